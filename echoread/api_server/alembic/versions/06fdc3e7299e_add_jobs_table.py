@@ -0,0 +1,46 @@
+"""add_jobs_table
+
+Revision ID: 06fdc3e7299e
+Revises: 1b81127b90e0
+Create Date: 2026-10-17 09:12:41.204113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '06fdc3e7299e'
+down_revision: Union[str, None] = '1b81127b90e0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # ### commands for jobs table (TTS job queue) ###
+    op.create_table('jobs',
+        sa.Column('id', sa.String(), nullable=False),
+        sa.Column('book_id', sa.String(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('locked_by', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['book_id'], ['books.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_jobs_id'), 'jobs', ['id'], unique=False)
+    op.create_index(op.f('ix_jobs_book_id'), 'jobs', ['book_id'], unique=False) # Index for FK
+    op.create_index('ix_jobs_status_created_at', 'jobs', ['status', 'created_at'], unique=False) # Queue polling
+    # ### end Alembic commands ###
+
+
+def downgrade() -> None:
+    op.drop_index('ix_jobs_status_created_at', table_name='jobs')
+    op.drop_index(op.f('ix_jobs_book_id'), table_name='jobs')
+    op.drop_index(op.f('ix_jobs_id'), table_name='jobs')
+    op.drop_table('jobs')
@@ -0,0 +1,27 @@
+"""add_books_version
+
+Revision ID: 45de0ce721f9
+Revises: 80a5b849af0e
+Create Date: 2026-10-17 18:12:40.902117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '45de0ce721f9'
+down_revision: Union[str, None] = '80a5b849af0e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Bumped on every change to a book or its audios; the ETag of the book's responses
+    op.add_column('books', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('books') as batch_op: # batch mode so the downgrade also works on SQLite
+        batch_op.drop_column('version')
@@ -0,0 +1,60 @@
+"""indexes_for_query_patterns
+
+Revision ID: 4d8a0f3b6e21
+Revises: 9c2e4b7d1a53
+Create Date: 2026-10-17 15:32:48.770124
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '4d8a0f3b6e21'
+down_revision: Union[str, None] = '9c2e4b7d1a53'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # books.author is in the model (and returned by every book route) but no earlier revision created it
+    op.add_column('books', sa.Column('author', sa.String(), nullable=True))
+
+    # GET /books and the ownership check behind every /books/{id}/... route filter on user_id;
+    # (created_at, id) also serves a newest-first library listing from the same index
+    op.create_index('ix_books_user_id_created_at', 'books', ['user_id', 'created_at', 'id'], unique=False)
+
+    # One audio per chapter. Older code could write a chapter twice: keep the most recent
+    # row and point plays of the dropped duplicates at it before enforcing uniqueness.
+    op.execute("""
+        CREATE TEMPORARY TABLE audio_duplicates AS
+        SELECT id, kept_id FROM (
+            SELECT id,
+                   FIRST_VALUE(id) OVER (
+                       PARTITION BY book_id, chapter_index ORDER BY created_at DESC, id DESC
+                   ) AS kept_id
+            FROM audios
+        ) AS ranked
+        WHERE id <> kept_id
+    """)
+    op.execute("""
+        UPDATE plays SET audio_id = (SELECT kept_id FROM audio_duplicates WHERE audio_duplicates.id = plays.audio_id)
+        WHERE audio_id IN (SELECT id FROM audio_duplicates)
+    """)
+    op.execute("DELETE FROM audios WHERE id IN (SELECT id FROM audio_duplicates)")
+    op.execute("DROP TABLE audio_duplicates")
+    op.create_index('ux_audios_book_id_chapter_index', 'audios', ['book_id', 'chapter_index'], unique=True)
+
+    # Both are leading prefixes of the unique indexes above / from the previous revision
+    op.drop_index('ix_audios_book_id', table_name='audios')
+    op.drop_index('ix_plays_user_id', table_name='plays')
+
+
+def downgrade() -> None:
+    op.create_index('ix_plays_user_id', 'plays', ['user_id'], unique=False)
+    op.create_index('ix_audios_book_id', 'audios', ['book_id'], unique=False)
+    op.drop_index('ux_audios_book_id_chapter_index', table_name='audios')
+    op.drop_index('ix_books_user_id_created_at', table_name='books')
+    with op.batch_alter_table('books') as batch_op: # batch mode so the downgrade also works on SQLite
+        batch_op.drop_column('author')
@@ -0,0 +1,27 @@
+"""add_jobs_first_chapter_at
+
+Revision ID: 611298a74e3d
+Revises: cecc7e7f0500
+Create Date: 2026-10-17 11:20:37.415902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '611298a74e3d'
+down_revision: Union[str, None] = 'cecc7e7f0500'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # When the first chapter of the job became playable (time-to-first-playable-chapter metric)
+    op.add_column('jobs', sa.Column('first_chapter_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('jobs') as batch_op: # batch mode so the downgrade also works on SQLite
+        batch_op.drop_column('first_chapter_at')
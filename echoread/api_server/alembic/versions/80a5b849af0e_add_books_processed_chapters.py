@@ -0,0 +1,32 @@
+"""add_books_processed_chapters
+
+Revision ID: 80a5b849af0e
+Revises: 4d8a0f3b6e21
+Create Date: 2026-10-17 17:05:12.384201
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '80a5b849af0e'
+down_revision: Union[str, None] = '4d8a0f3b6e21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Chapters with audio so far, maintained by the worker so status reads don't count audios
+    op.add_column('books', sa.Column('processed_chapters', sa.Integer(), nullable=False, server_default='0'))
+    op.execute("""
+        UPDATE books SET processed_chapters = (
+            SELECT count(*) FROM audios WHERE audios.book_id = books.id
+        )
+    """)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('books') as batch_op: # batch mode so the downgrade also works on SQLite
+        batch_op.drop_column('processed_chapters')
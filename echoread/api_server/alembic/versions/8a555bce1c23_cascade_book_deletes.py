@@ -0,0 +1,54 @@
+"""cascade_book_deletes
+
+Revision ID: 8a555bce1c23
+Revises: 45de0ce721f9
+Create Date: 2026-10-17 19:02:37.514826
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '8a555bce1c23'
+down_revision: Union[str, None] = '45de0ce721f9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (table, column, referred table): everything hanging off a book goes with it in one DELETE
+CASCADES = [
+    ('audios', 'book_id', 'books'),
+    ('plays', 'book_id', 'books'),
+    ('plays', 'audio_id', 'audios'),
+    ('jobs', 'book_id', 'books'),
+]
+
+# The earlier revisions created these foreign keys unnamed. On SQLite, batch mode names the
+# reflected ones with this convention so they can be dropped; PostgreSQL named them <table>_<column>_fkey.
+NAMING_CONVENTION = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+
+
+def _fk_name(table: str, column: str, referred: str) -> str:
+    if op.get_bind().dialect.name == 'sqlite':
+        return f'fk_{table}_{column}_{referred}'
+    return f'{table}_{column}_fkey'
+
+
+def _replace_foreign_keys(ondelete: Union[str, None]) -> None:
+    for table in dict.fromkeys(table for table, _, _ in CASCADES):
+        with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION) as batch_op:
+            for fk_table, column, referred in CASCADES:
+                if fk_table != table:
+                    continue
+                name = _fk_name(table, column, referred)
+                batch_op.drop_constraint(name, type_='foreignkey')
+                batch_op.create_foreign_key(name, referred, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade() -> None:
+    _replace_foreign_keys('CASCADE')
+
+
+def downgrade() -> None:
+    _replace_foreign_keys(None)
@@ -0,0 +1,49 @@
+"""unique_play_per_user_and_book
+
+Revision ID: 9c2e4b7d1a53
+Revises: 611298a74e3d
+Create Date: 2026-10-17 14:05:12.208311
+
+"""
+from typing import Sequence, Union
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '9c2e4b7d1a53'
+down_revision: Union[str, None] = '611298a74e3d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Copy of playback.PLAY_ID_NAMESPACE, so this migration doesn't change if the app code does
+PLAY_ID_NAMESPACE = uuid.UUID("5f1d0c52-8f55-4b0e-9a43-3f1c2b7f6a10")
+
+
+def upgrade() -> None:
+    # Plays used to be one row per (user, book, chapter); keep only the latest position per book
+    op.execute("""
+        DELETE FROM plays WHERE id NOT IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY user_id, book_id ORDER BY updated_at DESC, id DESC
+                ) AS position
+                FROM plays
+            ) AS ranked
+            WHERE position = 1
+        )
+    """)
+    # Switch the surviving rows to the deterministic ids that playback.play_id assigns
+    connection = op.get_bind()
+    plays = sa.table('plays', sa.column('id', sa.String), sa.column('user_id', sa.String), sa.column('book_id', sa.String))
+    for play_id, user_id, book_id in connection.execute(sa.select(plays.c.id, plays.c.user_id, plays.c.book_id)).all():
+        connection.execute(plays.update().where(plays.c.id == play_id).values(
+            id="play_" + str(uuid.uuid5(PLAY_ID_NAMESPACE, f"{user_id}/{book_id}"))
+        ))
+    op.create_index('ux_plays_user_id_book_id', 'plays', ['user_id', 'book_id'], unique=True)
+
+
+def downgrade() -> None:
+    # Deleted duplicate rows are not restored
+    op.drop_index('ux_plays_user_id_book_id', table_name='plays')
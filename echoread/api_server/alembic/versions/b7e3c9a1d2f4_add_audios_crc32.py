@@ -0,0 +1,27 @@
+"""add_audios_crc32
+
+Revision ID: b7e3c9a1d2f4
+Revises: 8a555bce1c23
+Create Date: 2026-10-17 21:40:12.518330
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e3c9a1d2f4'
+down_revision: Union[str, None] = '8a555bce1c23'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Set by the TTS worker when it writes a chapter; existing chapters get theirs on their first download
+    op.add_column('audios', sa.Column('crc32', sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('audios') as batch_op: # batch mode so the downgrade also works on SQLite
+        batch_op.drop_column('crc32')
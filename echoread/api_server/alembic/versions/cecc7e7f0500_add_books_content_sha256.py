@@ -0,0 +1,29 @@
+"""add_books_content_sha256
+
+Revision ID: cecc7e7f0500
+Revises: 06fdc3e7299e
+Create Date: 2026-10-17 10:02:15.883410
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'cecc7e7f0500'
+down_revision: Union[str, None] = '06fdc3e7299e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('books', sa.Column('content_sha256', sa.String(length=64), nullable=True))
+    # Existing rows have NULL hashes, which never collide in a unique index
+    op.create_index('ix_books_user_id_content_sha256', 'books', ['user_id', 'content_sha256'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_books_user_id_content_sha256', table_name='books')
+    with op.batch_alter_table('books') as batch_op: # batch mode so the downgrade also works on SQLite
+        batch_op.drop_column('content_sha256')
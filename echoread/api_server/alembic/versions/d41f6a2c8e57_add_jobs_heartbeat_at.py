@@ -0,0 +1,27 @@
+"""add_jobs_heartbeat_at
+
+Revision ID: d41f6a2c8e57
+Revises: b7e3c9a1d2f4
+Create Date: 2026-10-17 22:05:48.204716
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'd41f6a2c8e57'
+down_revision: Union[str, None] = 'b7e3c9a1d2f4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Running jobs without one are judged by started_at until their worker's next heartbeat
+    op.add_column('jobs', sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('jobs') as batch_op: # batch mode so the downgrade also works on SQLite
+        batch_op.drop_column('heartbeat_at')
@@ -0,0 +1,224 @@
+"""
+Audio duration from container headers, without decoding.
+
+* WAV: data chunk size / byte rate from the fmt chunk.
+* MP3: frame count from a Xing/Info or VBRI header in the first frame. Without
+  one, a stream whose sampled frames all share the first frame's bitrate is CBR
+  and its duration is the stream size / bitrate (what mutagen and ffprobe do);
+  otherwise frame headers are walked from one to the next (4 bytes read per
+  frame, no audio decoded).
+* Ogg (Vorbis, Opus): granule position of the last page / sample rate from the
+  identification header (Opus: 48 kHz, minus pre-skip).
+
+The format is detected from the leading bytes, not the file extension. Each
+probe reads a few KB at most, except the VBR MP3 frame walk, which touches one
+header per frame. That is cheap enough to run on every chapter the worker
+writes and to backfill thousands of rows in seconds (see backfill_durations.py).
+"""
+import mmap
+import os
+import struct
+from typing import BinaryIO, Optional, Tuple
+
+OGG_TAIL_BYTES = 65536 + 27 + 255 # Upper bound on one Ogg page: the last page starts within this tail
+MP3_CBR_SAMPLES = (0.25, 0.5, 0.75) # Points in the stream where a CBR stream's bitrate is checked
+MP3_RESYNC_BYTES = 16384 # How far from a sample point to look for two chained frames
+
+
+class ProbeError(ValueError):
+    '''Unsupported or corrupt audio file.'''
+
+
+def probe_duration(path: str) -> float:
+    '''Duration of the audio file at `path` in seconds; raises ProbeError if it can't be determined.'''
+    with open(path, "rb") as f:
+        head = f.read(12)
+        if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+            return _wav_duration(f)
+        if head[:4] == b"OggS":
+            return _ogg_duration(f)
+        if head[:3] == b"ID3" or _mp3_header(head[:4]) is not None:
+            return _mp3_duration(f)
+    raise ProbeError(f"{path}: unrecognized audio format")
+
+
+# --- WAV ---
+
+def _wav_duration(f: BinaryIO) -> float:
+    size = os.fstat(f.fileno()).st_size
+    f.seek(12)
+    byte_rate = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            raise ProbeError("WAV file has no data chunk")
+        chunk_id, chunk_size = struct.unpack("<4sI", chunk)
+        if chunk_id == b"fmt ":
+            fmt = f.read(chunk_size)
+            if len(fmt) < 16:
+                raise ProbeError("truncated WAV fmt chunk")
+            byte_rate = struct.unpack_from("<I", fmt, 8)[0]
+            if chunk_size % 2:
+                f.seek(1, os.SEEK_CUR)
+        elif chunk_id == b"data":
+            if not byte_rate:
+                raise ProbeError("WAV data chunk before fmt chunk")
+            # Streaming writers leave the size at 0 / 0xFFFFFFFF; the data then runs to the end of the file
+            available = size - f.tell()
+            data_size = chunk_size if 0 < chunk_size <= available else available
+            return data_size / byte_rate
+        else:
+            f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR) # Chunks are word-aligned
+
+
+# --- MP3 ---
+
+_MP3_BITRATES = { # kbps by (MPEG-1?, layer), index 1..14
+    (True, 1): (32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def _mp3_header(header: bytes) -> Optional[Tuple[int, int, int, int, int]]:
+    '''(frame length, samples per frame, sample rate, Xing offset, bitrate) of a valid frame header, else None.'''
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = (header[1] >> 3) & 3 # 3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5
+    layer = 4 - ((header[1] >> 1) & 3) # 1, 2 or 3 (4 = reserved)
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None # Reserved values, or free-format bitrate (no computable frame length)
+    mpeg1 = version == 3
+    bitrate = _MP3_BITRATES[(mpeg1, layer)][bitrate_index - 1] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+    padding = (header[2] >> 1) & 1
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate, 0, bitrate
+    samples = 1152 if mpeg1 or layer == 2 else 576
+    mono = header[3] >> 6 == 3
+    xing_offset = 4 + ((17 if mono else 32) if mpeg1 else (9 if mono else 17))
+    return samples // 8 * bitrate // sample_rate + padding, samples, sample_rate, xing_offset, bitrate
+
+
+def _id3v2_size(f: BinaryIO) -> int:
+    f.seek(0)
+    header = f.read(10)
+    if header[:3] != b"ID3" or len(header) < 10:
+        return 0
+    size = 0
+    for byte in header[6:10]: # Syncsafe integer: 7 bits per byte
+        size = (size << 7) | (byte & 0x7F)
+    return 10 + size + (10 if header[5] & 0x10 else 0)
+
+
+def _mp3_duration(f: BinaryIO) -> float:
+    start = _id3v2_size(f)
+    f.seek(start)
+    first = f.read(4 + 32 + 18) # Header plus wherever a Xing/Info or VBRI tag can sit
+    header = _mp3_header(first)
+    if header is None:
+        raise ProbeError("no MP3 frame after the ID3 tag")
+    _, samples, sample_rate, xing_offset, bitrate = header
+
+    tag = first[xing_offset:xing_offset + 4]
+    if tag in (b"Xing", b"Info"):
+        flags = struct.unpack_from(">I", first, xing_offset + 4)[0]
+        if flags & 1:
+            frames = struct.unpack_from(">I", first, xing_offset + 8)[0]
+            return frames * samples / sample_rate
+    if first[36:40] == b"VBRI":
+        frames = struct.unpack_from(">I", first, 36 + 14)[0]
+        return frames * samples / sample_rate
+
+    size = os.fstat(f.fileno()).st_size
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        end = size - 128 if size - 128 >= start and data[size - 128:size - 125] == b"TAG" else size
+        if _constant_bitrate(data, start, end, first[1:3]):
+            return (end - start) * 8 / bitrate
+        return _walk_mp3_frames(data, start, size, samples, sample_rate)
+
+
+def _chained_frame(data: mmap.mmap, position: int, limit: int) -> Optional[int]:
+    '''First frame at or after `position` whose successor frame header is valid too (guards against false syncs).'''
+    while 0 <= position < limit:
+        header = _mp3_header(data[position:position + 4])
+        if header is not None and _mp3_header(data[position + header[0]:position + header[0] + 4]) is not None:
+            return position
+        position = data.find(b"\xff", position + 1, limit)
+    return None
+
+
+def _constant_bitrate(data: mmap.mmap, start: int, end: int, first: bytes) -> bool:
+    '''True if frames at the start and at MP3_CBR_SAMPLES through the stream all match the first frame.'''
+    for point in (start, *(start + int((end - start) * fraction) for fraction in MP3_CBR_SAMPLES)):
+        position = _chained_frame(data, point, min(end - 4, point + MP3_RESYNC_BYTES))
+        if position is None:
+            return False
+        header = data[position + 1:position + 3]
+        # Same version and layer, bitrate and sample rate; padding may differ from frame to frame
+        if header[0] != first[0] or header[1] & 0xFC != first[1] & 0xFC:
+            return False
+    return True
+
+
+def _walk_mp3_frames(data: mmap.mmap, start: int, size: int, samples: int, sample_rate: int) -> float:
+    '''Count frames by hopping from one header to the next (no decoding).'''
+    frames = 0
+    position = start
+    lengths = {} # Frame length by header bytes: a stream uses only a handful of distinct headers
+    while position + 4 <= size:
+        header_bytes = data[position:position + 4]
+        length = lengths.get(header_bytes)
+        if length is None:
+            header = _mp3_header(header_bytes)
+            if header is None:
+                if header_bytes[:3] == b"TAG":
+                    break # ID3v1 trailer
+                position = data.find(b"\xff", position + 1) # Resynchronize on the next candidate sync byte
+                if position < 0:
+                    break
+                continue
+            length = lengths[header_bytes] = header[0]
+        frames += 1
+        position += length
+    if not frames:
+        raise ProbeError("no MP3 frames found")
+    return frames * samples / sample_rate
+
+
+# --- Ogg ---
+
+def _ogg_duration(f: BinaryIO) -> float:
+    f.seek(0)
+    page = f.read(27 + 255)
+    serial = struct.unpack_from("<I", page, 14)[0]
+    segments = page[26]
+    f.seek(27 + segments)
+    packet = f.read(32)
+    if packet.startswith(b"\x01vorbis"):
+        sample_rate, pre_skip = struct.unpack_from("<I", packet, 12)[0], 0
+    elif packet.startswith(b"OpusHead"):
+        sample_rate, pre_skip = 48000, struct.unpack_from("<H", packet, 10)[0] # Opus granules always count 48 kHz
+    else:
+        raise ProbeError("unsupported Ogg codec")
+    if not sample_rate:
+        raise ProbeError("Ogg identification header has no sample rate")
+
+    size = os.fstat(f.fileno()).st_size
+    f.seek(max(0, size - OGG_TAIL_BYTES))
+    tail = f.read()
+    position = len(tail)
+    while True: # Last page of the first logical stream with a granule position
+        position = tail.rfind(b"OggS", 0, position)
+        if position < 0:
+            raise ProbeError("no final Ogg page found")
+        if len(tail) - position >= 27:
+            granule, page_serial = struct.unpack_from("<qI", tail, position + 6)
+            if page_serial == serial and granule >= 0:
+                return max(0, granule - pre_skip) / sample_rate
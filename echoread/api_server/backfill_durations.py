@@ -0,0 +1,86 @@
+"""
+Backfill `audios.duration` from the audio files, reading headers only (audio_probe.py).
+
+Rows are walked in primary-key batches. Each batch is probed in parallel on a
+thread pool (probing is a few small reads per file, so it is I/O-bound) and
+written back with one executemany UPDATE per batch. The same transaction bumps the
+version of every book it touched, so cached responses and ETags that still show
+the old durations become stale (http_cache.py).
+
+    python -m echoread.api_server.backfill_durations --batch-size 1000 --workers 16
+    python -m echoread.api_server.backfill_durations --all   # Re-probe rows that already have a duration
+"""
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from echoread.api_server import audio_probe, models
+
+logger = logging.getLogger("echoread.backfill_durations")
+
+
+def _probe(path: Optional[str]) -> Tuple[Optional[float], Optional[str]]:
+    '''(duration, error) for one file; errors are reported, not raised, so one bad file doesn't stop a batch.'''
+    if not path:
+        return None, "no audio_path"
+    try:
+        return audio_probe.probe_duration(path), None
+    except (OSError, audio_probe.ProbeError) as exc:
+        return None, str(exc)
+
+
+def backfill(session_factory: Callable[[], Session], batch_size: int = 1000, workers: int = 16,
+             only_missing: bool = True) -> Dict[str, int]:
+    '''Probe and store durations; returns counts of updated and failed rows.'''
+    stats = {"updated": 0, "failed": 0}
+    after = "" # Keyset on the primary key, so rows updated in earlier batches never shift the next one
+    with ThreadPoolExecutor(max_workers=workers) as pool, session_factory() as db:
+        while True:
+            query = select(models.Audio.id, models.Audio.audio_path, models.Audio.book_id).where(models.Audio.id > after)
+            if only_missing:
+                query = query.where(models.Audio.duration.is_(None))
+            rows = db.execute(query.order_by(models.Audio.id).limit(batch_size)).all()
+            if not rows:
+                break
+            after = rows[-1].id
+
+            updates, book_ids = [], set()
+            for (audio_id, path, book_id), (duration, error) in zip(rows, pool.map(_probe, [row.audio_path for row in rows])):
+                if error is not None:
+                    logger.warning("Audio %s: %s", audio_id, error)
+                    stats["failed"] += 1
+                else:
+                    updates.append({"id": audio_id, "duration": duration})
+                    book_ids.add(book_id)
+            if updates:
+                db.execute(update(models.Audio), updates) # ORM bulk UPDATE by primary key (executemany)
+                # Bulk UPDATEs skip the ORM hook that bumps versions (models.py)
+                db.execute(update(models.Book).where(models.Book.id.in_(book_ids))
+                           .values(version=models.Book.version + 1).execution_options(synchronize_session=False))
+            db.commit()
+            stats["updated"] += len(updates)
+            logger.info("Backfilled %d duration(s) so far (%d failed)", stats["updated"], stats["failed"])
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows per query / UPDATE")
+    parser.add_argument("--workers", type=int, default=16, help="Files probed concurrently")
+    parser.add_argument("--all", action="store_true", help="Re-probe rows that already have a duration")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    from echoread.api_server.database import SessionLocal
+    started = time.monotonic()
+    stats = backfill(SessionLocal, args.batch_size, args.workers, only_missing=not args.all)
+    logger.info("Done: %d updated, %d failed in %.1fs", stats["updated"], stats["failed"], time.monotonic() - started)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Micro-batching of sentences into single TTS model calls.
+
+On CPU-only nodes most of a per-sentence model call is fixed overhead, so the
+worker does not call the engine per sentence or per chapter. Every chapter of
+every in-flight book is split into sentences and handed to one
+`BatchScheduler`, which groups sentences into batches of up to `max_batch_size`
+(waiting at most `max_wait` seconds for a batch to fill), runs each batch as a
+single `synthesize_batch` call in the process pool, and routes every output back
+to its chapter. A chapter's WAV is written once all of its sentences are back.
+
+At most `max_in_flight` batches are queued on the pool at a time; while all of
+them are busy, new sentences keep accumulating, so batches grow under load and
+stay small (low latency) when the worker is idle.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import List, Optional
+
+from echoread.api_server import tts
+
+
+def synthesize_batch(engine_name: str, texts: List[str]) -> List[bytes]:
+    '''Runs inside a pool process: one model call for the whole batch.'''
+    return tts.get_engine(engine_name).synthesize_batch(texts)
+
+
+class BatchScheduler:
+    def __init__(self, executor: Executor, engine_name: str, max_batch_size: int = 16,
+                 max_wait: float = 0.02, max_in_flight: int = 1):
+        self.executor = executor
+        self.engine_name = engine_name
+        self.sample_rate = tts.engine_class(engine_name).sample_rate
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.batches = 0
+        self.sentences = 0
+        self._queue = deque() # (enqueued_at, text, future)
+        self._cond = threading.Condition()
+        self._slots = threading.Semaphore(max(1, max_in_flight))
+        self._closed = False
+        # Chapter files are written off the dispatcher thread
+        self._writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tts-writer")
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="tts-batcher", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, text: str) -> "Future[bytes]":
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BatchScheduler is closed")
+            self._queue.append((time.monotonic(), text, future))
+            self._cond.notify()
+        return future
+
+    def synthesize_chapter(self, sentences: List[str], out_path: str) -> "Future[float]":
+        '''Queue every sentence of a chapter; the returned future resolves to the duration once the WAV is written.'''
+        chapter_future = Future()
+        parts = [self.submit(sentence) for sentence in sentences]
+        remaining = [len(parts)]
+        lock = threading.Lock()
+
+        def on_part_done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            self._writer.submit(self._write_chapter, parts, out_path, chapter_future)
+
+        if not parts:
+            self._writer.submit(self._write_chapter, parts, out_path, chapter_future)
+        for part in parts:
+            part.add_done_callback(on_part_done)
+        return chapter_future
+
+    def close(self) -> None:
+        '''Flush queued sentences, then stop the dispatcher.'''
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._dispatcher.join()
+        self._writer.shutdown(wait=True)
+
+    def _write_chapter(self, parts: List[Future], out_path: str, chapter_future: Future) -> None:
+        if not chapter_future.set_running_or_notify_cancel():
+            return # The job gave up on this chapter
+        try:
+            pcm = b"".join(part.result() for part in parts)
+            chapter_future.set_result(tts.write_wav(out_path, pcm, self.sample_rate))
+        except Exception as exc:
+            chapter_future.set_exception(exc)
+
+    def _next_batch(self) -> Optional[list]:
+        with self._cond:
+            while not self._queue:
+                if self._closed:
+                    return None
+                self._cond.wait()
+            # Give the batch until max_wait after its oldest sentence arrived to fill up
+            deadline = self._queue[0][0] + self.max_wait
+            while len(self._queue) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            count = min(len(self._queue), self.max_batch_size)
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            self._slots.acquire() # Wait for pool capacity first, so sentences pile up into bigger batches
+            batch = self._next_batch()
+            if batch is None:
+                self._slots.release()
+                return
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                self._slots.release()
+                continue
+            self.batches += 1
+            self.sentences += len(batch)
+            try:
+                result = self.executor.submit(synthesize_batch, self.engine_name, [text for _, text, _ in batch])
+            except Exception as exc: # Pool shut down or broken
+                self._slots.release()
+                for _, _, future in batch:
+                    future.set_exception(exc)
+                continue
+            result.add_done_callback(lambda done, batch=batch: self._deliver(done, batch))
+
+    def _deliver(self, done: Future, batch: list) -> None:
+        self._slots.release()
+        error = done.exception()
+        outputs = None if error else done.result()
+        for i, (_, _, future) in enumerate(batch):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(outputs[i])
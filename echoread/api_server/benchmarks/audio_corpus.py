@@ -0,0 +1,92 @@
+"""
+Synthetic audio files for benchmarks and tests of audio_probe.
+
+Only the container structure is real: headers, frame headers and Ogg pages are
+laid out as encoders write them, and the payload is zeros. Files whose probe
+never reads the payload (WAV, MP3 with a Xing tag, Ogg) are extended with
+truncate(), so long chapters cost no disk space.
+
+    write_mp3(path, seconds=600, xing=False, vbr=True)  # Probed by walking every frame header
+"""
+import os
+import struct
+from typing import Optional
+
+MP3_SAMPLE_RATE = 44100
+MP3_FRAME_SAMPLES = 1152
+MP3_BITRATE_INDEX = {128000: 9, 160000: 10} # MPEG-1 Layer III
+
+
+def _mp3_frame(bitrate: int, padding: bool, payload: bytes = b"") -> bytes:
+    '''One MPEG-1 Layer III frame (44.1 kHz, stereo) with a zero payload.'''
+    header = bytes([0xFF, 0xFB, MP3_BITRATE_INDEX[bitrate] << 4 | padding << 1, 0x00])
+    length = 144 * bitrate // MP3_SAMPLE_RATE + padding
+    return (header + payload).ljust(length, b"\0")
+
+
+def write_wav(path: str, seconds: float, sample_rate: int = 24000, extra_chunk: bool = False) -> None:
+    data_size = int(seconds * sample_rate) * 2
+    fmt = struct.pack("<HHIIHH", 1, 1, sample_rate, sample_rate * 2, 2, 16)
+    chunks = b"fmt " + struct.pack("<I", len(fmt)) + fmt
+    if extra_chunk:
+        info = b"INFOISFT\x05\x00\x00\x00test\x00\x00" # Odd-sized sub-chunk, padded
+        chunks += b"LIST" + struct.pack("<I", len(info)) + info
+    chunks += b"data" + struct.pack("<I", data_size)
+    with open(path, "wb") as out:
+        out.write(b"RIFF" + struct.pack("<I", 4 + len(chunks) + data_size) + b"WAVE" + chunks)
+        out.truncate(out.tell() + data_size)
+
+
+def mp3_frames(seconds: float) -> int:
+    return round(seconds * MP3_SAMPLE_RATE / MP3_FRAME_SAMPLES)
+
+
+def write_mp3(path: str, seconds: float, xing: bool = True, id3: bool = True, vbr: bool = False) -> None:
+    '''
+    128 kbps CBR, padded the way encoders do to hit the nominal bitrate on average;
+    `vbr` alternates 128 and 160 kbps frames so only a frame walk gets the duration right.
+    '''
+    frames = mp3_frames(seconds)
+    with open(path, "wb") as out:
+        if id3:
+            out.write(b"ID3\x04\x00\x00" + bytes([0, 0, 8, 0]) + b"\0" * 1024) # 1024-byte tag, syncsafe size
+        if xing:
+            # Xing tag in the first (silent) frame: flags = frame count present
+            out.write(_mp3_frame(128000, False, b"\0" * 32 + b"Xing" + struct.pack(">II", 1, frames)))
+            out.truncate(out.tell() + frames * 418)
+            return
+        plain = {(bitrate, padding): _mp3_frame(bitrate, padding) for bitrate in MP3_BITRATE_INDEX
+                 for padding in (False, True)}
+        body, remainder = [], 0
+        for i in range(frames):
+            bitrate = 160000 if vbr and i % 2 else 128000
+            remainder += 144 * bitrate % MP3_SAMPLE_RATE
+            padding = remainder >= MP3_SAMPLE_RATE
+            remainder -= MP3_SAMPLE_RATE if padding else 0
+            body.append(plain[bitrate, padding])
+        out.write(b"".join(body))
+        if id3:
+            out.write(b"TAG" + b"\0" * 125) # ID3v1 trailer
+
+
+def _ogg_page(granule: int, serial: int, sequence: int, body: bytes, header_type: int = 0) -> bytes:
+    lacing = [255] * (len(body) // 255) + [len(body) % 255]
+    return (b"OggS" + struct.pack("<BBqIIIB", 0, header_type, granule, serial, sequence, 0, len(lacing))
+            + bytes(lacing) + body)
+
+
+def write_ogg(path: str, seconds: float, codec: str = "opus", sample_rate: Optional[int] = None) -> None:
+    serial = 0x5EC7
+    if codec == "opus":
+        pre_skip = 312
+        identification = b"OpusHead" + struct.pack("<BBHIhB", 1, 1, pre_skip, sample_rate or 48000, 0, 0)
+        final_granule = int(seconds * 48000) + pre_skip
+    else:
+        rate = sample_rate or 44100
+        identification = b"\x01vorbis" + struct.pack("<IBIiiiBB", 0, 1, rate, 0, 0, 0, 0xB8, 1)
+        final_granule = int(seconds * rate)
+    with open(path, "wb") as out:
+        out.write(_ogg_page(0, serial, 0, identification, header_type=2))
+        out.truncate(out.tell() + 4 * 65536) # Stand-in for the audio pages in between
+        out.seek(0, os.SEEK_END)
+        out.write(_ogg_page(final_granule, serial, 99, b"\0" * 400, header_type=4))
@@ -0,0 +1,82 @@
+"""
+Benchmark of per-request authentication overhead.
+
+Compares an unauthenticated route (GET /) with GET /users/me, which does nothing
+but resolve the caller, with the per-process user cache enabled (zero user
+lookups per request) and disabled (one lookup per request). JWT verification
+alone is also timed in-process.
+
+    python -m echoread.api_server.benchmarks.bench_auth --requests 2000 --clients 8
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from echoread.api_server import models
+from echoread.api_server.benchmarks.common import (
+    BENCH_AUTH_HEADERS, BENCH_USER_EMAIL, BENCH_USER_ID, live_server, percentile, sqlite_database, summarize,
+)
+from echoread.api_server.security import decode_access_token, user_cache
+
+
+async def run_clients(base_url: str, path: str, headers: dict, clients: int, requests: int):
+    latencies = []
+
+    async def worker(client):
+        for _ in range(requests // clients):
+            start = time.perf_counter()
+            response = await client.get(path, headers=headers)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=httpx.Limits(max_connections=clients)) as client:
+        await client.get(path, headers=headers) # Warm up (and fill the cache when enabled)
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+    return latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=8)
+    args = parser.parse_args()
+
+    token = BENCH_AUTH_HEADERS["Authorization"].split(" ", 1)[1]
+    iterations = 10000
+    start = time.perf_counter()
+    for _ in range(iterations):
+        decode_access_token(token)
+    print(f"JWT verification: {(time.perf_counter() - start) / iterations * 1e6:.1f}us per token")
+
+    with sqlite_database() as session_factory:
+        db = session_factory()
+        db.add(models.User(id=BENCH_USER_ID, email=BENCH_USER_EMAIL, name="Bench"))
+        db.commit()
+        db.close()
+
+        with live_server() as base_url:
+            results = {}
+            ttl = user_cache.ttl
+            for label, path, headers, cache_ttl in (
+                ("GET / (no auth)", "/", {}, ttl),
+                ("GET /users/me (cached)", "/users/me", BENCH_AUTH_HEADERS, ttl),
+                ("GET /users/me (no cache)", "/users/me", BENCH_AUTH_HEADERS, 0),
+            ):
+                user_cache.ttl = cache_ttl
+                user_cache.clear()
+                latencies, elapsed = asyncio.run(run_clients(base_url, path, headers, args.clients, args.requests))
+                results[label] = latencies
+                print(summarize(label, latencies, elapsed))
+            user_cache.ttl = ttl
+
+    baseline = percentile(results["GET / (no auth)"], 50)
+    for label in ("GET /users/me (cached)", "GET /users/me (no cache)"):
+        print(f"auth overhead, {label}: {(percentile(results[label], 50) - baseline) * 1000:+.2f}ms at p50")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark for cross-chapter micro-batching (batching.py).
+
+Synthesizes the chapters of several books concurrently through a process pool,
+once per (batch size, max wait) setting, and reports sentences per second and
+chapter latency (submit to WAV written). The local engine stands in for the
+model; `--call-overhead` sets its fixed cost per model call, which is what
+batching amortizes, so set it to what one call costs on the target box.
+
+    python -m echoread.api_server.benchmarks.bench_batching --batch-sizes 1 4 16 --waits-ms 0 20
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from echoread.api_server import config
+from echoread.api_server.batching import BatchScheduler
+from echoread.api_server.benchmarks.common import percentile
+from echoread.api_server.benchmarks.epub_corpus import synthetic_chapters
+from echoread.api_server.epub import SENTENCE_END
+
+
+def chapter_sentences(count, paragraphs):
+    chapters = []
+    for title, body in synthetic_chapters(count, paragraphs=paragraphs):
+        chapters.append([title] + [sentence for paragraph in body for sentence in SENTENCE_END.split(paragraph)])
+    return chapters
+
+
+def run(executor, processes, chapters, batch_size, wait, out_dir):
+    scheduler = BatchScheduler(executor, "local", max_batch_size=batch_size, max_wait=wait,
+                               max_in_flight=2 * processes)
+    latencies = []
+    started = time.perf_counter()
+    pending = []
+    for i, sentences in enumerate(chapters):
+        submitted = time.perf_counter()
+        future = scheduler.synthesize_chapter(sentences, os.path.join(out_dir, f"chapter_{i}.wav"))
+        future.add_done_callback(lambda _, submitted=submitted: latencies.append(time.perf_counter() - submitted))
+        pending.append(future)
+    for future in pending:
+        future.result()
+    elapsed = time.perf_counter() - started
+    scheduler.close()
+    return scheduler, elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=4, help="Books synthesized concurrently")
+    parser.add_argument("--chapters", type=int, default=8, help="Chapters per book")
+    parser.add_argument("--paragraphs", type=int, default=4, help="Paragraphs per chapter")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--call-overhead", type=float, default=0.05, help="Seconds of fixed cost per model call")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--waits-ms", type=float, nargs="+", default=[0, 20, 50])
+    args = parser.parse_args()
+
+    # Forked pool processes inherit the config module, spawned ones read the environment
+    config.TTS_LOCAL_CALL_OVERHEAD = args.call_overhead
+    os.environ["TTS_LOCAL_CALL_OVERHEAD"] = str(args.call_overhead)
+    chapters = chapter_sentences(args.chapters, args.paragraphs) * args.books
+    total_sentences = sum(len(sentences) for sentences in chapters)
+    print(f"{len(chapters)} chapters, {total_sentences} sentences, {args.processes} processes, "
+          f"{args.call_overhead * 1000:.0f}ms per model call")
+    print(f"{'batch':>6} {'wait ms':>8} {'calls':>6} {'avg batch':>10} {'sent/s':>8} {'p50 chapter':>12} {'p95 chapter':>12}")
+    with ProcessPoolExecutor(max_workers=args.processes) as executor, tempfile.TemporaryDirectory() as tmp:
+        for batch_size in args.batch_sizes:
+            for wait_ms in args.waits_ms:
+                scheduler, elapsed, latencies = run(executor, args.processes, chapters, batch_size,
+                                                    wait_ms / 1000, tmp)
+                print(f"{batch_size:>6} {wait_ms:>8.0f} {scheduler.batches:>6} "
+                      f"{scheduler.sentences / scheduler.batches:>10.1f} {total_sentences / elapsed:>8.0f} "
+                      f"{percentile(latencies, 50) * 1000:>10.0f}ms {percentile(latencies, 95) * 1000:>10.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
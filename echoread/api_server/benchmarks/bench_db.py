@@ -0,0 +1,99 @@
+"""
+Load test for the database-backed API routes (GET /books, GET /books/{id},
+POST /plays, GET /play/{book_id}).
+
+Seeds a library for the bench user, then runs concurrent clients that mix
+library browsing with playback-position saves, and reports latency and
+requests per second per route. Run it before and after a change to the data
+layer: with synchronous sessions every query blocks the event loop, so p95 and
+rps degrade quickly as `--clients` grows.
+
+    python -m echoread.api_server.benchmarks.bench_db --books 200 --clients 8 32 64
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+
+from echoread.api_server import models
+from echoread.api_server.benchmarks.common import (
+    BENCH_AUTH_HEADERS, BENCH_USER_EMAIL, BENCH_USER_ID, live_server, sqlite_database, summarize,
+)
+
+
+def seed(session_factory, books: int, chapters: int) -> list:
+    db = session_factory()
+    user = models.User(id=BENCH_USER_ID, email=BENCH_USER_EMAIL, name="Bench")
+    db.add(user)
+    library = []
+    for b in range(books):
+        book = models.Book(id=str(uuid.uuid4()), user_id=user.id, title=f"Bench Book {b}", author="Bench Author",
+                           status="complete", chapter_count=chapters)
+        audios = [models.Audio(id=str(uuid.uuid4()), book_id=book.id, chapter_index=i,
+                               audio_path=f"/tmp/{book.id}/chapter_{i}.wav", duration=60.0)
+                  for i in range(1, chapters + 1)]
+        db.add(book)
+        db.add_all(audios)
+        library.append((book.id, [audio.id for audio in audios]))
+    db.commit()
+    db.close()
+    return library
+
+
+async def run_clients(base_url: str, library: list, clients: int, requests: int):
+    latencies = defaultdict(list)
+
+    async def call(client, label, method, url, **kwargs):
+        start = time.perf_counter()
+        response = await client.request(method, url, headers=BENCH_AUTH_HEADERS, **kwargs)
+        response.raise_for_status()
+        latencies[label].append(time.perf_counter() - start)
+
+    async def listener(client):
+        for _ in range(requests):
+            book_id, audio_ids = random.choice(library)
+            roll = random.random()
+            if roll < 0.25:
+                await call(client, "GET /books", "GET", "/books")
+            elif roll < 0.5:
+                await call(client, "GET /books/{id}", "GET", f"/books/{book_id}")
+            elif roll < 0.8:
+                await call(client, "POST /plays", "POST", "/plays", json={
+                    "book_id": book_id, "audio_id": random.choice(audio_ids),
+                    "last_timestamp": random.uniform(0, 60)})
+            else:
+                await call(client, "GET /play/{book_id}", "GET", f"/play/{book_id}")
+
+    limits = httpx.Limits(max_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(listener(client) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+    return latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=100)
+    parser.add_argument("--chapters", type=int, default=20, help="Chapters per book")
+    parser.add_argument("--clients", type=int, nargs="+", default=[8, 32, 64], help="Concurrent clients")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per client")
+    args = parser.parse_args()
+
+    with sqlite_database() as session_factory:
+        library = seed(session_factory, args.books, args.chapters)
+        with live_server() as base_url:
+            for clients in args.clients:
+                latencies, elapsed = asyncio.run(run_clients(base_url, library, clients, args.requests))
+                total = sum(len(values) for values in latencies.values())
+                print(f"--- {clients} clients: {total / elapsed:.1f} requests/s overall")
+                for label in sorted(latencies):
+                    print(summarize(label, latencies[label], elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Book deletion cost as books grow: ORM cascade vs one DELETE with ON DELETE CASCADE.
+
+For each --chapters size, seeds --books books with that many chapters (one file
+each on disk) and as many plays (one per listener), then deletes them:
+
+* orm: the previous implementation. The session loads the book's audios, their
+  plays and its jobs, then deletes them row by row (files stay on disk).
+* cascade: what DELETE /books/{id} does now. One DELETE ... RETURNING, the
+  database cascades, and the book directory is renamed into the trash.
+
+Then reports how long reaper.reap() takes to empty the trash in batches, which
+happens in the background and not in the request.
+
+    python -m echoread.api_server.benchmarks.bench_delete --chapters 10 100 1000 --books 5
+"""
+import argparse
+import os
+import tempfile
+import time
+import uuid
+
+from sqlalchemy import delete
+from sqlalchemy.orm import selectinload
+
+from echoread.api_server import config, models, reaper, storage
+from echoread.api_server.benchmarks.common import BENCH_USER_EMAIL, BENCH_USER_ID, percentile, sqlite_database
+
+
+def seed_listeners(session_factory, count: int) -> list:
+    with session_factory() as db:
+        db.add_all(models.User(id=f"listener-{i}", email=f"listener-{i}@example.com") for i in range(count))
+        db.commit()
+    return [f"listener-{i}" for i in range(count)]
+
+
+def seed(session_factory, books: int, chapters: int, listeners: list) -> list:
+    '''`books` books of `chapters` chapters, each with a play by the first `chapters` listeners.'''
+    book_ids = []
+    with session_factory() as db:
+        for _ in range(books):
+            book_id = str(uuid.uuid4())
+            directory = storage.book_dir(BENCH_USER_ID, book_id)
+            os.makedirs(directory)
+            audios = []
+            for i in range(1, chapters + 1):
+                path = os.path.join(directory, f"chapter_{i}.wav")
+                with open(path, "wb") as out:
+                    out.write(b"\0" * 4096)
+                audios.append(models.Audio(id=str(uuid.uuid4()), book_id=book_id, chapter_index=i, audio_path=path))
+            db.add(models.Book(id=book_id, user_id=BENCH_USER_ID, title="Bench", status="complete",
+                               chapter_count=chapters, processed_chapters=chapters))
+            db.add_all(audios)
+            db.add(models.Job(book_id=book_id, status="done"))
+            db.add_all(models.Play(user_id=listener, book_id=book_id, audio_id=audio.id, last_timestamp=1.0)
+                       for listener, audio in zip(listeners, audios))
+            book_ids.append(book_id)
+        db.commit()
+    return book_ids
+
+
+def delete_orm(session_factory, book_id: str) -> None:
+    with session_factory() as db:
+        book = db.get(models.Book, book_id, options=[
+            selectinload(models.Book.audios).selectinload(models.Audio.plays), selectinload(models.Book.jobs),
+        ])
+        db.delete(book)
+        db.commit()
+
+
+def delete_cascade(session_factory, book_id: str) -> None:
+    with session_factory() as db:
+        epub_path = db.execute(
+            delete(models.Book).where(models.Book.id == book_id, models.Book.user_id == BENCH_USER_ID)
+            .returning(models.Book.epub_path).execution_options(synchronize_session=False)
+        ).scalar_one()
+        db.commit()
+    storage.trash_book(BENCH_USER_ID, book_id, epub_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chapters", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--books", type=int, default=5, help="Books deleted per size and mode")
+    parser.add_argument("--batch-size", type=int, default=config.REAPER_BATCH_SIZE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as storage_root, sqlite_database() as session_factory:
+        config.STORAGE_ROOT = storage_root
+        with session_factory() as db:
+            db.add(models.User(id=BENCH_USER_ID, email=BENCH_USER_EMAIL))
+            db.commit()
+        listeners = seed_listeners(session_factory, max(args.chapters))
+        for chapters in args.chapters:
+            for label, delete_book in (("orm", delete_orm), ("cascade", delete_cascade)):
+                latencies = []
+                for book_id in seed(session_factory, args.books, chapters, listeners):
+                    started = time.perf_counter()
+                    delete_book(session_factory, book_id)
+                    latencies.append(time.perf_counter() - started)
+                print(f"{chapters:>5} chapters+plays  {label:<8} p50={percentile(latencies, 50) * 1000:8.2f}ms"
+                      f" max={max(latencies) * 1000:8.2f}ms")
+            started, batches = time.perf_counter(), 0
+            while reaper.reap(args.batch_size):
+                batches += 1
+            print(f"{chapters:>5} chapters+plays  reaper   {time.perf_counter() - started:8.3f}s for "
+                  f"{args.books * chapters} files in {batches} batch(es), in the background")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Whole-book download (GET /books/{id}/download, book_zip.py) vs fetching every
+chapter on its own (GET /books/{id}/audios/{audio_id}, then the signed URL).
+
+Writes a book of --chapters files of --chapter-mb each, serves it through the
+real app and reports wall time and throughput for:
+
+* zip (cold): first download, chapter CRCs computed on the way;
+* zip (warm): CRCs cached;
+* zip (resumed): the connection drops halfway and the client resumes with
+  Range + If-Range;
+* per-file: one URL request plus one file request per chapter, sequentially
+  and with --parallel concurrent fetches.
+
+Peak RSS of the process (server and client share it) is printed after the zip
+runs, to show the download is streamed rather than assembled in memory.
+
+    python -m echoread.api_server.benchmarks.bench_download --chapters 60 --chapter-mb 8 --parallel 4
+"""
+import argparse
+import asyncio
+import os
+import resource
+import tempfile
+import time
+import uuid
+
+import httpx
+
+from echoread.api_server import book_zip, config, models, storage
+from echoread.api_server.benchmarks.common import (
+    BENCH_AUTH_HEADERS, BENCH_USER_EMAIL, BENCH_USER_ID, live_server, sqlite_database,
+)
+
+READ_CHUNK = 256 * 1024
+
+
+def seed(session_factory, chapters: int, chapter_mb: float) -> str:
+    book_id = str(uuid.uuid4())
+    directory = storage.book_dir(BENCH_USER_ID, book_id)
+    os.makedirs(directory)
+    block = os.urandom(1024 * 1024)
+    with session_factory() as db:
+        db.add(models.User(id=BENCH_USER_ID, email=BENCH_USER_EMAIL))
+        db.add(models.Book(id=book_id, user_id=BENCH_USER_ID, title="Bench Book", status="complete",
+                           chapter_count=chapters, processed_chapters=chapters))
+        for index in range(1, chapters + 1):
+            path = os.path.join(directory, f"chapter_{index}.wav")
+            with open(path, "wb") as out:
+                for _ in range(int(chapter_mb)):
+                    out.write(block)
+                out.write(os.urandom(index)) # Distinct sizes and contents
+            db.add(models.Audio(id=str(uuid.uuid4()), book_id=book_id, chapter_index=index, audio_path=path,
+                                duration=60.0))
+        db.commit()
+    return book_id
+
+
+async def fetch(client: httpx.AsyncClient, url: str, headers: dict = None, stop_after: int = None) -> int:
+    received = 0
+    async with client.stream("GET", url, headers=headers) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_raw(READ_CHUNK):
+            received += len(chunk)
+            if stop_after is not None and received >= stop_after:
+                break # Simulated dropped connection
+    return received
+
+
+async def download_zip(client: httpx.AsyncClient, url: str) -> int:
+    return await fetch(client, url, BENCH_AUTH_HEADERS)
+
+
+async def download_resumed(client: httpx.AsyncClient, url: str) -> int:
+    head = await client.head(url, headers=BENCH_AUTH_HEADERS)
+    size, etag = int(head.headers["content-length"]), head.headers["etag"]
+    received = await fetch(client, url, BENCH_AUTH_HEADERS, stop_after=size // 2)
+    rest = await fetch(client, url, {**BENCH_AUTH_HEADERS, "Range": f"bytes={received}-", "If-Range": etag})
+    return received + rest
+
+
+async def download_per_file(client: httpx.AsyncClient, book_id: str, parallel: int) -> int:
+    audios = (await client.get(f"/books/{book_id}/audios", headers=BENCH_AUTH_HEADERS)).json()
+    semaphore = asyncio.Semaphore(parallel)
+
+    async def chapter(audio_id: str) -> int:
+        async with semaphore:
+            url = (await client.get(f"/books/{book_id}/audios/{audio_id}", headers=BENCH_AUTH_HEADERS)).json()["url"]
+            return await fetch(client, url[len(config.MEDIA_BASE_URL):])
+
+    return sum(await asyncio.gather(*(chapter(audio["audio_id"]) for audio in audios)))
+
+
+async def run(base_url: str, book_id: str, args: argparse.Namespace) -> None:
+    url = f"/books/{book_id}/download"
+    # Idle connections are dropped before uvicorn's 5s keep-alive timeout can close them under a request
+    limits = httpx.Limits(keepalive_expiry=1)
+    async with httpx.AsyncClient(base_url=base_url, timeout=3600, limits=limits) as client:
+        runs = [
+            ("zip (cold)", lambda: download_zip(client, url)),
+            ("zip (warm)", lambda: download_zip(client, url)),
+            ("zip (resumed)", lambda: download_resumed(client, url)),
+            ("per-file x1", lambda: download_per_file(client, book_id, 1)),
+            (f"per-file x{args.parallel}", lambda: download_per_file(client, book_id, args.parallel)),
+        ]
+        for label, download in runs:
+            started = time.perf_counter()
+            received = await download()
+            elapsed = time.perf_counter() - started
+            print(f"{label:<16} {elapsed:7.2f}s  {received / 1e6:8.1f} MB  {received / elapsed / 1e6:7.1f} MB/s")
+            if label == "zip (resumed)":
+                print(f"peak RSS after zip runs: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chapters", type=int, default=60)
+    parser.add_argument("--chapter-mb", type=float, default=8)
+    parser.add_argument("--parallel", type=int, default=4, help="Concurrent chapter fetches in the per-file run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as storage_root, sqlite_database() as session_factory:
+        config.STORAGE_ROOT = storage_root
+        book_id = seed(session_factory, args.chapters, args.chapter_mb)
+        book_zip.crc_cache.clear()
+        print(f"book: {args.chapters} chapters x {args.chapter_mb:g} MB")
+        with live_server() as base_url:
+            asyncio.run(run(base_url, book_id, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark for the lazy EPUB reader (epub.py) over synthetic books of increasing size.
+
+For each book it reports time to metadata, time to the first chapter, total parse
+time and peak Python memory, next to an eager baseline that decompresses every
+chapter document up front (what "load the whole book" parsing does).
+
+    python -m echoread.api_server.benchmarks.bench_epub --chapters 10 100 1000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+from echoread.api_server.benchmarks.epub_corpus import make_epub, synthetic_chapters
+from echoread.api_server.epub import EpubReader, _SentenceExtractor
+
+
+def measure(fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn(started)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def lazy_parse(path):
+    def run(started):
+        with EpubReader(path) as reader:
+            metadata_at = time.perf_counter() - started
+            first_chapter_at, sentences = None, 0
+            for chapter in reader.iter_chapters():
+                if first_chapter_at is None:
+                    first_chapter_at = time.perf_counter() - started
+                sentences += len(chapter.sentences)
+        return metadata_at, first_chapter_at, sentences
+    return measure(run)
+
+
+def eager_parse(path):
+    def run(started):
+        with EpubReader(path) as reader, zipfile.ZipFile(path) as archive:
+            documents = [archive.read(href).decode("utf-8") for href in reader.spine]
+        chapters = []
+        for document in documents:
+            extractor = _SentenceExtractor()
+            extractor.feed(document)
+            extractor.close()
+            chapters.append(extractor.sentences)
+        first_chapter_at = time.perf_counter() - started
+        return None, first_chapter_at, sum(len(sentences) for sentences in chapters)
+    return measure(run)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chapters", type=int, nargs="+", default=[10, 100, 500, 2000])
+    parser.add_argument("--paragraphs", type=int, default=40, help="Paragraphs per chapter")
+    args = parser.parse_args()
+
+    header = f"{'chapters':>8} {'size MB':>8} {'mode':>6} {'metadata':>10} {'1st chapter':>12} {'total':>9} {'sent/s':>10} {'peak MB':>8}"
+    print(header)
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in args.chapters:
+            path = os.path.join(tmp, f"book_{count}.epub")
+            make_epub(path, synthetic_chapters(count, paragraphs=args.paragraphs), title=f"Omnibus {count}")
+            size_mb = os.path.getsize(path) / 1e6
+            for mode, runner in (("lazy", lazy_parse), ("eager", eager_parse)):
+                (metadata_at, first_at, sentences), elapsed, peak = runner(path)
+                metadata = f"{metadata_at * 1000:8.1f}ms" if metadata_at is not None else f"{'-':>10}"
+                print(f"{count:>8} {size_mb:>8.2f} {mode:>6} {metadata} {first_at * 1000:10.1f}ms "
+                      f"{elapsed:8.2f}s {sentences / elapsed:>10.0f} {peak / 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
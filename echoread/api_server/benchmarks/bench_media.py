@@ -0,0 +1,144 @@
+"""
+Benchmark for the chapter media route (GET /media/books/{book_id}/chapters/{audio_file}).
+
+Generates a directory of chapter-sized files, then runs concurrent "seekers"
+that issue random Range requests (what a player does when scrubbing) and
+reports time-to-first-byte and throughput, next to full-file downloads.
+Seeks go through both the bearer-token route (JWT + ownership queries per
+request) and the signed URLs handed out by GET /books/{id}/audios/{audio_id},
+which are verified without touching the database.
+
+    python -m echoread.api_server.benchmarks.bench_media --files 8 --size-mb 40 --seekers 32
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+import uuid
+
+import httpx
+
+from echoread.api_server import config, models, signed_urls
+from echoread.api_server.benchmarks.common import (
+    BENCH_AUTH_HEADERS, BENCH_USER_EMAIL, BENCH_USER_ID, live_server, sqlite_database, summarize,
+)
+
+
+def generate_files(directory: str, count: int, size: int) -> list:
+    paths = []
+    block = os.urandom(1024 * 1024)
+    for i in range(1, count + 1):
+        path = os.path.join(directory, f"chapter_{i}.mp3")
+        with open(path, "wb") as out:
+            remaining = size
+            while remaining > 0:
+                out.write(block[:min(len(block), remaining)])
+                remaining -= len(block)
+        paths.append(path)
+    return paths
+
+
+def seed(session_factory, paths: list, book_id: str):
+    '''(bearer-token URLs, signed URLs) for the chapters at `paths`.'''
+    db = session_factory()
+    user = models.User(id=BENCH_USER_ID, email=BENCH_USER_EMAIL, name="Bench")
+    book = models.Book(id=book_id, user_id=user.id, title="Bench Book", status="complete")
+    db.add_all([user, book])
+    urls, signed = [], []
+    for i, path in enumerate(paths, start=1):
+        audio = models.Audio(id=str(uuid.uuid4()), book_id=book.id, chapter_index=i, audio_path=path)
+        db.add(audio)
+        urls.append(f"/media/books/{book.id}/chapters/{audio.id}.mp3")
+        url, _ = signed_urls.sign(user.id, book.id, audio.id, os.path.basename(path))
+        signed.append(url[len(config.MEDIA_BASE_URL):])
+    db.commit()
+    db.close()
+    return urls, signed
+
+
+async def fetch(client: httpx.AsyncClient, url: str, headers: dict):
+    start = time.perf_counter()
+    ttfb = None
+    nbytes = 0
+    async with client.stream("GET", url, headers=headers) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_raw():
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            nbytes += len(chunk)
+    return ttfb or 0.0, time.perf_counter() - start, nbytes
+
+
+async def run_seekers(base_url: str, urls: list, size: int, seekers: int, seeks: int, range_bytes: int,
+                      auth_headers: dict):
+    ttfbs, totals, nbytes = [], [], 0
+
+    async def seeker(client):
+        nonlocal nbytes
+        for _ in range(seeks):
+            offset = random.randrange(0, max(1, size - range_bytes))
+            headers = dict(auth_headers, Range=f"bytes={offset}-{offset + range_bytes - 1}")
+            ttfb, total, count = await fetch(client, random.choice(urls), headers)
+            ttfbs.append(ttfb)
+            totals.append(total)
+            nbytes += count
+
+    limits = httpx.Limits(max_connections=seekers)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(seeker(client) for _ in range(seekers)))
+        elapsed = time.perf_counter() - start
+    return ttfbs, totals, nbytes, elapsed
+
+
+async def run_full_downloads(base_url: str, urls: list, concurrency: int):
+    ttfbs, totals, nbytes = [], [], 0
+
+    async def download(client, url):
+        nonlocal nbytes
+        ttfb, total, count = await fetch(client, url, BENCH_AUTH_HEADERS)
+        ttfbs.append(ttfb)
+        totals.append(total)
+        nbytes += count
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=600) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(download(client, urls[i % len(urls)]) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return ttfbs, totals, nbytes, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--size-mb", type=int, default=40, help="Size of each generated chapter file")
+    parser.add_argument("--seekers", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--seeks", type=int, default=20, help="Range requests per client")
+    parser.add_argument("--range-kb", type=int, default=256, help="Bytes requested per seek")
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    book_id = str(uuid.uuid4())
+    with tempfile.TemporaryDirectory() as media_dir, sqlite_database() as session_factory:
+        config.STORAGE_ROOT = media_dir # Signed URLs resolve files under <STORAGE_ROOT>/<user>/<book>/
+        book_dir = os.path.join(media_dir, BENCH_USER_ID, book_id)
+        os.makedirs(book_dir)
+        urls, signed = seed(session_factory, generate_files(book_dir, args.files, size), book_id)
+        with live_server() as base_url:
+            for label, chapter_urls, headers in (("range seek", urls, BENCH_AUTH_HEADERS),
+                                                 ("signed range seek", signed, {})):
+                ttfbs, totals, nbytes, elapsed = asyncio.run(run_seekers(
+                    base_url, chapter_urls, size, args.seekers, args.seeks, args.range_kb * 1024, headers))
+                print(summarize(f"{label} (TTFB)", ttfbs, elapsed))
+                print(summarize(f"{label} (complete)", totals, elapsed, nbytes))
+
+            ttfbs, totals, nbytes, elapsed = asyncio.run(run_full_downloads(base_url, urls, args.seekers))
+            print(summarize("full download (TTFB)", ttfbs, elapsed))
+            print(summarize("full download (complete)", totals, elapsed, nbytes))
+
+
+if __name__ == "__main__":
+    main()
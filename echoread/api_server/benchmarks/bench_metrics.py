@@ -0,0 +1,131 @@
+"""
+Overhead of the Prometheus instrumentation (metrics.py).
+
+Runs the real app twice, in child processes, with METRICS_ENABLED=0 and =1
+(the flag is read at import), on two routes:
+
+* GET /: no database work, so the middleware is the only difference;
+* GET /books/{id}: a few SQL statements, so the cursor events and the timed
+  pool checkout are exercised too.
+
+Each route is timed by calling the ASGI app directly (no sockets, so the
+per-request cost of the instrumentation is not lost in network noise) and
+under HTTP load through uvicorn.
+
+With --multiprocess the metrics child writes to a PROMETHEUS_MULTIPROC_DIR, as
+under gunicorn, and the time to render one /metrics scrape is reported.
+
+    python -m echoread.api_server.benchmarks.bench_metrics --requests 4000 --clients 8
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+
+async def run_clients(base_url: str, path: str, headers: dict, clients: int, requests: int):
+    latencies = []
+
+    async def worker(client):
+        for _ in range(requests // clients):
+            start = time.perf_counter()
+            response = await client.get(path, headers=headers)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(max_connections=clients, keepalive_expiry=1)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits) as client:
+        for _ in range(50): # Warm up
+            await client.get(path, headers=headers)
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+    return latencies, elapsed
+
+
+async def call_app(app, path: str, headers: dict, iterations: int, rounds: int = 5) -> float:
+    '''Mean seconds per request of the best of `rounds`, calling the ASGI app in-process.'''
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+        "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200, message
+
+    for _ in range(100): # Warm up
+        await app(dict(scope), receive, send)
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            await app(dict(scope), receive, send)
+        best = min(best, (time.perf_counter() - start) / iterations)
+    return best
+
+
+def child(args: argparse.Namespace) -> None:
+    '''Runs in a fresh process, so METRICS_ENABLED and PROMETHEUS_MULTIPROC_DIR apply at import.'''
+    from echoread.api_server import metrics, models
+    from echoread.api_server.main import app
+    from echoread.api_server.benchmarks.common import (
+        BENCH_AUTH_HEADERS, BENCH_USER_EMAIL, BENCH_USER_ID, live_server, sqlite_database, summarize,
+    )
+
+    label = "metrics on " if os.environ["METRICS_ENABLED"] == "1" else "metrics off"
+    with sqlite_database() as session_factory:
+        book_id = str(uuid.uuid4())
+        with session_factory() as db:
+            db.add(models.User(id=BENCH_USER_ID, email=BENCH_USER_EMAIL, name="Bench"))
+            db.add(models.Book(id=book_id, user_id=BENCH_USER_ID, title="Bench Book", status="complete"))
+            db.commit()
+        routes = (("GET /", "/", {}), ("GET /books/{id}", f"/books/{book_id}", BENCH_AUTH_HEADERS))
+        for name, path, headers in routes:
+            per_request = asyncio.run(call_app(app, path, headers, args.requests // 2))
+            print(f"{label} {name:<16} in-process {per_request * 1e6:8.1f}us per request", flush=True)
+        with live_server() as base_url:
+            for name, path, headers in routes:
+                latencies, elapsed = asyncio.run(run_clients(base_url, path, headers, args.clients, args.requests))
+                print(summarize(f"{label} {name}", latencies, elapsed), flush=True)
+        if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            start = time.perf_counter()
+            body = metrics.render({"queued": 0})
+            print(f"{label} /metrics render: {(time.perf_counter() - start) * 1000:.2f}ms, {len(body)} bytes "
+                  f"({len(os.listdir(os.environ['PROMETHEUS_MULTIPROC_DIR']))} value files)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--multiprocess", action="store_true", help="Keep metrics in files, as under gunicorn")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    forwarded = ["--requests", str(args.requests), "--clients", str(args.clients)]
+    for enabled in ("0", "1"):
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            env = dict(os.environ, METRICS_ENABLED=enabled)
+            env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+            if args.multiprocess and enabled == "1":
+                env["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+            subprocess.run([sys.executable, "-m", __spec__.name, "--child", *forwarded], env=env, check=True)
+
+
+if __name__ == "__main__":
+    main()
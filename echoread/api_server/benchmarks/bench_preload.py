@@ -0,0 +1,94 @@
+"""
+Benchmark: gunicorn with and without preload_app.
+
+Starts gunicorn with gunicorn_conf.py and N workers against a throwaway SQLite
+database, once with GUNICORN_PRELOAD=0 (every worker imports the app) and once
+with preloading (the master imports it, workers are forked from it). Reports
+the time until every worker has finished its startup and the memory of all
+processes together, as proportional set size (shared pages are split between
+the processes sharing them).
+
+Run from the repository root (Linux only, reads /proc):
+    python -m echoread.api_server.benchmarks.bench_preload --workers 4
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import List
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_ROOT = os.path.dirname(os.path.dirname(API_DIR))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def children(pid: int) -> List[int]:
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def pss_bytes(pid: int) -> int:
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def run(workers: int, preload: bool, database_url: str) -> tuple:
+    port = free_port()
+    env = dict(os.environ, GUNICORN_PRELOAD="1" if preload else "0", WEB_CONCURRENCY=str(workers),
+               DATABASE_URL=database_url, PROMETHEUS_MULTIPROC_DIR=tempfile.mkdtemp(prefix="echoread-metrics-"))
+    log = tempfile.TemporaryFile()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", os.path.join(API_DIR, "gunicorn_conf.py"),
+         "--bind", f"127.0.0.1:{port}", "echoread.api_server.main:app"],
+        cwd=REPO_ROOT, env=env, stdout=log, stderr=log,
+    )
+    try:
+        while True: # Every worker has run its lifespan startup
+            log.seek(0)
+            if log.read().count(b"Application startup complete") >= workers:
+                break
+            if server.poll() is not None:
+                log.seek(0)
+                raise RuntimeError(log.read().decode())
+            time.sleep(0.01)
+        ready = time.perf_counter() - started
+        for _ in range(workers * 20): # Touch every worker a few times, as traffic would
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/").read()
+        pids = [server.pid] + children(server.pid)
+        return ready, sum(pss_bytes(pid) for pid in pids)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        for preload in (False, True):
+            results = sorted(run(args.workers, preload, database_url) for _ in range(args.rounds))
+            ready, pss = results[len(results) // 2]
+            print(f"preload={'on ' if preload else 'off'} workers={args.workers} "
+                  f"ready={ready:6.2f}s  pss={pss / 1e6:7.1f}MB ({pss / 1e6 / (args.workers + 1):.1f}MB per process)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Duration probing (audio_probe.py) vs reading every file in full.
+
+Writes --files synthetic chapters (audio_corpus.py), a mix of WAV, MP3 with a
+Xing tag, CBR MP3 without one (size / bitrate), VBR MP3 without one (frame
+walk) and Opus, then times:
+
+* probe: probe_duration() on each file, sequentially;
+* backfill: backfill_durations.backfill() end to end against a SQLite file;
+* full read: every byte of every file, a lower bound for any decoder.
+
+Runs in that order: the corpus was just written, so the probes mostly hit the
+page cache, while the full read of all files cannot fit in it.
+
+    python -m echoread.api_server.benchmarks.bench_probe --files 2000 --minutes 20
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from echoread.api_server import models
+from echoread.api_server.audio_probe import probe_duration
+from echoread.api_server.backfill_durations import backfill
+from echoread.api_server.benchmarks.audio_corpus import write_mp3, write_ogg, write_wav
+from echoread.api_server.benchmarks.common import BENCH_USER_EMAIL, BENCH_USER_ID, sqlite_database
+
+READ_CHUNK = 1024 * 1024
+
+
+KINDS = ("wav", "mp3-xing", "mp3-cbr", "mp3-vbr", "opus")
+
+
+def write_corpus(directory: str, count: int, minutes: float) -> list:
+    '''(kind, path) for `count` chapters, cycling through KINDS, 0.5-1.4x `minutes` long.'''
+    corpus = []
+    for i in range(count):
+        seconds = minutes * 60 * (0.5 + (i % 10) / 10)
+        kind = KINDS[i % len(KINDS)]
+        path = os.path.join(directory, f"chapter_{i}.{kind}")
+        if kind == "wav":
+            write_wav(path, seconds)
+        elif kind == "opus":
+            write_ogg(path, seconds)
+        else:
+            write_mp3(path, seconds, xing=kind == "mp3-xing", vbr=kind == "mp3-vbr")
+        corpus.append((kind, path))
+    return corpus
+
+
+def full_read(paths: list) -> int:
+    total = 0
+    for path in paths:
+        with open(path, "rb") as f:
+            while chunk := f.read(READ_CHUNK):
+                total += len(chunk)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--minutes", type=float, default=20, help="Mean chapter length")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = write_corpus(directory, args.files, args.minutes)
+        paths = [path for _, path in corpus]
+        print(f"{args.files} files, ~{args.minutes:g} min each")
+
+        by_kind = {kind: [] for kind in KINDS}
+        for kind, path in corpus:
+            started = time.perf_counter()
+            probe_duration(path)
+            by_kind[kind].append(time.perf_counter() - started)
+        elapsed = sum(sum(times) for times in by_kind.values())
+        print(f"probe       {elapsed:8.2f}s  {elapsed / len(paths) * 1e6:8.1f}us/file")
+        for kind, times in by_kind.items():
+            print(f"  {kind:<8} {sum(times):8.2f}s  {sum(times) / len(times) * 1e6:8.1f}us/file")
+
+        with sqlite_database() as session_factory:
+            with session_factory() as db:
+                db.add(models.User(id=BENCH_USER_ID, email=BENCH_USER_EMAIL))
+                db.add(models.Book(id="book_bench", user_id=BENCH_USER_ID, title="Bench"))
+                db.add_all(models.Audio(id=f"audio_{i:06d}", book_id="book_bench", chapter_index=i, audio_path=path)
+                           for i, path in enumerate(paths))
+                db.commit()
+            started = time.perf_counter()
+            stats = backfill(session_factory, args.batch_size, args.workers)
+            elapsed = time.perf_counter() - started
+            print(f"backfill    {elapsed:8.2f}s  {stats['updated']} updated, {stats['failed']} failed"
+                  f" ({args.workers} workers, batches of {args.batch_size})")
+
+        started = time.perf_counter()
+        nbytes = full_read(paths)
+        elapsed = time.perf_counter() - started
+        print(f"full read   {elapsed:8.2f}s  {nbytes / 1e9:6.2f} GB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Cost of the request profiling hook (profiling.py).
+
+Calls the real app in-process (as bench_metrics does) on GET /books/{id}:
+
+* without the middleware, as when neither PROFILE_TOKEN nor PROFILE_SAMPLE_RATE is set;
+* with it installed, for requests it lets through (no X-Profile header, not sampled);
+* with every request profiled, to show what a profiled request costs itself.
+
+    python -m echoread.api_server.benchmarks.bench_profiling --requests 2000
+"""
+import argparse
+import asyncio
+import tempfile
+import uuid
+
+from echoread.api_server import models, profiling
+from echoread.api_server.benchmarks.bench_metrics import call_app
+from echoread.api_server.benchmarks.common import BENCH_AUTH_HEADERS, BENCH_USER_EMAIL, BENCH_USER_ID, sqlite_database
+from echoread.api_server.main import app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--interval-ms", type=float, default=1.0, help="Sampling interval of profiled requests")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as profile_dir, sqlite_database() as session_factory:
+        book_id = str(uuid.uuid4())
+        with session_factory() as db:
+            db.add(models.User(id=BENCH_USER_ID, email=BENCH_USER_EMAIL, name="Bench"))
+            db.add(models.Book(id=book_id, user_id=BENCH_USER_ID, title="Bench Book", status="complete"))
+            db.commit()
+
+        def middleware(sample_rate: float):
+            return profiling.ProfilingMiddleware(app, token="bench-token", sample_rate=sample_rate,
+                                                 directory=profile_dir, interval=args.interval_ms / 1000)
+
+        runs = (
+            ("no middleware", app, args.requests),
+            ("installed, not triggered", middleware(0), args.requests),
+            ("every request profiled", middleware(1.0), max(1, args.requests // 10)),
+        )
+        for label, asgi_app, requests in runs:
+            per_request = asyncio.run(call_app(asgi_app, f"/books/{book_id}", BENCH_AUTH_HEADERS, requests))
+            print(f"{label:<26} {per_request * 1e6:9.1f}us per request")
+
+
+if __name__ == "__main__":
+    main()
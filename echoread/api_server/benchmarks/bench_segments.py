@@ -0,0 +1,189 @@
+"""
+Startup latency, seek latency and bytes transferred for monolithic vs segmented chapters.
+
+Writes one long chapter WAV, packages it into segments (segments.py) and serves
+both forms through the signed media route. Each simulated listening session:
+
+1. starts playback once --buffer-seconds of audio are downloaded (startup latency);
+2. listens for --listen-seconds while the player keeps buffering;
+3. seeks to a random position and waits until --buffer-seconds from there are
+   downloaded (seek latency).
+
+The monolithic player is a progressive download of chapter_N.wav: one GET,
+read in order, so a seek past the downloaded part waits for everything before
+it. The segmented player fetches the playlist, then only the segments covering
+the playhead and its forward buffer. The client throttles its reads to --mbps
+and sleeps --rtt-ms before each request, to model a mobile link over loopback.
+
+    python -m echoread.api_server.benchmarks.bench_segments --minutes 10 --mbps 4 --rtt-ms 80
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from typing import List, Tuple
+
+import httpx
+
+from echoread.api_server import config, segments, signed_urls, tts
+from echoread.api_server.benchmarks.common import BENCH_USER_ID, live_server, percentile
+
+SAMPLE_RATE = tts.TTSEngine.sample_rate
+BYTES_PER_SECOND = SAMPLE_RATE * 2 # 16-bit mono PCM
+WAV_HEADER = 44
+READ_CHUNK = 16 * 1024
+
+
+class Link:
+    '''Client side of a modelled network link: per-request latency and a throughput cap.'''
+    def __init__(self, mbps: float, rtt_ms: float):
+        self.bytes_per_second = mbps * 1e6 / 8 if mbps > 0 else 0
+        self.rtt = rtt_ms / 1000
+        self.transferred = 0
+        self._window_start = time.perf_counter()
+        self._window_bytes = 0
+
+    async def request(self) -> None:
+        await asyncio.sleep(self.rtt)
+        self._window_start, self._window_bytes = time.perf_counter(), 0
+
+    async def received(self, count: int) -> None:
+        self.transferred += count
+        self._window_bytes += count
+        if self.bytes_per_second:
+            ahead = self._window_bytes / self.bytes_per_second - (time.perf_counter() - self._window_start)
+            if ahead > 0:
+                await asyncio.sleep(ahead)
+
+
+def write_chapter(directory: str, minutes: float) -> str:
+    path = os.path.join(directory, "chapter_1.wav")
+    block = os.urandom(BYTES_PER_SECOND)
+    tts.write_wav(path, block * int(minutes * 60), SAMPLE_RATE)
+    return path
+
+
+def signed_path(book_id: str, filename: str) -> str:
+    url, _ = signed_urls.sign(BENCH_USER_ID, book_id, "audio_bench", filename)
+    return url[len(config.MEDIA_BASE_URL):]
+
+
+async def monolithic_session(client: httpx.AsyncClient, link: Link, url: str, duration: float, seek_to: float,
+                             buffer: float, listen: float) -> Tuple[float, float, int]:
+    start = time.perf_counter()
+    await link.request()
+    startup = seek = None
+    downloaded = 0
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_raw(READ_CHUNK):
+            downloaded += len(chunk)
+            await link.received(len(chunk))
+            now = time.perf_counter()
+            if startup is None and downloaded >= WAV_HEADER + buffer * BYTES_PER_SECOND:
+                startup, listened_at = now - start, now
+            if startup is not None and now - listened_at >= listen:
+                if seek is None:
+                    seek_at = now # The listener seeks; only bytes already downloaded are playable
+                    seek = 0.0
+                needed = WAV_HEADER + min(duration, seek_to + buffer) * BYTES_PER_SECOND
+                if downloaded >= needed:
+                    seek = now - seek_at
+                    break
+    return startup, seek or 0.0, link.transferred # No seek wait if the download finished while listening
+
+
+async def segmented_session(client: httpx.AsyncClient, link: Link, playlist_url: str, book_id: str,
+                            seek_to: float, buffer: float, listen: float) -> Tuple[float, float, int]:
+    fetched = set()
+
+    async def fetch(url: str) -> bytes:
+        await link.request()
+        body = b""
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_raw(READ_CHUNK):
+                body += chunk
+                await link.received(len(chunk))
+        return body
+
+    async def fill(entries: List[Tuple[str, float, float]], position: float) -> None:
+        for name, begin, end in entries: # Segments overlapping [position, position + buffer)
+            if end > position and begin < position + buffer and name not in fetched:
+                fetched.add(name)
+                await fetch(signed_path(book_id, name))
+
+    start = time.perf_counter()
+    lines = (await fetch(playlist_url)).decode().splitlines()
+    entries, offset = [], 0.0
+    for info, name in zip(lines, lines[1:]):
+        if info.startswith("#EXTINF:"):
+            length = float(info[len("#EXTINF:"):].rstrip(","))
+            entries.append((os.path.basename(httpx.URL(name).path), offset, offset + length))
+            offset += length
+    await fill(entries, 0.0)
+    startup = time.perf_counter() - start
+
+    listened_at = time.perf_counter()
+    await fill(entries, listen) # Keeps the forward buffer full while listening
+    await asyncio.sleep(max(0.0, listen - (time.perf_counter() - listened_at)))
+
+    seek_at = time.perf_counter()
+    await fill(entries, seek_to)
+    return startup, time.perf_counter() - seek_at, link.transferred
+
+
+def report(label: str, results: list) -> None:
+    startups, seeks, transferred = zip(*results)
+    print(f"{label:<12} startup p50={percentile(startups, 50) * 1000:8.1f}ms"
+          f" p95={percentile(startups, 95) * 1000:8.1f}ms"
+          f"  seek p50={percentile(seeks, 50) * 1000:8.1f}ms p95={percentile(seeks, 95) * 1000:8.1f}ms"
+          f"  transferred/session={sum(transferred) / len(transferred) / 1e6:7.2f} MB")
+
+
+async def run(base_url: str, book_id: str, duration: float, args: argparse.Namespace) -> None:
+    chapter_url = signed_path(book_id, "chapter_1.wav")
+    playlist_url = signed_path(book_id, "chapter_1" + segments.PLAYLIST_SUFFIX)
+    seeks = [random.uniform(duration * 0.1, duration * 0.9) for _ in range(args.sessions)]
+    # Idle connections are dropped before uvicorn's 5s keep-alive timeout can close them under a request
+    limits = httpx.Limits(keepalive_expiry=1)
+    async with httpx.AsyncClient(base_url=base_url, timeout=3600, limits=limits) as client:
+        results = []
+        for seek_to in seeks:
+            results.append(await monolithic_session(client, Link(args.mbps, args.rtt_ms), chapter_url, duration,
+                                                    seek_to, args.buffer_seconds, args.listen_seconds))
+        report("monolithic", results)
+        results = []
+        for seek_to in seeks:
+            results.append(await segmented_session(client, Link(args.mbps, args.rtt_ms), playlist_url, book_id,
+                                                   seek_to, args.buffer_seconds, args.listen_seconds))
+        report("segmented", results)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, default=10, help="Length of the chapter")
+    parser.add_argument("--segment-seconds", type=float, default=6)
+    parser.add_argument("--buffer-seconds", type=float, default=10, help="Audio buffered before playback (re)starts")
+    parser.add_argument("--listen-seconds", type=float, default=5, help="Listening time before the seek")
+    parser.add_argument("--sessions", type=int, default=3)
+    parser.add_argument("--mbps", type=float, default=4, help="Modelled link throughput (0: unthrottled)")
+    parser.add_argument("--rtt-ms", type=float, default=80, help="Modelled round trip per request")
+    args = parser.parse_args()
+
+    book_id = "book_bench"
+    with tempfile.TemporaryDirectory() as storage_root:
+        config.STORAGE_ROOT = storage_root # The signed media route resolves <STORAGE_ROOT>/<user>/<book>/<file>
+        book_dir = os.path.join(storage_root, BENCH_USER_ID, book_id)
+        os.makedirs(book_dir)
+        chapter = write_chapter(book_dir, args.minutes)
+        segments.package_chapter(chapter, args.segment_seconds)
+        print(f"chapter: {args.minutes:g} min, {os.path.getsize(chapter) / 1e6:.1f} MB; "
+              f"{args.segment_seconds:g}s segments; link {args.mbps:g} Mbps, {args.rtt_ms:g} ms RTT")
+        with live_server() as base_url:
+            asyncio.run(run(base_url, book_id, args.minutes * 60, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Micro-benchmark: JSON bodies of the list endpoints through Pydantic vs serializers.py.
+
+For 10, 1k and 10k items of each response (GET /books, GET /books/{id}/audios,
+and GET /books/{id}, whose size is its number of chapters), it times:
+
+* current: load ORM objects, then validate them into the response model and
+  encode them as FastAPI does for a response_model (or as the routes did with
+  TypeAdapter.dump_json);
+* fast: select the response's columns as tuples and encode them with orjson
+  (serializers.py).
+
+Both are timed with the SQLite fetch ("fetch+encode") and on rows already in
+memory ("encode"). It also checks that both paths produce the same bytes.
+
+    python -m echoread.api_server.benchmarks.bench_serialization
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, List, NamedTuple
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session, selectinload
+
+from echoread.api_server import models, serializers
+from echoread.api_server.database import Base
+
+SIZES = (10, 1000, 10000)
+USER_ID = "bench-user"
+BOOK_LIST = TypeAdapter(List[models.BookResponse])
+AUDIO_LIST = TypeAdapter(List[models.AudioChapterInfo])
+
+
+def fastapi_body(adapter: TypeAdapter, objects) -> bytes:
+    # fastapi.routing.serialize_response + JSONResponse.render for a response_model
+    value = adapter.dump_python(adapter.validate_python(objects), mode="json")
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+
+def seed(session: Session, size: int) -> str:
+    book_id = str(uuid.uuid4())
+    start = datetime(2024, 1, 1)
+    session.add(models.User(id=USER_ID, email="bench@example.com"))
+    session.add_all(
+        models.Book(id=book_id if i == 0 else str(uuid.uuid4()), user_id=USER_ID, title=f"Book {i}",
+                    author=None if i % 3 else "An Author", epub_path=f"/data/{i}.epub", status="complete",
+                    chapter_count=size if i == 0 else 12, created_at=start + timedelta(seconds=i, microseconds=i))
+        for i in range(size)
+    )
+    session.add_all(
+        models.Audio(id=f"audio_{uuid.uuid4()}", book_id=book_id, chapter_index=i, audio_path=f"/data/{i}.mp3",
+                     url=None, duration=61.25 + i, created_at=start + timedelta(seconds=i))
+        for i in range(size)
+    )
+    session.commit()
+    return book_id
+
+
+class Path(NamedTuple):
+    load: Callable[[Session], object] # What the route selects
+    encode: Callable[[object], bytes] # How it turns that into the body
+
+
+def paths(book_id: str) -> list:
+    '''(endpoint, current path, fast path) for each response.'''
+    books = (select(models.Book).where(models.Book.user_id == USER_ID), models.Book.created_at.desc())
+    audios = (select(models.Audio).where(models.Audio.book_id == book_id), models.Audio.chapter_index)
+
+    def rows(columns, query_and_order):
+        query, order = query_and_order
+        return lambda session: session.execute(query.with_only_columns(*serializers.labelled(columns)).order_by(order)).all()
+
+    def objects(query_and_order):
+        query, order = query_and_order
+        return lambda session: session.scalars(query.order_by(order)).all()
+
+    def detail_rows(session):
+        book = session.execute(select(*serializers.labelled(serializers.BOOK_DETAIL_COLUMNS))
+                               .where(models.Book.id == book_id)).one()
+        return book, rows(serializers.BOOK_DETAIL_AUDIO_COLUMNS, audios)(session)
+
+    return [
+        ("GET /books",
+         Path(objects(books), lambda loaded: fastapi_body(BOOK_LIST, loaded)),
+         Path(rows(serializers.BOOK_COLUMNS, books), lambda loaded: serializers.dump_rows(loaded, list(serializers.BOOK_COLUMNS)))),
+        ("GET /books/{id}/audios",
+         Path(objects(audios), lambda loaded: AUDIO_LIST.dump_json(AUDIO_LIST.validate_python(loaded))),
+         Path(rows(serializers.AUDIO_CHAPTER_COLUMNS, audios),
+              lambda loaded: serializers.dump_rows(loaded, list(serializers.AUDIO_CHAPTER_COLUMNS)))),
+        ("GET /books/{id}",
+         Path(lambda session: session.scalars(select(models.Book).where(models.Book.id == book_id)
+                                              .options(selectinload(models.Book.audios))).one(),
+              lambda loaded: models.BookDetail.model_validate(loaded).model_dump_json().encode()),
+         Path(detail_rows, lambda loaded: serializers.dump_book_detail(*loaded))),
+    ]
+
+
+def best_of(function: Callable[[], bytes], rounds: int) -> float:
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def run(size: int, rounds: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        with Session(engine) as session:
+            book_id = seed(session, size)
+
+        for label, current, fast in paths(book_id):
+            timings, bodies = {}, {}
+            for name, path in (("current", current), ("fast", fast)):
+                def fetch_and_encode(path=path):
+                    with Session(engine) as session: # One per request, as get_db gives
+                        return path.encode(path.load(session))
+                timings[name, "fetch+encode"] = best_of(fetch_and_encode, rounds)
+                with Session(engine) as session:
+                    loaded = path.load(session)
+                    timings[name, "encode"] = best_of(lambda: path.encode(loaded), rounds)
+                    bodies[name] = path.encode(loaded)
+            assert bodies["current"] == bodies["fast"], f"{label}: bodies differ"
+            for stage in ("fetch+encode", "encode"):
+                before, after = timings["current", stage], timings["fast", stage]
+                print(f"{label:<24} n={size:<6} {stage:<13} current={before * 1000:9.3f}ms "
+                      f"fast={after * 1000:9.3f}ms  x{before / after:5.1f}", flush=True)
+        engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, max(3, args.rounds if size < 10000 else args.rounds // 4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Shared helpers for the benchmark scripts in this package.
+
+The scripts run the real `main.app` behind uvicorn on a local port, backed by
+a throwaway SQLite file, so timings include the HTTP stack.
+"""
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Sequence
+
+import uvicorn
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from echoread.api_server import database
+from echoread.api_server.database import Base, enable_sqlite_foreign_keys
+from echoread.api_server.main import app
+from echoread.api_server.security import create_access_token
+
+BENCH_USER_ID = "bench-user"
+BENCH_USER_EMAIL = "bench@example.com"
+BENCH_AUTH_HEADERS = {"Authorization": f"Bearer {create_access_token(BENCH_USER_ID, BENCH_USER_EMAIL)}"}
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(label: str, latencies: List[float], elapsed: float, nbytes: int = 0) -> str:
+    parts = [
+        f"{label:<28}",
+        f"n={len(latencies):<6}",
+        f"p50={percentile(latencies, 50) * 1000:8.2f}ms",
+        f"p95={percentile(latencies, 95) * 1000:8.2f}ms",
+        f"p99={percentile(latencies, 99) * 1000:8.2f}ms",
+        f"rps={len(latencies) / elapsed:9.1f}" if elapsed else "",
+    ]
+    if nbytes:
+        parts.append(f"MB/s={nbytes / elapsed / 1e6:8.1f}")
+    return " ".join(parts)
+
+
+@contextmanager
+def sqlite_database() -> Iterator[sessionmaker]:
+    '''
+    Point the app at a fresh SQLite file for the duration of the block.
+    Yields a synchronous session factory for seeding; the app itself goes through aiosqlite.
+    '''
+    with tempfile.TemporaryDirectory() as tmp:
+        with bench_database(f"sqlite:///{os.path.join(tmp, 'bench.db')}") as session_factory:
+            yield session_factory
+
+
+@contextmanager
+def bench_database(url: str) -> Iterator[sessionmaker]:
+    '''
+    Point the app at the database at `url` (SQLite or an empty PostgreSQL database) for the duration of the
+    block. The tables are created first and dropped afterwards. Yields a synchronous session factory for
+    seeding; the app itself goes through the async driver.
+    '''
+    connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+    engine = create_engine(url, connect_args=connect_args)
+    enable_sqlite_foreign_keys(engine)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    # The app builds its engines from this URL, with the DB_POOL_* settings, in its lifespan (main.py)
+    database.configure(url)
+    try:
+        yield session_factory
+    finally:
+        asyncio.run(database.dispose_engines()) # Nothing to do if a live server's shutdown already did it
+        Base.metadata.drop_all(bind=engine)
+        engine.dispose()
+
+
+@contextmanager
+def live_server() -> Iterator[str]:
+    '''Run `main.app` under uvicorn in a background thread and yield its base URL.'''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # As gunicorn does for its listeners. Without it, responses written in two parts (headers, body) wait
+    # for the client's delayed ACK and every request takes 40ms+.
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+        sock.close()
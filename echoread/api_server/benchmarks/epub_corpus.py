@@ -0,0 +1,70 @@
+"""
+Synthetic EPUB generator for benchmarks and tests.
+
+    make_epub(path, synthetic_chapters(50, paragraphs=200), title="Omnibus", author="A. Writer")
+"""
+import random
+import zipfile
+from typing import IO, Iterable, Iterator, List, Optional, Tuple, Union
+
+WORDS = (
+    "the of and to in a is that for it as was with be by on not he this are or his from at which but "
+    "have an they you were her she there been one all we their has would when if so no will more its "
+    "river night window letter garden silence morning harbour lantern captain stranger journey"
+).split()
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>"""
+
+CHAPTER_XHTML = """<?xml version="1.0" encoding="UTF-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml"><head><title>{title}</title><style>p {{ margin: 0 }}</style></head>
+<body><h1>{title}</h1>
+{body}
+</body></html>"""
+
+Chapter = Tuple[str, List[str]] # (title, paragraphs)
+
+
+def synthetic_chapters(count: int, paragraphs: int = 20, sentences: int = 6, seed: int = 0) -> Iterator[Chapter]:
+    rng = random.Random(seed)
+    for i in range(1, count + 1):
+        body = []
+        for _ in range(paragraphs):
+            body.append(" ".join(
+                " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 18))).capitalize() + rng.choice(".!?")
+                for _ in range(sentences)
+            ))
+        yield f"Chapter {i}", body
+
+
+def make_epub(path: Union[str, IO[bytes]], chapters: Iterable[Chapter], title: Optional[str] = "Synthetic Book",
+              author: Optional[str] = "Bench Author", cover_image_bytes: int = 0) -> int:
+    '''Write a minimal EPUB 3 to `path` and return the number of chapters written.'''
+    manifest, spine = [], []
+    with zipfile.ZipFile(path, "w") as epub:
+        epub.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip") # Stored, first, as the spec requires
+        epub.writestr("META-INF/container.xml", CONTAINER_XML, compress_type=zipfile.ZIP_DEFLATED)
+        if cover_image_bytes: # Incompressible payload, like the illustrations of a large EPUB
+            epub.writestr("OEBPS/images/cover.jpg", random.Random(1).randbytes(cover_image_bytes))
+            manifest.append('<item id="cover" href="images/cover.jpg" media-type="image/jpeg"/>')
+        count = 0
+        for count, (chapter_title, paragraphs) in enumerate(chapters, start=1):
+            body = "\n".join(f"<p>{paragraph}</p>" for paragraph in paragraphs)
+            epub.writestr(f"OEBPS/chapter_{count}.xhtml", CHAPTER_XHTML.format(title=chapter_title, body=body),
+                          compress_type=zipfile.ZIP_DEFLATED)
+            manifest.append(f'<item id="c{count}" href="chapter_{count}.xhtml" media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="c{count}"/>')
+        metadata = "".join([
+            f"<dc:title>{title}</dc:title>" if title else "",
+            f"<dc:creator>{author}</dc:creator>" if author else "",
+            "<dc:language>en</dc:language>",
+        ])
+        epub.writestr("OEBPS/content.opf", f"""<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">{metadata}</metadata>
+  <manifest>{''.join(manifest)}</manifest>
+  <spine>{''.join(spine)}</spine>
+</package>""", compress_type=zipfile.ZIP_DEFLATED)
+    return count
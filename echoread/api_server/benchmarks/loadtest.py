@@ -0,0 +1,392 @@
+"""
+Load test of the API's real traffic mix, with JSON baselines and a regression check.
+
+Serves the real `main.app` behind uvicorn and runs each scenario with
+--clients concurrent async httpx clients:
+
+* heartbeat: every client is a different listener saving its play position
+  (POST /plays) as fast as the server answers, like a fleet of players;
+* browse:    library pages (GET /books, following the next-page cursor) and
+  book details (GET /books/{id});
+* upload:    EPUB uploads (POST /books/upload), each a distinct book;
+* range:     a chapter URL (GET /books/{id}/audios/{audio_id}) followed by
+  range requests on the signed media URL, like a player seeking.
+
+For each scenario it reports requests per second, p50/p95/p99 latency, errors
+and SQL statements per request (from the per-request counts in metrics.py).
+Client and server share the process, so the numbers compare runs on the same
+machine; they are not capacity figures. Record the baseline on the machine
+that runs the comparison, and use --repeat on noisy hosts.
+
+    # Before a change: record a baseline (median of 3 rounds per scenario)
+    python -m echoread.api_server.benchmarks.loadtest run --repeat 3 --save baseline.json
+    # After it: run again and flag regressions of more than 10%
+    python -m echoread.api_server.benchmarks.loadtest run --repeat 3 --baseline baseline.json --threshold 10
+    # Or compare two saved runs
+    python -m echoread.api_server.benchmarks.loadtest compare baseline.json current.json
+
+The database defaults to a temporary SQLite file; --database-url runs against
+an empty PostgreSQL database instead (tables are created and dropped).
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+from prometheus_client import REGISTRY
+
+from echoread.api_server import config, models
+from echoread.api_server.benchmarks.common import bench_database, live_server, percentile, sqlite_database
+from echoread.api_server.benchmarks.epub_corpus import make_epub, synthetic_chapters
+from echoread.api_server.security import create_access_token
+
+SCENARIOS = ("heartbeat", "browse", "upload", "range")
+# Higher is worse for all of these; requests per second is checked the other way round
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+RANGE_BYTES = 256 * 1024 # Per seek of the range scenario
+WARMUP_REQUESTS = 5 # Per scenario, before the clock starts
+
+
+class Library:
+    '''What seed() wrote: listeners with their tokens and books, and the browsing user's library.'''
+
+    def __init__(self):
+        self.listeners: List[Tuple[dict, str, List[str]]] = [] # (auth headers, book id, audio ids)
+        self.reader_headers: dict = {}
+        self.book_ids: List[str] = []
+        self.chapter_book_id: str = ""
+        self.chapter_audio_ids: List[str] = []
+        self.chapter_size = 0
+        self.uploads: List[bytes] = [] # Consumed by the upload scenario, one distinct EPUB per request
+
+
+def _auth(user_id: str, email: str) -> dict:
+    return {"Authorization": f"Bearer {create_access_token(user_id, email)}"}
+
+
+def seed(session_factory, args: argparse.Namespace) -> Library:
+    library = Library()
+    created = datetime.utcnow()
+    with session_factory() as db:
+        # One listener per client, each with a book of its own
+        for i in range(args.clients):
+            user_id, book_id = f"listener-{i}", str(uuid.uuid4())
+            audio_ids = [str(uuid.uuid4()) for _ in range(args.chapters)]
+            db.add(models.User(id=user_id, email=f"listener-{i}@example.com"))
+            db.add(models.Book(id=book_id, user_id=user_id, title=f"Listening {i}", status="complete",
+                               chapter_count=args.chapters, processed_chapters=args.chapters))
+            db.add_all(models.Audio(id=audio_id, book_id=book_id, chapter_index=index, duration=600.0,
+                                    audio_path=f"/nonexistent/{book_id}/chapter_{index}.wav")
+                       for index, audio_id in enumerate(audio_ids, start=1))
+            library.listeners.append((_auth(user_id, f"listener-{i}@example.com"), book_id, audio_ids))
+
+        # A reader with a large library; its first book has real chapter files for the range scenario
+        reader_id = "reader"
+        db.add(models.User(id=reader_id, email="reader@example.com"))
+        library.reader_headers = _auth(reader_id, "reader@example.com")
+        for b in range(args.books):
+            book_id = str(uuid.uuid4())
+            db.add(models.Book(id=book_id, user_id=reader_id, title=f"Library Book {b}", author="Bench Author",
+                               status="complete", chapter_count=args.chapters, processed_chapters=args.chapters,
+                               created_at=created - timedelta(minutes=b)))
+            library.book_ids.append(book_id)
+        db.commit()
+
+        library.chapter_book_id = library.book_ids[0]
+        library.chapter_size = int(args.chapter_mb * 1024 * 1024)
+        directory = os.path.join(config.STORAGE_ROOT, reader_id, library.chapter_book_id)
+        os.makedirs(directory)
+        block = os.urandom(1024 * 1024)
+        for index in range(1, args.chapters + 1):
+            path = os.path.join(directory, f"chapter_{index}.wav")
+            with open(path, "wb") as out:
+                remaining = library.chapter_size
+                while remaining > 0:
+                    out.write(block[:min(len(block), remaining)])
+                    remaining -= len(block)
+            audio_id = str(uuid.uuid4())
+            db.add(models.Audio(id=audio_id, book_id=library.chapter_book_id, chapter_index=index,
+                                audio_path=path, duration=600.0))
+            library.chapter_audio_ids.append(audio_id)
+        db.commit()
+    return library
+
+
+def statement_totals() -> Tuple[float, float]:
+    '''(SQL statements, requests) observed by metrics.MetricsMiddleware so far, over all routes.'''
+    statements = requests = 0.0
+    for family in REGISTRY.collect():
+        if family.name == "echoread_db_statements_per_request":
+            for sample in family.samples:
+                if sample.name.endswith("_sum"):
+                    statements += sample.value
+                elif sample.name.endswith("_count"):
+                    requests += sample.value
+    return statements, requests
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.error_kinds: Dict[str, int] = {} # "500", "ReadTimeout", ...
+
+    async def call(self, client: httpx.AsyncClient, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as exc:
+            self._error(type(exc).__name__)
+            return None
+        self.latencies.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self._error(str(response.status_code))
+        return response
+
+    def _error(self, kind: str) -> None:
+        self.errors += 1
+        self.error_kinds[kind] = self.error_kinds.get(kind, 0) + 1
+
+
+async def heartbeat(client: httpx.AsyncClient, recorder: Recorder, library: Library, index: int, count: int):
+    headers, book_id, audio_ids = library.listeners[index]
+    position = 0.0
+    for _ in range(count):
+        position += 5.0
+        await recorder.call(client, "POST", "/plays", headers=headers, json={
+            "book_id": book_id, "audio_id": random.choice(audio_ids), "last_timestamp": position,
+        })
+
+
+async def browse(client: httpx.AsyncClient, recorder: Recorder, library: Library, index: int, count: int):
+    headers = library.reader_headers
+    cursor = None
+    for i in range(count):
+        if i % 4 == 0: # A page of the library for every three books opened
+            params = {"limit": 20, **({"cursor": cursor} if cursor else {})}
+            response = await recorder.call(client, "GET", "/books", headers=headers, params=params)
+            cursor = response.headers.get("x-next-cursor") if response is not None else None
+        else:
+            await recorder.call(client, "GET", f"/books/{random.choice(library.book_ids)}", headers=headers)
+
+
+async def upload(client: httpx.AsyncClient, recorder: Recorder, library: Library, index: int, count: int):
+    headers = library.reader_headers
+    for _ in range(count):
+        epub = library.uploads.pop()
+        await recorder.call(client, "POST", "/books/upload", headers=headers,
+                            files={"file": ("book.epub", epub, "application/epub+zip")})
+
+
+async def range_fetch(client: httpx.AsyncClient, recorder: Recorder, library: Library, index: int, count: int):
+    headers = library.reader_headers
+    book_id, size = library.chapter_book_id, library.chapter_size
+    done = 0
+    while done < count:
+        audio_id = random.choice(library.chapter_audio_ids)
+        response = await recorder.call(client, "GET", f"/books/{book_id}/audios/{audio_id}", headers=headers)
+        done += 1
+        if response is None or response.status_code != 200:
+            continue
+        url = response.json()["url"][len(config.MEDIA_BASE_URL):]
+        for _ in range(min(3, count - done)): # A few seeks per chapter opened
+            offset = random.randrange(0, max(1, size - RANGE_BYTES))
+            await recorder.call(client, "GET", url, headers={"Range": f"bytes={offset}-{offset + RANGE_BYTES - 1}"})
+            done += 1
+
+
+RUNNERS: Dict[str, Callable] = {"heartbeat": heartbeat, "browse": browse, "upload": upload, "range": range_fetch}
+
+
+def make_uploads(count: int) -> List[bytes]:
+    '''Distinct small EPUBs, generated before the clock starts.'''
+    uploads = []
+    for seed_value in range(count):
+        buffer = io.BytesIO()
+        make_epub(buffer, synthetic_chapters(5, paragraphs=4, seed=seed_value), title=f"Upload {seed_value}")
+        uploads.append(buffer.getvalue())
+    return uploads
+
+
+async def run_scenario(base_url: str, name: str, library: Library, clients: int, requests: int) -> dict:
+    recorder = Recorder()
+    runner = RUNNERS[name]
+    per_client = max(1, requests // clients)
+    limits = httpx.Limits(max_connections=clients, keepalive_expiry=1)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        await runner(client, Recorder(), library, 0, WARMUP_REQUESTS) # Connections, caches, first-query costs
+        statements_before, requests_before = statement_totals()
+        start = time.perf_counter()
+        await asyncio.gather(*(runner(client, recorder, library, i, per_client) for i in range(clients)))
+        elapsed = time.perf_counter() - start
+    statements_after, requests_after = statement_totals()
+    statements, counted = statements_after - statements_before, requests_after - requests_before
+    latencies = recorder.latencies
+    return {
+        "requests": len(latencies),
+        "errors": recorder.errors,
+        "error_kinds": recorder.error_kinds,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "queries_per_request": round(statements / counted, 2) if counted else None,
+    }
+
+
+def median_result(rounds: List[dict]) -> dict:
+    '''The median of each figure over repeated rounds (errors are summed), to damp run-to-run noise.'''
+    if len(rounds) == 1:
+        return rounds[0]
+    result = {}
+    for key in ("requests", "rps", *LATENCY_KEYS, "queries_per_request"):
+        values = sorted(r[key] for r in rounds if r[key] is not None)
+        result[key] = values[len(values) // 2] if values else None
+    result["errors"] = sum(r["errors"] for r in rounds)
+    result["error_kinds"] = {}
+    for r in rounds:
+        for kind, count in r["error_kinds"].items():
+            result["error_kinds"][kind] = result["error_kinds"].get(kind, 0) + count
+    return result
+
+
+def format_result(name: str, result: dict) -> str:
+    queries = result["queries_per_request"]
+    return (f"{name:<10} n={result['requests']:<6} err={result['errors']:<4} rps={result['rps']:8.1f} "
+            f"p50={result['p50_ms']:8.2f}ms p95={result['p95_ms']:8.2f}ms p99={result['p99_ms']:8.2f}ms "
+            f"queries/req={'-' if queries is None else f'{queries:.2f}'}"
+            + (f" errors={result['error_kinds']}" if result["errors"] else ""))
+
+
+def compare(baseline: dict, current: dict, threshold: float, min_delta_ms: float) -> List[str]:
+    '''
+    Regressions of `current` against `baseline`: latency or queries per request up by more than
+    `threshold` percent (and latency by at least `min_delta_ms`), throughput down by more than
+    `threshold` percent, or errors where there were none.
+    '''
+    regressions = []
+    limit = threshold / 100.0
+    for name, now in current["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            continue
+        if now["rps"] < before["rps"] * (1 - limit):
+            regressions.append(f"{name}: rps {before['rps']} -> {now['rps']}")
+        for key in LATENCY_KEYS:
+            if now[key] > before[key] * (1 + limit) and now[key] - before[key] >= min_delta_ms:
+                regressions.append(f"{name}: {key} {before[key]} -> {now[key]}")
+        queries_before, queries_now = before.get("queries_per_request"), now.get("queries_per_request")
+        if queries_before is not None and queries_now is not None and queries_now > queries_before * (1 + limit):
+            regressions.append(f"{name}: queries_per_request {queries_before} -> {queries_now}")
+        if now["errors"] and not before["errors"]:
+            regressions.append(f"{name}: {now['errors']} errors (none in the baseline)")
+    return regressions
+
+
+def report_comparison(baseline: dict, current: dict, args: argparse.Namespace) -> int:
+    regressions = compare(baseline, current, args.threshold, args.min_delta_ms)
+    for name, now in current["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is not None:
+            change = (now["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+            print(f"{name:<10} p95 {before['p95_ms']:8.2f}ms -> {now['p95_ms']:8.2f}ms ({change:+.1f}%)  "
+                  f"rps {before['rps']:8.1f} -> {now['rps']:8.1f}")
+    if regressions:
+        print(f"REGRESSIONS (threshold {args.threshold:g}%):")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"No regressions beyond {args.threshold:g}%")
+    return 0
+
+
+def run(args: argparse.Namespace) -> dict:
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as storage_root:
+        config.STORAGE_ROOT = storage_root
+        database = bench_database(args.database_url) if args.database_url else sqlite_database()
+        with database as session_factory:
+            library = seed(session_factory, args)
+            if "upload" in args.scenarios:
+                library.uploads = make_uploads((args.uploads + WARMUP_REQUESTS) * args.repeat)
+            results = {}
+            with live_server() as base_url:
+                # Failed requests are counted per status in the results; their tracebacks would drown the report.
+                # Set once the server has configured its logging.
+                logging.getLogger("uvicorn.error").setLevel(logging.CRITICAL)
+                for name in args.scenarios:
+                    requests = args.uploads if name == "upload" else args.requests
+                    rounds = []
+                    for _ in range(args.repeat):
+                        rounds.append(asyncio.run(run_scenario(base_url, name, library, args.clients, requests)))
+                        if args.repeat > 1:
+                            print(format_result(f"  {name}", rounds[-1]), flush=True)
+                    results[name] = median_result(rounds)
+                    print(format_result(name, results[name]), flush=True)
+    return {
+        "created_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "database": "postgresql" if args.database_url and args.database_url.startswith("postgres") else "sqlite",
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "settings": {"clients": args.clients, "requests": args.requests, "uploads": args.uploads, "repeat": args.repeat,
+                     "books": args.books, "chapters": args.chapters, "chapter_mb": args.chapter_mb},
+        "scenarios": results,
+    }
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the scenarios")
+    run_parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    run_parser.add_argument("--clients", type=int, default=32, help="Concurrent clients (and listeners)")
+    run_parser.add_argument("--requests", type=int, default=4000, help="Requests per scenario")
+    run_parser.add_argument("--uploads", type=int, default=200, help="Requests of the upload scenario")
+    run_parser.add_argument("--books", type=int, default=500, help="Books in the browsing user's library")
+    run_parser.add_argument("--chapters", type=int, default=10, help="Chapters per book")
+    run_parser.add_argument("--chapter-mb", type=float, default=4, help="Size of the chapter files range requests read")
+    run_parser.add_argument("--repeat", type=int, default=1, help="Rounds per scenario; the median is reported")
+    run_parser.add_argument("--database-url", help="Empty PostgreSQL database to run against (default: SQLite)")
+    run_parser.add_argument("--save", help="Write the results to this JSON file")
+    run_parser.add_argument("--baseline", help="Compare the results with this saved run")
+
+    compare_parser = commands.add_parser("compare", help="Compare two saved runs")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+
+    for sub in (run_parser, compare_parser):
+        sub.add_argument("--threshold", type=float, default=10, help="Percent change counted as a regression")
+        sub.add_argument("--min-delta-ms", type=float, default=1.0, help="Ignore latency changes smaller than this")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        sys.exit(report_comparison(load(args.baseline), load(args.current), args))
+
+    results = run(args)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+    if args.baseline:
+        sys.exit(report_comparison(load(args.baseline), results, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+Whole-book downloads: a zip of every chapter file plus a JSON manifest, streamed
+straight from the files on disk.
+
+Entries are stored (method 0): audio doesn't compress, and without compression
+every byte offset of the archive is known before the first byte is sent. That
+gives:
+
+* a Content-Length, so clients show progress;
+* Range / If-Range, so an interrupted download resumes where it stopped. The
+  requested range is mapped onto the archive's parts (generated headers and
+  slices of chapter files) and only those are read;
+* constant memory: headers are built in memory (tens of bytes per chapter) and
+  file data is copied in CHUNK_SIZE pieces. Nothing is written to disk.
+
+Local headers carry each file's CRC-32, so it must be known up front. Chapter
+files are written once and never modified, so the TTS worker computes the CRC
+as it commits each chapter and stores it in `audios.crc32`: a download reads
+no file before its first byte, in any API process. Chapters written before
+that column existed get theirs on their first download, kept per process in
+`crc_cache`, keyed by (path, size, mtime). Archives of 4 GiB or more (40+
+hours of WAV) use the Zip64 extensions.
+"""
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Hashable, List, NamedTuple, Optional, Sequence, Tuple
+
+import anyio
+from fastapi import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from echoread.api_server import config
+from echoread.api_server.media import CHUNK_SIZE, parse_range
+
+MANIFEST_NAME = "manifest.json"
+ZIP64_LIMIT = 0xFFFFFFFF # Sizes and offsets from here on go in Zip64 fields
+ZIP64_COUNT_LIMIT = 0xFFFF # Likewise for the number of entries
+CRC_CHUNK = 1024 * 1024
+
+_UTF8_NAMES = 0x0800 # General purpose flag bit 11: names are UTF-8
+_MADE_BY = (3 << 8) | 45 # Unix, zip spec 4.5
+_FILE_ATTRIBUTES = 0o100644 << 16
+_MARKER_32, _MARKER_16 = 0xFFFFFFFF, 0xFFFF # "See the Zip64 field" in the classic 32- and 16-bit fields
+
+
+class Entry(NamedTuple):
+    '''One archive member: either a file on disk (`path`) or bytes built in memory (`data`).'''
+    name: str
+    size: int
+    crc32: int
+    mtime: float
+    path: Optional[str] = None
+    data: Optional[bytes] = None
+
+
+class Part(NamedTuple):
+    '''A contiguous piece of the archive: generated bytes, or a whole file from disk.'''
+    length: int
+    data: Optional[bytes] = None
+    path: Optional[str] = None
+
+
+class CRCCache:
+    '''LRU of file CRC-32s keyed by (path, size, mtime_ns): a rewritten file gets a new key.'''
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, int]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[int]:
+        with self._lock:
+            crc = self._entries.get(key)
+            if crc is not None:
+                self._entries.move_to_end(key)
+            return crc
+
+    def put(self, key: Hashable, crc: int) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = crc
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+crc_cache = CRCCache(config.ZIP_CRC_CACHE_SIZE)
+
+
+def compute_crc32(path: str) -> int:
+    '''CRC-32 of a whole file, read in CRC_CHUNK pieces. Blocking.'''
+    crc = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(CRC_CHUNK):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def file_crc32(path: str, size: int, mtime_ns: int) -> int:
+    '''CRC-32 of a chapter file, from `crc_cache` or by reading it once. Blocking: call it from a worker thread.'''
+    key = (path, size, mtime_ns)
+    crc = crc_cache.get(key)
+    if crc is None:
+        crc = compute_crc32(path)
+        crc_cache.put(key, crc)
+    return crc
+
+
+def data_entry(name: str, data: bytes, mtime: float) -> Entry:
+    return Entry(name, len(data), zlib.crc32(data), mtime, data=data)
+
+
+def manifest_entry(book: dict, chapters: List[dict], mtime: float) -> Entry:
+    # Sorted keys and no timestamps: the same book must always produce the same bytes, or resumes would break
+    body = json.dumps({"book": book, "chapters": chapters}, sort_keys=True, separators=(",", ":")).encode()
+    return data_entry(MANIFEST_NAME, body, mtime)
+
+
+def _dos_datetime(mtime: float) -> Tuple[int, int]:
+    # UTC rather than local time, so every server produces the same archive
+    t = time.gmtime(max(mtime, 315532800)) # DOS dates start in 1980
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+def _local_header(entry: Entry, name: bytes, zip64: bool) -> bytes:
+    dos_time, dos_date = _dos_datetime(entry.mtime)
+    size = _MARKER_32 if zip64 else entry.size
+    extra = struct.pack("<HHQQ", 0x0001, 16, entry.size, entry.size) if zip64 else b""
+    return struct.pack(
+        "<IHHHHHIIIHH", 0x04034B50, 45 if zip64 else 20, _UTF8_NAMES, 0, dos_time, dos_date,
+        entry.crc32, size, size, len(name), len(extra),
+    ) + name + extra
+
+
+def _central_header(entry: Entry, name: bytes, offset: int) -> bytes:
+    dos_time, dos_date = _dos_datetime(entry.mtime)
+    zip64_fields = [] # Only the fields that overflow go in the Zip64 extra, in this order
+    if entry.size >= ZIP64_LIMIT:
+        zip64_fields += [entry.size, entry.size]
+    if offset >= ZIP64_LIMIT:
+        zip64_fields.append(offset)
+    extra = struct.pack(f"<HH{len(zip64_fields)}Q", 0x0001, 8 * len(zip64_fields), *zip64_fields) if zip64_fields else b""
+    size = _MARKER_32 if entry.size >= ZIP64_LIMIT else entry.size
+    return struct.pack(
+        "<IHHHHHHIIIHHHHHII", 0x02014B50, _MADE_BY, 45 if zip64_fields else 20, _UTF8_NAMES, 0, dos_time, dos_date,
+        entry.crc32, size, size, len(name), len(extra), 0, 0, 0, _FILE_ATTRIBUTES,
+        _MARKER_32 if offset >= ZIP64_LIMIT else offset,
+    ) + name + extra
+
+
+def _end_records(count: int, directory_offset: int, directory_size: int) -> bytes:
+    if count < ZIP64_COUNT_LIMIT and directory_offset < ZIP64_LIMIT and directory_size < ZIP64_LIMIT:
+        return struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, count, count, directory_size, directory_offset, 0)
+    zip64_end_offset = directory_offset + directory_size
+    return (
+        struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, _MADE_BY, 45, 0, 0, count, count, directory_size, directory_offset)
+        + struct.pack("<IIQI", 0x07064B50, 0, zip64_end_offset, 1) # Locator of the Zip64 end record
+        + struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, _MARKER_16, _MARKER_16, _MARKER_32, _MARKER_32, 0)
+    )
+
+
+class Archive:
+    '''The byte layout of a stored zip of `entries`: its parts, their offsets and the total size.'''
+    def __init__(self, entries: Sequence[Entry]):
+        self.parts: List[Part] = []
+        self.offsets: List[int] = []
+        self.size = 0
+        directory = []
+        for entry in entries:
+            name = entry.name.encode()
+            offset = self.size
+            # Zip64 local fields when the entry itself is large; large offsets only matter in the directory
+            self._add(Part(0, data=_local_header(entry, name, zip64=entry.size >= ZIP64_LIMIT)))
+            self._add(Part(entry.size, data=entry.data, path=entry.path))
+            directory.append(_central_header(entry, name, offset))
+        directory_offset = self.size
+        directory_bytes = b"".join(directory)
+        self._add(Part(0, data=directory_bytes + _end_records(len(entries), directory_offset, len(directory_bytes))))
+        # The central directory has every name, size, CRC, date and offset: it identifies the archive's bytes
+        self.etag = f'"{hashlib.sha256(directory_bytes).hexdigest()[:32]}"'
+
+    def _add(self, part: Part) -> None:
+        if part.data is not None:
+            part = part._replace(length=len(part.data))
+        if part.length:
+            self.offsets.append(self.size)
+            self.parts.append(part)
+            self.size += part.length
+
+
+def book_archive(book: dict, chapters: Sequence[Tuple[str, int, Optional[str], Optional[float], Optional[int]]]) -> Archive:
+    '''
+    Archive of a book's chapter files, from (audio id, chapter index, path, duration, CRC-32) rows,
+    with manifest.json first. Chapters whose file is missing are left out. Blocking (stat, and
+    reading the chapters whose CRC-32 is not stored).
+    '''
+    entries, listed = [], []
+    width = max(3, len(str(max((index for _, index, _, _, _ in chapters), default=0))))
+    for audio_id, index, path, duration, stored_crc in chapters:
+        try:
+            stat_result = os.stat(path) if path else None
+        except FileNotFoundError:
+            stat_result = None
+        if stat_result is None:
+            continue
+        name = f"chapter_{index:0{width}d}{os.path.splitext(path)[1]}"
+        crc = stored_crc if stored_crc is not None else file_crc32(path, stat_result.st_size, stat_result.st_mtime_ns)
+        entries.append(Entry(name, stat_result.st_size, crc, stat_result.st_mtime, path=path))
+        listed.append({"index": index, "audio_id": audio_id, "file": name, "duration": duration,
+                       "size": stat_result.st_size})
+    mtime = max((entry.mtime for entry in entries), default=0)
+    return Archive([manifest_entry(book, listed, mtime)] + entries)
+
+
+class ArchiveResponse(Response):
+    '''Streams bytes `start`..`end` (inclusive) of an Archive, reading chapter files in CHUNK_SIZE pieces.'''
+
+    def __init__(self, archive: Archive, start: int, end: int, status_code: int = 200,
+                 headers: Optional[dict] = None):
+        self.archive = archive
+        self.start = start
+        self.end = end
+        super().__init__(content=None, status_code=status_code, headers=headers, media_type="application/zip")
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method") != "HEAD":
+            await self._send_range(send)
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+        if self.background is not None:
+            await self.background()
+
+    async def _send_range(self, send: Send) -> None:
+        index = bisect_right(self.archive.offsets, self.start) - 1
+        position = self.start
+        while position <= self.end:
+            part = self.archive.parts[index]
+            skip = position - self.archive.offsets[index]
+            take = min(part.length - skip, self.end + 1 - position)
+            if part.data is not None:
+                await send({"type": "http.response.body", "body": part.data[skip:skip + take], "more_body": True})
+            else:
+                async with await anyio.open_file(part.path, mode="rb") as file:
+                    await file.seek(skip)
+                    remaining = take
+                    while remaining > 0:
+                        chunk = await file.read(min(CHUNK_SIZE, remaining))
+                        if not chunk: # The declared length can't be honoured: abort rather than send a corrupt zip
+                            raise RuntimeError(f"{part.path} shrank while being downloaded")
+                        remaining -= len(chunk)
+                        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            position += take
+            index += 1
+
+
+def archive_response(request: Request, archive: Archive, etag: str, filename: str) -> Response:
+    '''GET/HEAD of an archive, honouring Range and If-Range (resumed downloads).'''
+    headers = {
+        "accept-ranges": "bytes",
+        "etag": etag,
+        "cache-control": "private, no-cache",
+        "content-disposition": f"attachment; filename=\"{filename}\"",
+    }
+    last = archive.size - 1
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and if_range and if_range.strip() != etag:
+        range_header = None # The book changed since the partial download started: send the new archive in full
+
+    if range_header:
+        try:
+            byte_range = parse_range(range_header, archive.size)
+        except ValueError:
+            headers["content-range"] = f"bytes */{archive.size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["content-range"] = f"bytes {start}-{end}/{archive.size}"
+            return ArchiveResponse(archive, start, end, status_code=206, headers=headers)
+
+    return ArchiveResponse(archive, 0, last, headers=headers)
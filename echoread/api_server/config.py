@@ -0,0 +1,91 @@
+import os
+from dotenv import load_dotenv
+
+# Same dev.env as database.py; values already present in the environment win.
+dotenv_path = os.path.join(os.path.dirname(__file__), 'dev.env')
+load_dotenv(dotenv_path=dotenv_path)
+
+# --- Database connections (see database.py) ---
+# Per process: an API worker opens at most DB_POOL_SIZE + DB_MAX_OVERFLOW connections (README, "Connections")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5")) # Connections each process keeps open
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5")) # Extra connections under bursts, closed again when returned
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10")) # Seconds a request waits for a free connection before failing
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800")) # Connections older than this are reopened; -1 never
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") != "0" # Check connections on checkout, so a database restart costs no errors
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "0") == "1" # Behind PgBouncer in transaction mode: no client pool, no statement caches
+
+# --- Read replica (see replicas.py) ---
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL") # Read-only routes query this database; unset, everything goes to DATABASE_URL
+REPLICA_PIN_SECONDS = float(os.getenv("REPLICA_PIN_SECONDS", "5")) # After a user writes, their reads go to the primary this long
+
+# --- Storage ---
+# Root directory for uploaded EPUBs and generated audio: <STORAGE_ROOT>/<user_id>/<book_id>/...
+STORAGE_ROOT = os.getenv("STORAGE_ROOT", "/user_uploads")
+
+# --- TTS worker ---
+TTS_ENGINE = os.getenv("TTS_ENGINE", "local") # See tts.get_engine for available engines
+TTS_WORKER_PROCESSES = int(os.getenv("TTS_WORKER_PROCESSES", str(os.cpu_count() or 1)))
+TTS_POLL_INTERVAL = float(os.getenv("TTS_POLL_INTERVAL", "2.0")) # Seconds between polls of an empty queue
+TTS_JOB_MAX_ATTEMPTS = int(os.getenv("TTS_JOB_MAX_ATTEMPTS", "3"))
+TTS_JOB_TIMEOUT = int(os.getenv("TTS_JOB_TIMEOUT", "300")) # Running jobs without a heartbeat for this long are assumed dead
+TTS_JOB_HEARTBEAT_INTERVAL = float(os.getenv("TTS_JOB_HEARTBEAT_INTERVAL", "30")) # Seconds between heartbeats (and stale-job sweeps)
+TTS_WORKER_JOBS = int(os.getenv("TTS_WORKER_JOBS", "2")) # Books processed concurrently per worker (their sentences share batches)
+TTS_LOCAL_CALL_OVERHEAD = float(os.getenv("TTS_LOCAL_CALL_OVERHEAD", "0")) # Simulated per-call cost of the local engine
+TTS_SEGMENT_SECONDS = float(os.getenv("TTS_SEGMENT_SECONDS", "0")) # >0 also writes each chapter as segments + playlist (segments.py)
+
+# --- Sentence micro-batching (see batching.py) ---
+TTS_BATCH_MAX_SIZE = int(os.getenv("TTS_BATCH_MAX_SIZE", "16"))
+TTS_BATCH_MAX_WAIT_MS = float(os.getenv("TTS_BATCH_MAX_WAIT_MS", "20"))
+
+# --- Uploads ---
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(512 * 1024 * 1024))) # Illustrated EPUBs can reach 200 MB+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# --- TTS output cache ---
+# Defaults to <STORAGE_ROOT>/.tts_cache so cached audio can be hard-linked into book directories
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR")
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(10 * 1024 ** 3))) # Bound on cached audio no book links to; 0 disables the cache
+
+# --- Authentication ---
+JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY") # Required; security.py refuses to start without it
+JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+JWT_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRE_MINUTES", str(7 * 24 * 60)))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300")) # Seconds a resolved user is reused without a DB lookup; 0 disables
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+# --- Playback positions (see playback.py) ---
+PLAY_WRITE_BEHIND_MS = int(os.getenv("PLAY_WRITE_BEHIND_MS", "0")) # >0 buffers positions in memory and flushes them in batches; other workers read them up to this late
+
+# --- TTS progress streams (see progress.py) ---
+PROGRESS_POLL_INTERVAL = float(os.getenv("PROGRESS_POLL_INTERVAL", "1.0")) # Seconds between checks of the watched books
+PROGRESS_HEARTBEAT_INTERVAL = float(os.getenv("PROGRESS_HEARTBEAT_INTERVAL", "15")) # Keeps idle proxies from closing streams
+PROGRESS_RETRY_MS = int(os.getenv("PROGRESS_RETRY_MS", "3000")) # Reconnect delay suggested to EventSource clients
+
+# --- HTTP response cache (see http_cache.py) ---
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000")) # Serialized book responses kept per process; 0 disables
+
+# --- Signed media URLs (see signed_urls.py) ---
+MEDIA_BASE_URL = os.getenv("MEDIA_BASE_URL", "https://api.echoread.com").rstrip("/") # Public origin of the /media routes
+MEDIA_SIGNING_KEYS = os.getenv("MEDIA_SIGNING_KEYS") # "kid:secret,..."; first one signs. Defaults to a key derived from JWT_SECRET_KEY
+MEDIA_URL_TTL = int(os.getenv("MEDIA_URL_TTL", "3600")) # Seconds a chapter URL stays valid
+MEDIA_URL_EXPIRY_STEP = int(os.getenv("MEDIA_URL_EXPIRY_STEP", "300")) # Expiries are rounded up to this, so URLs are reused
+
+# --- Deleted book files (see reaper.py) ---
+REAPER_INTERVAL = float(os.getenv("REAPER_INTERVAL", "1.0")) # Seconds between batches; 0 leaves the trash to another process
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", "500")) # Files unlinked per batch
+
+# --- Whole-book downloads (see book_zip.py) ---
+ZIP_CRC_CACHE_SIZE = int(os.getenv("ZIP_CRC_CACHE_SIZE", "100000")) # Chapter-file CRC-32s kept per process, for chapters without a stored audios.crc32
+
+# --- Metrics (see metrics.py) ---
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0" # Request, SQL and pool instrumentation behind GET /metrics
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") # GET /metrics requires "Authorization: Bearer <token>"; unset, it answers 404
+TTS_WORKER_METRICS_PORT = int(os.getenv("TTS_WORKER_METRICS_PORT", "0")) # >0 serves the TTS worker's /metrics on this port
+
+# --- Request profiling (see profiling.py) ---
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN") # Requests sending "X-Profile: <token>" are profiled; unset disables the header
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0")) # Share of all requests profiled at random
+PROFILE_DIR = os.getenv("PROFILE_DIR") # Where profiles are written; defaults to <tmp>/echoread-profiles
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "1000")) # Newest profiles kept in PROFILE_DIR; 0 keeps all
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1")) # Sampling interval
+PROFILE_FORMAT = os.getenv("PROFILE_FORMAT", "speedscope") # "speedscope" (JSON) or "collapsed" (flamegraph.pl)
@@ -1,9 +1,17 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+import logging
 import os
+import uuid
+from typing import Optional
 from dotenv import load_dotenv
 
+from echoread.api_server import config, metrics
+
 # Load environment variables from dev.env, which should be in the same directory
 # as this file or the main application entry point.
 # Assuming dev.env is in api_server, and this script is also in api_server.
@@ -16,13 +24,177 @@ if not DATABASE_URL:
     # This will halt startup if dev.env is missing or DATABASE_URL is not in it.
     raise RuntimeError("DATABASE_URL environment variable not set. Ensure dev.env is present and configured correctly in echoread/api_server/dev.env")
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+logger = logging.getLogger("echoread.database")
+
+# Async drivers for the same databases; used by the API so queries don't block the event loop
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+def async_database_url(url: str) -> str:
+    parsed = make_url(url)
+    return parsed.set(drivername=ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername)).render_as_string(hide_password=False)
+
+def enable_sqlite_foreign_keys(engine: Engine) -> None:
+    '''
+    SQLite ignores foreign keys, ON DELETE CASCADE included, unless every connection turns them on.
+    For an AsyncEngine, pass `async_engine.sync_engine`.
+    '''
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _foreign_keys_on(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+def engine_options(url: str) -> dict:
+    '''
+    Pool arguments for create_engine / create_async_engine, from the DB_* settings.
+
+    Every process has its own pool, so a deployment opens up to
+    (processes) x (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections; see the README.
+    '''
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite":
+        return {} # A file, not a server: nothing to bound
+    if config.DB_PGBOUNCER:
+        # PgBouncer (transaction pooling) does the pooling; a connection is only ours for one transaction
+        options = {"poolclass": NullPool}
+        if parsed.get_driver_name() == "asyncpg":
+            # Prepared statements live on a server connection the next transaction may not get, and their
+            # names must not collide with other clients' on the same server connection
+            options["connect_args"] = {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+            }
+        return options
+    return {
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+        "pool_recycle": config.DB_POOL_RECYCLE,
+        "pool_pre_ping": config.DB_POOL_PRE_PING,
+    }
+
+def pool_options(url: str, name: str, is_async: bool) -> dict:
+    '''
+    engine_options plus the pool class, timed for the metrics under `name` (see metrics.timed_pool_class).
+    Unless DB_PGBOUNCER picks NullPool, the class is the one the dialect would choose by itself.
+    '''
+    options = engine_options(url)
+    parsed = make_url(url)
+    pool_class = options.get("poolclass") or parsed.get_dialect(_is_async=is_async).get_pool_class(parsed)
+    options["poolclass"] = metrics.timed_pool_class(pool_class, name)
+    return options
+
+# The engines are built on first use, in the process that uses them: importing the app (e.g. in a
+# preloading gunicorn master) opens no connections, and each worker gets its own pool.
+_database_urls = {
+    "sync": DATABASE_URL,
+    "async": os.getenv("ASYNC_DATABASE_URL") or async_database_url(DATABASE_URL),
+    "replica": async_database_url(config.DATABASE_REPLICA_URL) if config.DATABASE_REPLICA_URL else None,
+}
+_engine: Optional[Engine] = None
+_async_engine: Optional[AsyncEngine] = None
+_replica_engine: Optional[AsyncEngine] = None
+
+def get_engine() -> Engine:
+    '''Synchronous engine: TTS worker, Alembic migrations and scripts.'''
+    global _engine
+    if _engine is None:
+        url = _database_urls["sync"]
+        _engine = create_engine(url, **pool_options(url, "sync", is_async=False))
+        enable_sqlite_foreign_keys(_engine)
+        metrics.instrument_engine(_engine)
+    return _engine
+
+def _create_async_engine(url: str, name: str) -> AsyncEngine:
+    options = pool_options(url, name, is_async=True)
+    engine = create_async_engine(url, **options)
+    enable_sqlite_foreign_keys(engine.sync_engine)
+    metrics.instrument_engine(engine.sync_engine) # Statements per request
+    if "pool_size" in options:
+        logger.info("Process %d: %s database pool of %d connections, up to %d under load",
+                    os.getpid(), name, options["pool_size"], options["pool_size"] + options["max_overflow"])
+    return engine
+
+def get_async_engine() -> AsyncEngine:
+    '''Asynchronous engine: request handlers (see get_db). Created by the app's lifespan in each worker.'''
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = _create_async_engine(_database_urls["async"], "async")
+    return _async_engine
+
+def replica_configured() -> bool:
+    return _database_urls["replica"] is not None
+
+def get_replica_engine() -> AsyncEngine:
+    '''Asynchronous engine on the read replica (DATABASE_REPLICA_URL), for read-only routes (see replicas.py).'''
+    global _replica_engine
+    if _replica_engine is None:
+        if not replica_configured():
+            raise RuntimeError("DATABASE_REPLICA_URL is not set")
+        _replica_engine = _create_async_engine(_database_urls["replica"], "replica")
+    return _replica_engine
+
+def configure(url: str, async_url: Optional[str] = None, replica_url: Optional[str] = None) -> None:
+    '''Point the engines at other databases (benchmarks). Engines already built must be disposed first.'''
+    if _engine is not None or _async_engine is not None or _replica_engine is not None:
+        raise RuntimeError("dispose_engines() before configuring another database")
+    _database_urls.update(sync=url, replica=async_database_url(replica_url) if replica_url else None,
+                          **{"async": async_url or async_database_url(url)})
+
+async def dispose_engines() -> None:
+    '''Close every pooled connection of this process; the engines are built again on next use.'''
+    global _engine, _async_engine, _replica_engine
+    if _replica_engine is not None:
+        await _replica_engine.dispose()
+        _replica_engine = None
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+
+def _drop_inherited_connections() -> None:
+    # A forked child (gunicorn worker, TTS synthesis process) must not talk over its parent's sockets.
+    # close=False: the parent still owns them; the child just starts with empty pools.
+    for engine in (_engine, _async_engine, _replica_engine):
+        if isinstance(engine, AsyncEngine):
+            engine = engine.sync_engine
+        if engine is not None:
+            engine.dispose(close=False)
+
+os.register_at_fork(after_in_child=_drop_inherited_connections)
+
+class _LazySessionmaker(sessionmaker):
+    def __call__(self, **local_kw):
+        local_kw.setdefault("bind", get_engine())
+        return super().__call__(**local_kw)
+
+class _LazyAsyncSessionmaker(async_sessionmaker):
+    def __init__(self, get_bind, **kw):
+        super().__init__(**kw)
+        self._get_bind = get_bind
+
+    def __call__(self, **local_kw):
+        local_kw.setdefault("bind", self._get_bind())
+        return super().__call__(**local_kw)
+
+SessionLocal = _LazySessionmaker(autocommit=False, autoflush=False)
+# expire_on_commit=False: returned objects are serialized after the commit, when lazy refreshes are not possible
+AsyncSessionLocal = _LazyAsyncSessionmaker(get_async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+ReplicaSessionLocal = _LazyAsyncSessionmaker(get_replica_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
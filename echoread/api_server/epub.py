@@ -0,0 +1,201 @@
+"""
+Lazy EPUB reader.
+
+Only the zip central directory, `META-INF/container.xml` and the OPF package
+document are read up front (title, author, spine). Chapter documents are
+decompressed and parsed one at a time, in small pieces, when `iter_chapters`
+is consumed, so memory stays bounded by the largest chapter rather than the
+whole book, and synthesis can start on chapter 1 while the rest is unread.
+"""
+import codecs
+import posixpath
+import re
+import zipfile
+import zlib
+import xml.etree.ElementTree as ET
+from html.parser import HTMLParser
+from typing import IO, Iterator, List, NamedTuple, Optional, Union
+from urllib.parse import unquote
+
+READ_SIZE = 64 * 1024 # Decompressed bytes fed to the HTML parser at a time
+
+# Elements whose end also ends the current sentence (headings, paragraphs, list items...)
+BLOCK_TAGS = {
+    "p", "div", "section", "article", "aside", "blockquote", "br", "hr", "li", "dt", "dd",
+    "h1", "h2", "h3", "h4", "h5", "h6", "tr", "td", "th", "pre", "figcaption", "title",
+}
+SKIPPED_TAGS = {"head", "script", "style", "svg", "math", "nav"}
+HEADING_TAGS = {"h1", "h2", "h3"}
+
+SENTENCE_END = re.compile(r"(?<=[.!?…])[\"'”’)\]]*\s+")
+WHITESPACE = re.compile(r"\s+")
+
+# What zipfile raises for a damaged member: bad CRC, corrupt deflate data, truncated file, unknown method
+CORRUPT_MEMBER_ERRORS = (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError)
+
+
+class EpubError(ValueError):
+    '''The file is not a readable EPUB.'''
+
+
+class Chapter(NamedTuple):
+    index: int # 1-based, counting only chapters that contain text
+    title: Optional[str]
+    sentences: List[str]
+
+    @property
+    def text(self) -> str:
+        return " ".join(self.sentences)
+
+
+class _SentenceExtractor(HTMLParser):
+    '''Incremental XHTML -> sentences. Feed it chunks, then drain `sentences`.'''
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.sentences: List[str] = []
+        self.title: Optional[str] = None
+        self._buffer: List[str] = []
+        self._skip_depth = 0
+        self._heading: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._flush()
+            if tag in HEADING_TAGS and self.title is None:
+                self._heading = []
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._flush()
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            if tag in HEADING_TAGS and self._heading is not None:
+                self.title = WHITESPACE.sub(" ", "".join(self._heading)).strip() or None
+                self._heading = None
+            self._flush()
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        self._buffer.append(data)
+        if self._heading is not None:
+            self._heading.append(data)
+        # Emit every complete sentence; keep the trailing fragment for the next chunk
+        if any(mark in data for mark in ".!?…"):
+            pieces = SENTENCE_END.split(WHITESPACE.sub(" ", "".join(self._buffer)))
+            self._buffer = [pieces.pop()]
+            self.sentences.extend(piece.strip() for piece in pieces if piece.strip())
+
+    def _flush(self):
+        text = WHITESPACE.sub(" ", "".join(self._buffer)).strip()
+        self._buffer = []
+        if text:
+            self.sentences.extend(piece.strip() for piece in SENTENCE_END.split(text) if piece.strip())
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+class EpubReader:
+    def __init__(self, source: Union[str, IO[bytes]]):
+        try:
+            self._zip = zipfile.ZipFile(source)
+        except zipfile.BadZipFile as exc:
+            raise EpubError(f"Invalid EPUB: {exc}") from exc
+        try:
+            self._read_package()
+        except BaseException:
+            self._zip.close() # Not returned to the caller, so nobody else would close it
+            raise
+
+    def _read_package(self) -> None:
+        try:
+            opf_path = self._find_package_document()
+            package = ET.fromstring(self._zip.read(opf_path))
+        except (KeyError, ET.ParseError, *CORRUPT_MEMBER_ERRORS) as exc:
+            raise EpubError(f"Invalid EPUB: {exc}") from exc
+
+        metadata = package.find("{*}metadata")
+        self.title = self._first_text(metadata, "{*}title")
+        self.author = self._first_text(metadata, "{*}creator")
+
+        opf_dir = posixpath.dirname(opf_path)
+        manifest = {}
+        for item in package.iterfind("{*}manifest/{*}item"):
+            href = item.get("href")
+            if item.get("id") and href:
+                manifest[item.get("id")] = (
+                    posixpath.normpath(posixpath.join(opf_dir, unquote(href))),
+                    item.get("media-type", ""),
+                )
+        self.spine: List[str] = []
+        for itemref in package.iterfind("{*}spine/{*}itemref"):
+            entry = manifest.get(itemref.get("idref"))
+            if entry is None or itemref.get("linear", "yes") == "no":
+                continue
+            href, media_type = entry
+            if "html" in media_type and href in self._zip.NameToInfo:
+                self.spine.append(href)
+        if not self.spine:
+            raise EpubError("Invalid EPUB: no readable documents in the spine")
+
+    def __enter__(self) -> "EpubReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._zip.close()
+
+    @property
+    def chapter_count(self) -> int:
+        '''Upper bound from the spine; documents without text (covers, blank pages) are skipped when reading.'''
+        return len(self.spine)
+
+    def iter_chapters(self) -> Iterator[Chapter]:
+        '''
+        Chapters with text, in spine order. A member that cannot be decompressed raises EpubError:
+        the file is malformed, and reading it again would fail the same way.
+        '''
+        index = 0
+        for href in self.spine:
+            extractor = _SentenceExtractor()
+            try:
+                self._feed(href, extractor)
+            except (KeyError, *CORRUPT_MEMBER_ERRORS) as exc:
+                raise EpubError(f"Invalid EPUB: cannot read {href}: {exc}") from exc
+            if extractor.sentences:
+                index += 1
+                yield Chapter(index=index, title=extractor.title, sentences=extractor.sentences)
+
+    def _feed(self, href: str, extractor: _SentenceExtractor) -> None:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        with self._zip.open(href) as member:
+            while True:
+                raw = member.read(READ_SIZE)
+                extractor.feed(decoder.decode(raw, final=not raw))
+                if not raw:
+                    break
+        extractor.close()
+
+    def _find_package_document(self) -> str:
+        container = ET.fromstring(self._zip.read("META-INF/container.xml"))
+        rootfile = container.find(".//{*}rootfile")
+        if rootfile is None or not rootfile.get("full-path"):
+            raise KeyError("container.xml has no rootfile")
+        return rootfile.get("full-path")
+
+    @staticmethod
+    def _first_text(parent, path: str) -> Optional[str]:
+        element = parent.find(path) if parent is not None else None
+        if element is None or not element.text:
+            return None
+        return WHITESPACE.sub(" ", element.text).strip() or None
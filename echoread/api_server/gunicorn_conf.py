@@ -1,8 +1,45 @@
+import gc
 import multiprocessing
+import os
+import shutil
+import tempfile
 
 bind = "0.0.0.0:8000"
-workers = multiprocessing.cpu_count() * 2 + 1
+# Every worker opens up to DB_POOL_SIZE + DB_MAX_OVERFLOW connections (README, "Connections"): size
+# WEB_CONCURRENCY against the database's max_connections, not just the core count.
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count() * 2 + 1)))
 worker_class = "uvicorn.workers.UvicornWorker"
+# Import the app once in the master and fork the workers from it: they share its memory copy-on-write
+# and start without importing anything. Importing the app opens no connections (database.py).
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0"
 # loglevel = "info" # Example
 # accesslog = "-" # Example: log to stdout
 # errorlog = "-"  # Example: log to stderr
+
+# Workers keep their metrics in this directory so a /metrics scrape of any of them sees all (metrics.py).
+# Set here, before the workers import the app: prometheus_client picks its storage at import time.
+metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "echoread-metrics"))
+
+
+def on_starting(server):
+    # Files of a previous run would be summed into this one's counters
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def when_ready(server):
+    from echoread.api_server import config
+    if not config.DB_PGBOUNCER:
+        per_worker = config.DB_POOL_SIZE + config.DB_MAX_OVERFLOW
+        server.log.info("Database connections: %d workers x up to %d = %d", server.num_workers, per_worker,
+                        server.num_workers * per_worker)
+    if preload_app:
+        # The preloaded objects live as long as the master. Moved out of the collector's reach, so a collection
+        # in a worker does not write to (and un-share) every page that holds one of them.
+        gc.freeze()
+
+
+def child_exit(server, worker):
+    # Drop the dead worker's live gauges (requests in progress); its counters and histograms are kept
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
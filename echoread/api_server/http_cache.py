@@ -0,0 +1,101 @@
+"""
+Conditional GETs and an in-process response cache for per-book JSON responses.
+
+Every book has a `version` that is bumped whenever the book or its audios
+change (see models.py and worker.py), so (book id, version) identifies a
+representation exactly. Routes read just the version (one indexed column, no ORM
+objects) and then:
+
+* answer `If-None-Match` with a 304 when the client already has that version;
+* otherwise serve the serialized body cached under (book id, version, variant),
+  if there is one;
+* otherwise load and serialize the response, and cache it for the next request.
+
+Entries never need invalidation: a change produces a new version, and the old
+entries age out of the LRU. A finished book never changes, so its responses are
+served from cache for as long as they stay in the LRU.
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+from starlette.responses import Response
+
+from echoread.api_server import config
+
+# Clients may keep the body but must revalidate it (cheaply, with If-None-Match) before reuse
+CACHE_CONTROL = "private, no-cache"
+
+
+def book_etag(book_id: str, version: int) -> str:
+    # Strong validator: a version identifies the exact bytes of each of the book's representations
+    return f'"{book_id}.{version}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+
+class ResponseCache:
+    '''LRU of serialized response bodies (and their extra headers), keyed by (book id, version, variant).'''
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[bytes, Dict[str, str]]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Tuple[bytes, Dict[str, str]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Hashable, body: bytes, headers: Dict[str, str]) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (body, headers)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+response_cache = ResponseCache(config.RESPONSE_CACHE_SIZE)
+
+
+def _json_response(body: bytes, etag: str, headers: Dict[str, str]) -> Response:
+    return Response(content=body, media_type="application/json",
+                    headers={"etag": etag, "cache-control": CACHE_CONTROL, **headers})
+
+
+def cached_book_response(if_none_match: Optional[str], book_id: str, version: int, variant: str) -> Optional[Response]:
+    '''A 304 if the client has this version, else the cached response if there is one, else None.'''
+    etag = book_etag(book_id, version)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"etag": etag, "cache-control": CACHE_CONTROL})
+    entry = response_cache.get((book_id, version, variant))
+    if entry is None:
+        return None
+    return _json_response(entry[0], etag, entry[1])
+
+
+def book_response(book_id: str, version: int, variant: str, body: bytes,
+                  headers: Optional[Dict[str, str]] = None) -> Response:
+    '''Cache a freshly serialized body under (book_id, version, variant) and return it with its ETag.'''
+    headers = headers or {}
+    response_cache.put((book_id, version, variant), body, headers)
+    return _json_response(body, book_etag(book_id, version), headers)
@@ -0,0 +1,103 @@
+"""
+Durable TTS job queue stored in the `jobs` table.
+
+The API enqueues one job per uploaded book and returns immediately; TTS workers
+(see worker.py) claim jobs one at a time. Claiming uses
+SELECT ... FOR UPDATE SKIP LOCKED on PostgreSQL so several workers can poll the
+same table without blocking each other, followed by a conditional UPDATE so the
+claim is also race-free on SQLite (which ignores FOR UPDATE).
+
+A worker refreshes `heartbeat_at` on its running jobs every
+TTS_JOB_HEARTBEAT_INTERVAL and whenever it commits a chapter. A running job
+whose heartbeat is older than TTS_JOB_TIMEOUT lost its worker and is put back
+in the queue, however long the book itself takes.
+"""
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from echoread.api_server import models
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+KIND_SYNTHESIZE_BOOK = "synthesize_book"
+
+
+def enqueue_book_synthesis(db: Session, book: models.Book) -> models.Job:
+    '''Add a synthesis job for `book` to the session. The caller commits.'''
+    job = models.Job(book_id=book.id, kind=KIND_SYNTHESIZE_BOOK, status=JOB_QUEUED)
+    db.add(job)
+    return job
+
+
+def claim_next_job(db: Session, worker_id: str) -> Optional[models.Job]:
+    '''Atomically move the oldest queued job to `running` and return it, or None if the queue is empty.'''
+    while True:
+        candidate = db.query(models.Job.id).filter(
+            models.Job.status == JOB_QUEUED
+        ).order_by(models.Job.created_at).limit(1).with_for_update(skip_locked=True).first()
+        if candidate is None:
+            db.rollback() # Release the (empty) transaction
+            return None
+
+        claimed = db.query(models.Job).filter(
+            models.Job.id == candidate.id,
+            models.Job.status == JOB_QUEUED, # Another worker may have claimed it in between (SQLite)
+        ).update({
+            models.Job.status: JOB_RUNNING,
+            models.Job.attempts: models.Job.attempts + 1,
+            models.Job.locked_by: worker_id,
+            models.Job.started_at: datetime.utcnow(),
+            models.Job.heartbeat_at: datetime.utcnow(),
+        }, synchronize_session=False)
+        db.commit()
+        if claimed:
+            return db.get(models.Job, candidate.id)
+
+
+def complete_job(db: Session, job: models.Job) -> None:
+    job.status = JOB_DONE
+    job.error = None
+    job.finished_at = datetime.utcnow()
+
+
+def fail_job(db: Session, job: models.Job, error: str, max_attempts: int) -> bool:
+    '''Record a failure. Returns True if the job was put back in the queue for another attempt.'''
+    job.error = error
+    if job.attempts < max_attempts:
+        job.status = JOB_QUEUED
+        job.locked_by = None
+        return True
+    job.status = JOB_FAILED
+    job.finished_at = datetime.utcnow()
+    return False
+
+
+def heartbeat(db: Session, job_ids: Iterable[str], worker_id: str) -> int:
+    '''Mark `job_ids` as still being worked on by `worker_id`; returns how many are.'''
+    job_ids = list(job_ids)
+    if not job_ids:
+        return 0
+    count = db.query(models.Job).filter(
+        models.Job.id.in_(job_ids),
+        models.Job.status == JOB_RUNNING,
+        models.Job.locked_by == worker_id,
+    ).update({models.Job.heartbeat_at: datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+    return count
+
+
+def requeue_stale_jobs(db: Session, timeout_seconds: int) -> int:
+    '''Put back jobs whose worker died mid-run (`running`, with no heartbeat for `timeout_seconds`).'''
+    cutoff = datetime.utcnow() - timedelta(seconds=timeout_seconds)
+    count = db.query(models.Job).filter(
+        models.Job.status == JOB_RUNNING,
+        func.coalesce(models.Job.heartbeat_at, models.Job.started_at) < cutoff,
+    ).update({models.Job.status: JOB_QUEUED, models.Job.locked_by: None}, synchronize_session=False)
+    db.commit()
+    return count
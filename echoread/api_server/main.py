@@ -1,23 +1,85 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
 
+from typing import Optional
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Response, status
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from echoread.api_server import config, database, jobs, metrics, models, playback, profiling, progress, reaper, replicas
+from echoread.api_server.database import get_db
+from echoread.api_server.storage import UploadSizeLimitMiddleware
 # Import the routers
-from echoread.api_server.routers import auth, users, books, plays # Relative imports for routers
+from echoread.api_server.routers import auth, users, books, plays, media # Relative imports for routers
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Built here, in the worker process, never in a gunicorn master that preloaded the app (database.py)
+    database.get_async_engine()
+    if database.replica_configured():
+        database.get_replica_engine()
+    if playback.position_buffer is not None:
+        playback.position_buffer.start()
+    # Removes deleted books' files in the background (see reaper.py)
+    if reaper.reaper is not None:
+        reaper.reaper.start()
+    yield
+    # Buffered play positions are written before the process exits (see playback.py)
+    if playback.position_buffer is not None:
+        await playback.position_buffer.close()
+    # End open progress streams; EventSource clients reconnect to another process
+    await progress.broker.close()
+    if reaper.reaper is not None:
+        await reaper.reaper.close()
+    # Pooled async connections belong to this event loop; close them before it stops
+    await database.dispose_engines()
 
 app = FastAPI(
     title="EchoRead API",
     description="API for EchoRead mobile application, including TTS generation from EPUBs.",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan,
 )
 
+# Reject oversized EPUB uploads before their body is read
+app.add_middleware(UploadSizeLimitMiddleware)
+# Pins users who just wrote to the primary database, so their reads see their writes (see replicas.py)
+if config.DATABASE_REPLICA_URL:
+    app.add_middleware(replicas.ReadYourWritesMiddleware)
+# Profiles single requests on demand or at random (see profiling.py); not installed at all otherwise
+if config.PROFILE_TOKEN or config.PROFILE_SAMPLE_RATE > 0:
+    app.add_middleware(profiling.ProfilingMiddleware)
+# Outermost, so rejected uploads and unhandled errors are timed as well
+if config.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
 @app.get("/")
 async def read_root():
     return {"message": "Welcome to EchoRead API"}
 
+def require_metrics_token(authorization: Optional[str] = Header(None)) -> None:
+    if not config.METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found") # Not configured: not served
+    if not metrics.scrape_authorized(authorization, config.METRICS_TOKEN):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_metrics_token)])
+async def read_metrics(db: AsyncSession = Depends(get_db)):
+    # Prometheus scrape target (bearer_token / authorization in the scrape config); see metrics.py
+    job_counts = dict.fromkeys((jobs.JOB_QUEUED, jobs.JOB_RUNNING, jobs.JOB_DONE, jobs.JOB_FAILED), 0) # Zeros too
+    job_counts.update((await db.execute(select(models.Job.status, func.count()).group_by(models.Job.status))).all())
+    await db.close()
+    # Aggregating every worker's files is file I/O: off the event loop
+    return Response(await run_in_threadpool(metrics.render, job_counts), media_type=metrics.CONTENT_TYPE)
+
 # Include the routers in the app
 app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(books.router)
 app.include_router(plays.router)
+app.include_router(media.router)
 
 # To run this app (save as main.py in api_server directory):
 # Ensure you are in the 'echoread' directory (one level above api_server)
@@ -0,0 +1,165 @@
+"""
+File serving helpers for generated chapter audio.
+
+Chapters can be long (40+ minutes), so players seek with HTTP `Range` requests
+instead of re-downloading the whole file. `file_response` handles the
+conditional / partial request logic and `FileRangeResponse` moves the bytes,
+using the ASGI zero-copy extensions when the server offers them.
+"""
+import mimetypes
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+
+import anyio
+from fastapi import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from echoread.api_server.http_cache import etag_matches
+
+CHUNK_SIZE = 256 * 1024 # Fallback read size when the server has no zero-copy extension
+
+
+def make_etag(stat_result: os.stat_result) -> str:
+    # Chapter files are written once and never modified in place,
+    # so size + mtime is enough for a strong validator.
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    '''
+    Parse a single `bytes=` range into an inclusive (start, end) pair.
+    Returns None when the header should be ignored (malformed or multi-range),
+    and raises ValueError when the range cannot be satisfied.
+    '''
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None # Multi-range is rarely used by players; serve the full body instead
+    start_str, sep, end_str = spec.strip().partition("-")
+    if not sep or not (start_str or end_str):
+        return None
+    if (start_str and not start_str.isdigit()) or (end_str and not end_str.isdigit()):
+        return None
+    if not start_str: # Suffix range: the last N bytes
+        length = int(end_str)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(start_str)
+    end = int(end_str) if end_str else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, size - 1)
+
+
+def _not_modified_since(header: str, mtime: float) -> bool:
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+class FileRangeResponse(Response):
+    '''
+    Streams `count` bytes of `path` starting at `offset`.
+
+    When the ASGI server advertises `http.response.zerocopysend` the open file
+    descriptor is handed over and the server uses sendfile(); for full-file
+    responses `http.response.pathsend` is used when available. Otherwise the
+    file is read in CHUNK_SIZE pieces on a worker thread.
+    '''
+
+    def __init__(self, path: str, offset: int, count: int, status_code: int = 200,
+                 headers: Optional[dict] = None, media_type: Optional[str] = None,
+                 full_file: bool = False):
+        self.path = path
+        self.offset = offset
+        self.count = count
+        self.full_file = full_file
+        super().__init__(content=None, status_code=status_code, headers=headers, media_type=media_type)
+        self.headers["content-length"] = str(count)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method") == "HEAD" or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        else:
+            extensions = scope.get("extensions") or {}
+            if self.full_file and "http.response.pathsend" in extensions:
+                await send({"type": "http.response.pathsend", "path": self.path})
+            elif "http.response.zerocopysend" in extensions:
+                await self._send_zerocopy(send)
+            else:
+                await self._send_chunks(send)
+        if self.background is not None:
+            await self.background()
+
+    async def _send_zerocopy(self, send: Send) -> None:
+        with open(self.path, "rb") as file:
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": file,
+                "offset": self.offset,
+                "count": self.count,
+                "more_body": False,
+            })
+
+    async def _send_chunks(self, send: Send) -> None:
+        remaining = self.count
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.offset)
+            while remaining > 0:
+                chunk = await file.read(min(CHUNK_SIZE, remaining))
+                if not chunk: # File was truncated underneath us
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def file_response(request: Request, path: str, media_type: Optional[str] = None,
+                  cache_control: str = "private, max-age=3600") -> Response:
+    '''
+    Build the response for a GET/HEAD of a file on disk, honouring
+    If-None-Match, If-Modified-Since, Range and If-Range.
+    Raises FileNotFoundError if the file does not exist.
+    '''
+    stat_result = os.stat(path)
+    size = stat_result.st_size
+    etag = make_etag(stat_result)
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    headers = {
+        "accept-ranges": "bytes",
+        "etag": etag,
+        "last-modified": last_modified,
+        "cache-control": cache_control,
+    }
+    media_type = media_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+    elif _not_modified_since(request.headers.get("if-modified-since"), stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and if_range and if_range.strip() not in (etag, last_modified):
+        range_header = None # Representation changed since the client's partial copy: send it all
+
+    if range_header:
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            headers["content-range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+            return FileRangeResponse(path, start, end - start + 1, status_code=206,
+                                     headers=headers, media_type=media_type)
+
+    return FileRangeResponse(path, 0, size, headers=headers, media_type=media_type, full_file=True)
@@ -0,0 +1,219 @@
+"""
+Prometheus metrics, served at GET /metrics.
+
+Under gunicorn every worker process has its own counters. When
+PROMETHEUS_MULTIPROC_DIR is set (gunicorn_conf.py sets it), prometheus_client
+keeps them in memory-mapped files in that directory and a scrape of any worker
+aggregates all of them. Without it (uvicorn, tests) the process' own values
+are served.
+
+What is measured:
+
+* request latency and count per route template (`/books/{book_id}`, not the
+  raw path, so the number of series stays bounded);
+* SQL statements and time spent in them per request, through cursor events on
+  the instrumented engines (instrument_engine). The totals are kept in a
+  contextvar and observed once when the request ends;
+* time to get a connection from each engine's pool, by the pool class the
+  engine is built with (timed_pool_class);
+* TTS job queue depth, counted from the jobs table at scrape time;
+* synthesis time per chapter and time from upload to the first playable
+  chapter, observed by the TTS worker (worker.py).
+
+GET /metrics is only served to scrapers sending `Authorization: Bearer
+<METRICS_TOKEN>`; without a METRICS_TOKEN it answers 404, so the endpoint is
+never open by accident when the app is exposed.
+
+The per-request cost is a few dict and float operations plus one histogram
+observation per metric; see benchmarks/bench_metrics.py.
+"""
+import hmac
+import os
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from echoread.api_server import config
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+UNMATCHED_ROUTE = "<unmatched>" # 404s and other requests no route claimed; keeps raw paths out of the labels
+METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS")) # Anything else is labelled OTHER
+
+REQUEST_SECONDS = Histogram(
+    "echoread_http_request_duration_seconds", "Time until the response was fully sent, per route template",
+    ["method", "route"], buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+REQUESTS = Counter("echoread_http_requests", "Responses sent, per route template and status", ["method", "route", "status"])
+REQUESTS_IN_PROGRESS = Gauge("echoread_http_requests_in_progress", "Requests being handled", multiprocess_mode="livesum")
+REQUEST_STATEMENTS = Histogram(
+    "echoread_db_statements_per_request", "SQL statements executed while handling a request", ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+REQUEST_DB_SECONDS = Histogram(
+    "echoread_db_seconds_per_request", "Time spent executing SQL statements while handling a request", ["route"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+POOL_CHECKOUT_SECONDS = Histogram(
+    "echoread_db_pool_checkout_seconds",
+    "Time to get a connection from the pool, including waits for a free one and opening new ones", ["engine"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+CHAPTER_SYNTHESIS_SECONDS = Histogram(
+    "echoread_tts_chapter_synthesis_seconds", "Time from submitting a chapter's sentences to its file being written",
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+FIRST_CHAPTER_SECONDS = Histogram(
+    "echoread_tts_time_to_first_chapter_seconds", "Time from a book's upload until its first chapter was playable",
+    buckets=(1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+
+# [statements, seconds] of the request being handled; None outside requests (TTS worker, scripts)
+_request_db: ContextVar[Optional[List[float]]] = ContextVar("echoread_request_db", default=None)
+
+
+def scrape_authorized(authorization: Optional[str], token: Optional[str]) -> bool:
+    '''Whether the Authorization header of a /metrics request carries `token` (never, if `token` is unset).'''
+    if not token:
+        return False
+    scheme, _, credentials = (authorization or "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(credentials.encode(), token.encode())
+
+
+def multiprocess_dir() -> Optional[str]:
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+
+class MetricsMiddleware:
+    '''Observe latency, status and SQL work of every HTTP request, labelled by route template.'''
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        # Labelled children per (method, route) and (method, route, status): labels() costs a lock and a lookup
+        self._observers: Dict[tuple, tuple] = {}
+        self._counters: Dict[tuple, Counter] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500 # Unless a response is started
+        db = [0, 0.0]
+        token = _request_db.set(db)
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        REQUESTS_IN_PROGRESS.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_db.reset(token)
+            REQUESTS_IN_PROGRESS.dec()
+            route = scope.get("route") # Set by the router on the scope it shares with us
+            template = getattr(route, "path", UNMATCHED_ROUTE)
+            method = scope["method"] if scope["method"] in METHODS else "OTHER"
+            self._observe(method, template, status, elapsed, db)
+
+    def _observe(self, method: str, template: str, status: int, elapsed: float, db: list) -> None:
+        observers = self._observers.get((method, template))
+        if observers is None:
+            observers = self._observers[(method, template)] = (
+                REQUEST_SECONDS.labels(method, template),
+                REQUEST_STATEMENTS.labels(template),
+                REQUEST_DB_SECONDS.labels(template),
+            )
+        latency, statements, db_seconds = observers
+        latency.observe(elapsed)
+        statements.observe(db[0])
+        db_seconds.observe(db[1])
+        counter = self._counters.get((method, template, status))
+        if counter is None:
+            counter = self._counters[(method, template, status)] = REQUESTS.labels(method, template, str(status))
+        counter.inc()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._echoread_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    db = _request_db.get()
+    if db is not None:
+        db[0] += 1
+        db[1] += time.perf_counter() - context._echoread_started
+
+
+_timed_pool_classes: Dict[tuple, type] = {}
+
+
+def timed_pool_class(pool_class: type, name: str) -> type:
+    '''
+    The pool class to build engine `name` with (create_engine's poolclass=): a subclass of `pool_class`
+    timing _do_get, the hook every pool implements to hand out a connection (SQLAlchemy has no event
+    before a checkout). Being the engine's own class, the timing also survives engine.dispose(), which
+    recreates the pool from it. `pool_class` itself when metrics are disabled.
+    '''
+    if not config.METRICS_ENABLED:
+        return pool_class
+    key = (pool_class, name)
+    if key not in _timed_pool_classes:
+        checkout_seconds = POOL_CHECKOUT_SECONDS.labels(name)
+
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return pool_class._do_get(self)
+            finally:
+                checkout_seconds.observe(time.perf_counter() - started)
+
+        _timed_pool_classes[key] = type(f"Timed{pool_class.__name__}", (pool_class,), {"_do_get": _do_get})
+    return _timed_pool_classes[key]
+
+
+def instrument_engine(engine: Engine) -> None:
+    '''
+    Count the statements `engine` executes per request. Pool checkouts are timed by building the
+    engine with timed_pool_class. For an AsyncEngine, pass `async_engine.sync_engine`.
+    '''
+    if not config.METRICS_ENABLED:
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class _JobQueueCollector:
+    '''Queue depth as counted by the scraping process; not kept per process, so not aggregated.'''
+
+    def __init__(self, job_counts: Dict[str, int]):
+        self.job_counts = job_counts
+
+    def collect(self):
+        family = GaugeMetricFamily("echoread_tts_jobs", "TTS jobs in the queue table, by status", labels=["status"])
+        for status, count in sorted(self.job_counts.items()):
+            family.add_metric([status], count)
+        yield family
+
+
+def render(job_counts: Dict[str, int]) -> bytes:
+    '''The text exposition of all metrics: this process' (or every worker's, in multiprocess mode) plus `job_counts`.'''
+    if multiprocess_dir():
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    queue = CollectorRegistry()
+    queue.register(_JobQueueCollector(job_counts))
+    return generate_latest(registry) + generate_latest(queue)
@@ -1,5 +1,5 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, Integer, Text, Float
-from sqlalchemy.orm import relationship
+from sqlalchemy import BigInteger, Column, String, DateTime, ForeignKey, Integer, Text, Float, Index, event
+from sqlalchemy.orm import object_session, relationship
 from pydantic import BaseModel, Field as PydanticField, field_serializer # Added field_serializer here
 from typing import List, Optional
 from datetime import datetime
@@ -20,42 +20,68 @@ class User(Base):
 
 class Book(Base):
     __tablename__ = "books"
+    __table_args__ = (
+        # A user uploading the same EPUB twice gets the existing book back
+        Index("ix_books_user_id_content_sha256", "user_id", "content_sha256", unique=True),
+        Index("ix_books_user_id_created_at", "user_id", "created_at", "id"), # A user's library, newest first
+    )
 
     id = Column(String, primary_key=True, index=True)
     user_id = Column(String, ForeignKey("users.id"), nullable=False)
     title = Column(String, nullable=False)
     author = Column(String, nullable=True)
     epub_path = Column(String, nullable=True)
+    content_sha256 = Column(String(64), nullable=True) # SHA-256 of the uploaded EPUB, for duplicate detection
     status = Column(String, default="pending")
     chapter_count = Column(Integer, nullable=True)
+    processed_chapters = Column(Integer, nullable=False, default=0, server_default="0") # Chapters with audio; kept by the worker
+    version = Column(Integer, nullable=False, default=1, server_default="1") # Bumped on every change to the book or its audios (ETags)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     owner = relationship("User", back_populates="books")
-    audios = relationship("Audio", back_populates="book", cascade="all, delete-orphan")
+    # passive_deletes: ON DELETE CASCADE removes the rows, so deleting a book doesn't load its audios, plays and jobs
+    audios = relationship("Audio", back_populates="book", cascade="all, delete-orphan", order_by="Audio.chapter_index",
+                          passive_deletes=True)
+    jobs = relationship("Job", back_populates="book", cascade="all, delete-orphan", passive_deletes=True)
     # If Play model has a direct FK to Book, a relationship here might be useful too.
     # plays = relationship("Play", back_populates="book") # If Play.book_id is a direct FK
 
+@event.listens_for(Book, "before_update")
+def _bump_book_version(mapper, connection, target):
+    # Any ORM change to a book makes its cached responses stale (see http_cache.py);
+    # bulk UPDATEs of books, and new chapters (worker.py), bump the version themselves
+    if object_session(target).is_modified(target, include_collections=False):
+        target.version = Book.version + 1
+
 class Audio(Base):
     __tablename__ = "audios"
+    __table_args__ = (
+        Index("ux_audios_book_id_chapter_index", "book_id", "chapter_index", unique=True), # One audio per chapter
+    )
 
     id = Column(String, primary_key=True, index=True, default=lambda: "audio_" + str(uuid.uuid4()))
-    book_id = Column(String, ForeignKey("books.id"), nullable=False)
+    book_id = Column(String, ForeignKey("books.id", ondelete="CASCADE"), nullable=False)
     chapter_index = Column(Integer, nullable=False)
     audio_path = Column(String, nullable=True)
     url = Column(String, nullable=True)
     duration = Column(Float, nullable=True)
+    crc32 = Column(BigInteger, nullable=True) # Of the chapter file, for whole-book zips (book_zip.py); unsigned, hence 64-bit
     created_at = Column(DateTime, default=datetime.utcnow)
 
     book = relationship("Book", back_populates="audios")
-    plays = relationship("Play", back_populates="audio_played", cascade="all, delete-orphan")
+    plays = relationship("Play", back_populates="audio_played", cascade="all, delete-orphan", passive_deletes=True)
 
 class Play(Base):
     __tablename__ = "plays"
+    __table_args__ = (
+        Index("ux_plays_user_id_book_id", "user_id", "book_id", unique=True), # One position per user and book (upsert target)
+    )
 
     id = Column(String, primary_key=True, index=True, default=lambda: "play_" + str(uuid.uuid4()))
     user_id = Column(String, ForeignKey("users.id"), nullable=False)
-    book_id = Column(String, ForeignKey("books.id"), nullable=False)
-    audio_id = Column(String, ForeignKey("audios.id"), nullable=False)
+    # Indexed: ON DELETE CASCADE looks plays up by each deleted book and audio
+    book_id = Column(String, ForeignKey("books.id", ondelete="CASCADE"), nullable=False, index=True)
+    audio_id = Column(String, ForeignKey("audios.id", ondelete="CASCADE"), nullable=False, index=True)
     last_timestamp = Column(Float, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -63,6 +89,27 @@ class Play(Base):
     book = relationship("Book") # Direct relationship to Book
     audio_played = relationship("Audio", back_populates="plays")
 
+class Job(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_status_created_at", "status", "created_at"), # Queue polling: oldest queued job first
+    )
+
+    id = Column(String, primary_key=True, index=True, default=lambda: "job_" + str(uuid.uuid4()))
+    book_id = Column(String, ForeignKey("books.id", ondelete="CASCADE"), nullable=False, index=True)
+    kind = Column(String, nullable=False, default="synthesize_book")
+    status = Column(String, nullable=False, default="queued") # queued -> running -> done / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    locked_by = Column(String, nullable=True) # Worker that claimed the job
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True) # Refreshed by the worker while it runs the job (jobs.requeue_stale_jobs)
+    first_chapter_at = Column(DateTime, nullable=True) # When the first chapter became playable
+    finished_at = Column(DateTime, nullable=True)
+
+    book = relationship("Book", back_populates="jobs")
+
 
 # --- Pydantic Models for API interaction ---
 
@@ -134,6 +181,7 @@ class PlayResponse(PlayBase): # Response model for play position
 class AudioURLResponse(BaseModel):
     url: str
     expires_in: int
+    playlist_url: Optional[str] = None # Segmented (HLS-style) version of the chapter, when it was packaged
 
 # Existing Pydantic models - to be reviewed and updated/replaced
 class BookMetadata(BaseModel): # Can potentially be replaced by BookResponse or a subset
@@ -156,7 +204,7 @@ class BookDetail(BookResponse): # Inherit from BookResponse to get all base fiel
 
 
 class AudioChapterInfo(BaseModel): # Can be derived/replaced by AudioResponse
-    audio_id: str # from AudioResponse.id
+    audio_id: str = PydanticField(validation_alias="id") # from Audio.id (ORM) / AudioResponse.id
     chapter_index: int # from AudioResponse.chapter_index
     url: Optional[str] = None # from AudioResponse.url
     duration: Optional[float] = None # from AudioResponse.duration
@@ -164,6 +212,25 @@ class AudioChapterInfo(BaseModel): # Can be derived/replaced by AudioResponse
         from_attributes = True
 
 
+# Shapes of the list endpoints' `fields=` projections: each item has only the requested keys
+class BookFields(BaseModel):
+    id: Optional[str] = None
+    user_id: Optional[str] = None
+    title: Optional[str] = None
+    author: Optional[str] = None
+    epub_path: Optional[str] = None
+    status: Optional[str] = None
+    chapter_count: Optional[int] = None
+    created_at: Optional[datetime] = None
+
+
+class AudioChapterFields(BaseModel):
+    audio_id: Optional[str] = None
+    chapter_index: Optional[int] = None
+    url: Optional[str] = None
+    duration: Optional[float] = None
+
+
 class PlayPosition(BaseModel): # Can be derived/replaced by PlayResponse
     book_id: str
     audio_id: str
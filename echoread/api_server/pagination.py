@@ -0,0 +1,73 @@
+"""
+Keyset (cursor) pagination and sparse field selection for list endpoints.
+
+Pages are ordered by a unique sort key (e.g. `(created_at, id)` for books) and
+the next page starts strictly after the last key of the previous one, so each
+page is one index range scan of `limit + 1` rows however deep it is (no OFFSET).
+The key is handed to the client as an opaque cursor in the `Link: <...>;
+rel="next"` and `X-Next-Cursor` headers; the response body stays a plain list.
+A request with neither `limit` nor `cursor` gets the whole list, as before
+pagination existed (see `page_size`).
+
+`fields=a,b,c` selects only those columns in SQL and returns them as-is.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+from fastapi import HTTPException, Request, Response, status
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def page_size(limit: Optional[int], cursor: Optional[str]) -> Optional[int]:
+    '''Rows on this page: `limit`, DEFAULT_PAGE_SIZE for a cursor without one, None (all of them) for neither.'''
+    if limit is None and cursor:
+        return DEFAULT_PAGE_SIZE
+    return limit
+
+
+def encode_cursor(key: Sequence[Any]) -> str:
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in key]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, types: Sequence[type]) -> List[Any]:
+    '''Decode a cursor made by `encode_cursor` into values of `types`; 400 if it was tampered with.'''
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError(cursor)
+        return [datetime.fromisoformat(value) if kind is datetime else kind(value) for kind, value in zip(types, values)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def parse_fields(fields: Optional[str], allowed: Dict[str, Any]) -> Optional[List[str]]:
+    '''Requested field names (in request order), or None for the full representation.'''
+    if not fields:
+        return None
+    names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in allowed]
+    if unknown or not names:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown field(s): {', '.join(unknown) or '(none given)'}. Available: {', '.join(allowed)}",
+        )
+    return names
+
+
+def next_page_headers(request: Request, next_key: Optional[Sequence[Any]]) -> Dict[str, str]:
+    if next_key is None:
+        return {} # Last page
+    cursor = encode_cursor(next_key)
+    return {
+        "X-Next-Cursor": cursor,
+        "Link": f'<{request.url.include_query_params(cursor=cursor)}>; rel="next"',
+    }
+
+
+def set_next_page(request: Request, response: Response, next_key: Optional[Sequence[Any]]) -> None:
+    response.headers.update(next_page_headers(request, next_key))
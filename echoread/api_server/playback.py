@@ -0,0 +1,202 @@
+"""
+Storage of playback positions (the `plays` table).
+
+Clients post their position every few seconds, so this is the hottest write
+path. There is one row per (user, book), with a deterministic id, written by a
+single INSERT ... SELECT ... ON CONFLICT DO UPDATE statement. The SELECT joins
+audios and books, so the same statement checks that the chapter belongs to the
+caller's book; an empty RETURNING means the position was rejected.
+Out-of-order writes never move a position back in time: the update only
+applies when its `updated_at` is newer.
+
+With PLAY_WRITE_BEHIND_MS > 0, positions go to a `PositionBuffer` instead. It
+keeps only the latest position per (user, book) in memory and flushes them in
+one batch every PLAY_WRITE_BEHIND_MS. Reads consult the buffer first, but
+only the buffer of their own process: a read served by another worker process
+(gunicorn runs several) gets the database row, which can be up to one flush
+interval behind. Only the worker that took a heartbeat returns it at once. A
+client keeps its latest position itself, so this only shows when resuming on
+another device within PLAY_WRITE_BEHIND_MS of the last heartbeat; keep the
+interval short (the default is off).
+Durability: an acknowledged position is in the database within one flush
+interval. On a clean shutdown (SIGTERM; see main.py) the buffer is flushed
+before the process exits. A crash (SIGKILL, OOM) loses at most the last
+interval of positions, which the client's next heartbeat rewrites anyway.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import DateTime, Float, String, bindparam, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from echoread.api_server import config, models
+
+logger = logging.getLogger("echoread.playback")
+
+# Play ids are derived from (user, book), so a buffered position has its final id before it is written
+PLAY_ID_NAMESPACE = uuid.UUID("5f1d0c52-8f55-4b0e-9a43-3f1c2b7f6a10")
+
+COLUMNS = ("id", "user_id", "book_id", "audio_id", "last_timestamp", "updated_at")
+
+
+def play_id(user_id: str, book_id: str) -> str:
+    return "play_" + str(uuid.uuid5(PLAY_ID_NAMESPACE, f"{user_id}/{book_id}"))
+
+
+class PlayPosition(NamedTuple):
+    id: str
+    user_id: str
+    book_id: str
+    audio_id: str
+    last_timestamp: float
+    updated_at: datetime
+
+
+def new_position(user_id: str, book_id: str, audio_id: str, last_timestamp: float) -> PlayPosition:
+    return PlayPosition(play_id(user_id, book_id), user_id, book_id, audio_id, last_timestamp, datetime.utcnow())
+
+
+def _upsert_statement(dialect_name: str, returning: bool):
+    '''INSERT ... SELECT ... ON CONFLICT (user_id, book_id) DO UPDATE, with one bind parameter per PlayPosition field.'''
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    source = select(
+        bindparam("id", type_=String),
+        models.Book.user_id,
+        models.Audio.book_id,
+        models.Audio.id,
+        bindparam("last_timestamp", type_=Float),
+        bindparam("updated_at", type_=DateTime),
+    ).join(models.Book, models.Book.id == models.Audio.book_id).where(
+        models.Audio.id == bindparam("audio_id", type_=String),
+        models.Audio.book_id == bindparam("book_id", type_=String),
+        models.Book.user_id == bindparam("user_id", type_=String),
+    )
+    plays = models.Play.__table__ # Core insert: the ORM bulk-insert path doesn't take INSERT ... SELECT
+    statement = insert(plays).from_select(list(COLUMNS), source)
+    statement = statement.on_conflict_do_update(
+        index_elements=[plays.c.user_id, plays.c.book_id],
+        set_={
+            "audio_id": statement.excluded.audio_id,
+            "last_timestamp": statement.excluded.last_timestamp,
+            "updated_at": statement.excluded.updated_at,
+        },
+        where=plays.c.updated_at <= statement.excluded.updated_at, # Never go back to an older heartbeat
+    )
+    if returning:
+        statement = statement.returning(*(plays.c[column] for column in COLUMNS))
+    return statement
+
+
+async def upsert_position(db: AsyncSession, position: PlayPosition) -> Optional[PlayPosition]:
+    '''
+    Write `position` in one statement and commit. Returns the stored position, or None if the
+    chapter does not belong to the user's book (or a newer position is already stored).
+    '''
+    result = await db.execute(_upsert_statement(db.bind.dialect.name, returning=True), position._asdict())
+    row = result.first()
+    await db.commit()
+    return PlayPosition(*row) if row else None
+
+
+async def chapter_belongs_to_user(db: AsyncSession, user_id: str, book_id: str, audio_id: str) -> bool:
+    return await db.scalar(
+        select(models.Audio.id).join(models.Book, models.Book.id == models.Audio.book_id).where(
+            models.Audio.id == audio_id, models.Audio.book_id == book_id, models.Book.user_id == user_id
+        )
+    ) is not None
+
+
+async def get_position(db: AsyncSession, user_id: str, book_id: str) -> Optional[PlayPosition]:
+    '''The stored position, or the one buffered in this process (not in other workers; see above).'''
+    if position_buffer is not None:
+        buffered = position_buffer.get(user_id, book_id)
+        if buffered is not None:
+            return buffered
+    row = (await db.execute(
+        select(*(getattr(models.Play, column) for column in COLUMNS)).where(
+            models.Play.user_id == user_id, models.Play.book_id == book_id
+        )
+    )).first()
+    return PlayPosition(*row) if row else None
+
+
+class PositionBuffer:
+    '''Write-behind buffer: latest position per (user, book), flushed in batches every `interval` seconds.'''
+    def __init__(self, session_factory: async_sessionmaker, interval: float):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.flushes = 0
+        self.written = 0
+        self._pending: Dict[Tuple[str, str], PlayPosition] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def put(self, position: PlayPosition) -> None:
+        key = (position.user_id, position.book_id)
+        current = self._pending.get(key)
+        if current is None or current.updated_at <= position.updated_at:
+            self._pending[key] = position # Older heartbeats for the same book are coalesced away
+
+    def get(self, user_id: str, book_id: str) -> Optional[PlayPosition]:
+        return self._pending.get((user_id, book_id))
+
+    async def flush(self) -> int:
+        '''Write every pending position in one transaction; returns how many were written.'''
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            try:
+                async with self.session_factory() as db:
+                    await db.execute(_upsert_statement(db.bind.dialect.name, returning=False),
+                                     [position._asdict() for position in batch.values()])
+                    await db.commit()
+            except Exception:
+                # Put the batch back (unless newer positions arrived meanwhile) and retry on the next tick
+                for key, position in batch.items():
+                    self._pending.setdefault(key, position)
+                raise
+            self.flushes += 1
+            self.written += len(batch)
+            return len(batch)
+
+    def start(self) -> None:
+        '''Start periodic flushing on the running event loop.'''
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        '''Stop periodic flushing and write whatever is still pending.'''
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Flushing %d buffered play position(s) failed", len(self))
+
+
+def buffer_from_config() -> Optional[PositionBuffer]:
+    if config.PLAY_WRITE_BEHIND_MS <= 0:
+        return None
+    from echoread.api_server.database import AsyncSessionLocal
+    return PositionBuffer(AsyncSessionLocal, config.PLAY_WRITE_BEHIND_MS / 1000)
+
+
+position_buffer = buffer_from_config()
@@ -0,0 +1,308 @@
+"""
+Opt-in profiling of single requests.
+
+ProfilingMiddleware profiles a request when it carries `X-Profile: <PROFILE_TOKEN>`,
+or when it is picked at random at PROFILE_SAMPLE_RATE. Everything else goes
+straight through: the middleware is only installed when one of the two is
+configured (main.py), and the SQL statement hooks are only registered once the
+first profile starts.
+
+A profiled request gets a sampler thread that, every PROFILE_INTERVAL_MS,
+records where the request's task is: the Python stack it is running, or the
+chain of coroutines it is suspended in and what the innermost one awaits.
+Samples are weighted by the wall-clock time since the previous one, so time
+spent waiting for the database or a thread counts as much as CPU time. While a
+SQL statement is executing, it is added as the leaf frame (`SQL SELECT ...`).
+
+The profile is written to PROFILE_DIR as a speedscope file (open it at
+https://www.speedscope.app) or as collapsed stacks for flamegraph.pl,
+depending on PROFILE_FORMAT. The directory keeps the newest PROFILE_MAX_FILES
+profiles; older ones are deleted as new ones are written, so sampling can be
+left on. Requests profiled on demand also get a summary:
+
+    Server-Timing: app;dur=41.2, db;dur=12.9;desc="3 statements", samples;desc="38"
+    X-Profile: 20261017T201502-GET-books-book_id-1f2e3d4c.speedscope.json
+"""
+import asyncio
+import hmac
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter as Tally
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from echoread.api_server import config
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_EXTENSIONS = ("speedscope.json", "collapsed.txt")
+SQL_FRAME_LENGTH = 80 # Characters of a statement kept in its leaf frame
+
+Frame = Tuple[str, str, int] # (function, file, first line)
+
+_active: ContextVar[Optional["Profile"]] = ContextVar("echoread_profile", default=None)
+_hooks_lock = threading.Lock()
+_hooks_installed = False
+
+
+def _short_path(filename: str) -> str:
+    '''Paths from the package or site-packages onwards, which is what a reader of the flamegraph needs.'''
+    index = filename.rfind(os.sep + "site-packages" + os.sep)
+    if index != -1:
+        return filename[index + len("site-packages") + 2:]
+    index = filename.rfind(os.sep + "echoread" + os.sep)
+    if index != -1:
+        return filename[index + 1:]
+    return filename
+
+
+def _frame(code) -> Frame:
+    return (getattr(code, "co_qualname", code.co_name), _short_path(code.co_filename), code.co_firstlineno)
+
+
+class Profile:
+    '''Samples and SQL timings of one request.'''
+
+    def __init__(self, label: str, task: asyncio.Task, root_frame, interval: float):
+        self.label = label
+        self.task = task
+        self.root_frame = root_frame # The middleware's frame: stacks are cut above it
+        self.interval = interval
+        self.loop_thread = threading.get_ident()
+        self.samples: Tally = Tally() # stack -> seconds
+        self.sample_count = 0
+        self.statement: Optional[str] = None # Executing now, as seen by the sampler
+        self.statements: List[Tuple[str, float]] = []
+        self.started = time.perf_counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample_loop, name="echoread-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def db_seconds(self) -> float:
+        return sum(seconds for _, seconds in self.statements)
+
+    def _sample_loop(self) -> None:
+        last = time.perf_counter()
+        while True:
+            stack = self.capture()
+            now = time.perf_counter()
+            if stack and not self._stop.is_set(): # Not the request any more, but stop() waiting for this thread
+                self.samples[stack] += now - last
+                self.sample_count += 1
+            last = now
+            if self._stop.wait(self.interval):
+                return
+
+    def capture(self) -> Tuple:
+        '''The request's current stack, outermost frame first.'''
+        stack: List = []
+        coro = self.task.get_coro()
+        while coro is not None:
+            frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+            if frame is None:
+                break
+            stack.append(frame)
+            awaiting = getattr(coro, "cr_await", None) if hasattr(coro, "cr_frame") else getattr(coro, "gi_yieldfrom", None)
+            if awaiting is None:
+                if getattr(coro, "cr_running", False) or getattr(coro, "gi_running", False):
+                    stack.extend(self._running_frames(frame))
+                break
+            if not (hasattr(awaiting, "cr_frame") or hasattr(awaiting, "gi_frame")):
+                stack.append(("await " + type(awaiting).__name__, "", 0)) # A future, an I/O waiter...
+                break
+            coro = awaiting
+        try:
+            stack = stack[stack.index(self.root_frame):]
+        except ValueError:
+            return () # Not inside the middleware (yet, or any more)
+        frames = tuple(_frame(item.f_code) if not isinstance(item, tuple) else item for item in stack)
+        statement = self.statement
+        if statement is not None:
+            frames += (("SQL " + statement[:SQL_FRAME_LENGTH], "", 0),)
+        return frames
+
+    def _running_frames(self, coroutine_frame) -> List:
+        '''Frames the loop thread is executing below `coroutine_frame` (sync code, SQLAlchemy's greenlets).'''
+        frame = sys._current_frames().get(self.loop_thread)
+        below = []
+        while frame is not None and frame is not coroutine_frame:
+            below.append(frame)
+            frame = frame.f_back
+        below.reverse()
+        return below
+
+    def speedscope(self) -> dict:
+        frames: Dict[Frame, int] = {}
+        samples, weights = [], []
+        for stack, seconds in self.samples.items():
+            samples.append([frames.setdefault(frame, len(frames)) for frame in stack])
+            weights.append(round(seconds * 1000, 3))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.label,
+            "exporter": "echoread.profiling",
+            "shared": {"frames": [
+                {"name": name, **({"file": path, "line": line} if path else {})} for name, path, line in frames
+            ]},
+            "profiles": [{
+                "type": "sampled", "name": self.label, "unit": "milliseconds",
+                "startValue": 0, "endValue": round(sum(weights), 3), "samples": samples, "weights": weights,
+            }],
+        }
+
+    def collapsed(self) -> str:
+        '''One `frame;frame;frame microseconds` line per distinct stack, as flamegraph.pl reads them.'''
+        lines = []
+        for stack, seconds in sorted(self.samples.items()):
+            names = ";".join((f"{name} ({path}:{line})" if path else name).replace(";", ",") for name, path, line in stack)
+            lines.append(f"{names} {max(1, round(seconds * 1e6))}")
+        return "\n".join(lines) + "\n"
+
+    def server_timing(self) -> str:
+        return (f'app;dur={(time.perf_counter() - self.started) * 1000:.1f}, '
+                f'db;dur={self.db_seconds * 1000:.1f};desc="{len(self.statements)} statements", '
+                f'samples;desc="{self.sample_count}"')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _active.get()
+    if profile is not None:
+        profile.statement = " ".join(statement.split())
+        context._echoread_profile_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _active.get()
+    if profile is not None and hasattr(context, "_echoread_profile_started"):
+        profile.statements.append((profile.statement, time.perf_counter() - context._echoread_profile_started))
+        profile.statement = None
+
+
+def _install_statement_hooks() -> None:
+    '''Time SQL statements of every engine; done on the first profile, so unprofiled processes pay nothing.'''
+    global _hooks_installed
+    with _hooks_lock:
+        if not _hooks_installed:
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            _hooks_installed = True
+
+
+def profile_filename(scope: Scope, extension: str) -> str:
+    route = scope.get("route")
+    template = getattr(route, "path", scope["path"])
+    slug = "-".join(part.strip("{}") for part in template.split("/") if part)[:80] or "root"
+    return f"{datetime.utcnow():%Y%m%dT%H%M%S}-{scope['method']}-{slug}-{uuid.uuid4().hex[:8]}.{extension}"
+
+
+def write_profile(profile: Profile, path: str, output_format: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as out:
+        if output_format == "collapsed":
+            out.write(profile.collapsed())
+        else:
+            json.dump(profile.speedscope(), out)
+
+
+def prune_profiles(directory: str, keep: int) -> int:
+    '''Delete all but the newest `keep` profiles in `directory`; returns how many were deleted.'''
+    profiles = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(PROFILE_EXTENSIONS):
+                try:
+                    profiles.append((entry.stat().st_mtime_ns, entry.name, entry.path))
+                except FileNotFoundError: # Pruned by another worker meanwhile
+                    pass
+    profiles.sort(reverse=True)
+    deleted = 0
+    for _, _, path in profiles[keep:]:
+        try:
+            os.unlink(path)
+            deleted += 1
+        except FileNotFoundError:
+            pass
+    return deleted
+
+
+class ProfilingMiddleware:
+    '''Profile requests that carry the debug token, and a random PROFILE_SAMPLE_RATE share of the rest.'''
+
+    def __init__(self, app: ASGIApp, token: Optional[str] = None, sample_rate: Optional[float] = None,
+                 directory: Optional[str] = None, interval: Optional[float] = None,
+                 output_format: Optional[str] = None, max_files: Optional[int] = None):
+        self.app = app
+        token = token if token is not None else config.PROFILE_TOKEN
+        self.token = token.encode() if token else None
+        self.sample_rate = sample_rate if sample_rate is not None else config.PROFILE_SAMPLE_RATE
+        self.directory = directory or config.PROFILE_DIR or os.path.join(tempfile.gettempdir(), "echoread-profiles")
+        self.interval = interval if interval is not None else config.PROFILE_INTERVAL_MS / 1000
+        self.output_format = output_format or config.PROFILE_FORMAT
+        self.max_files = max_files if max_files is not None else config.PROFILE_MAX_FILES
+
+    def _requested(self, scope: Scope) -> bool:
+        if self.token is None:
+            return False
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return hmac.compare_digest(value, self.token)
+        return False
+
+    def _save(self, profile: Profile, filename: str) -> None:
+        write_profile(profile, os.path.join(self.directory, filename), self.output_format)
+        if self.max_files > 0:
+            prune_profiles(self.directory, self.max_files)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        requested = self._requested(scope)
+        if not requested and not (self.sample_rate and random.random() < self.sample_rate):
+            await self.app(scope, receive, send)
+            return
+
+        _install_statement_hooks()
+        profile = Profile(f"{scope['method']} {scope['path']}", asyncio.current_task(), sys._getframe(), self.interval)
+        extension = "collapsed.txt" if self.output_format == "collapsed" else "speedscope.json"
+        filename = None
+
+        async def send_with_summary(message: Message) -> None:
+            nonlocal filename
+            if message["type"] == "http.response.start" and requested:
+                filename = profile_filename(scope, extension) # The route is known by now
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", profile.server_timing().encode()),
+                    (b"x-profile", filename.encode()),
+                ]
+            await send(message)
+
+        token = _active.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_summary)
+        finally:
+            profile.stop()
+            _active.reset(token)
+            route = scope.get("route")
+            profile.label = f"{scope['method']} {getattr(route, 'path', scope['path'])}"
+            filename = filename or profile_filename(scope, extension)
+            await run_in_threadpool(self._save, profile, filename)
@@ -0,0 +1,176 @@
+"""
+TTS progress pushed to clients as Server-Sent Events (GET /books/{id}/status/stream).
+
+Chapters are synthesized by the TTS worker, a separate process, which records
+progress on the `books` row (status, processed_chapters) as each chapter commits.
+Each API process has one `ProgressBroker`. While anyone is subscribed, it reads
+every watched book in one primary-key query per PROGRESS_POLL_INTERVAL and fans
+changes out to all subscribers of that book. However many clients are watching,
+that is one query per interval per process, instead of one status request per
+client per poll.
+
+Every event carries the full progress snapshot, with an id derived from it. A
+client that reconnects with Last-Event-ID needs no replay: it gets the current
+snapshot if that differs from the last one it saw. Streams send a comment line
+every PROGRESS_HEARTBEAT_INTERVAL so idle proxies keep them open. They end once
+the book is complete or failed, or when it is deleted.
+"""
+import asyncio
+import json
+import logging
+from typing import AsyncIterator, Dict, NamedTuple, Optional, Set
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from echoread.api_server import config, models
+
+logger = logging.getLogger("echoread.progress")
+
+FINISHED_STATUSES = ("complete", "error")
+POLL_CHUNK = 500 # Book ids per IN (...) list
+
+
+class Progress(NamedTuple):
+    book_id: str
+    status: str
+    processed_chapters: int
+    total_chapters: int
+
+    @property
+    def event_id(self) -> str:
+        return f"{self.processed_chapters}.{self.total_chapters}.{self.status}"
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+
+def progress_of(book: models.Book) -> Progress:
+    return Progress(book.id, book.status, book.processed_chapters or 0, book.chapter_count or 0)
+
+
+def format_event(progress: Progress) -> str:
+    data = json.dumps(progress._asdict(), separators=(",", ":"))
+    return f"id: {progress.event_id}\nevent: progress\ndata: {data}\n\n"
+
+
+class Subscription:
+    '''One client's stream of snapshots for a book; None means the stream is over.'''
+    def __init__(self, book_id: str, last_event_id: Optional[str]):
+        self.book_id = book_id
+        self.last_event_id = last_event_id
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+
+    def publish(self, progress: Optional[Progress]) -> None:
+        if self._queue.full():
+            self._queue.get_nowait() # A slow reader only needs the newest snapshot
+        self._queue.put_nowait(progress)
+
+    async def get(self) -> Optional[Progress]:
+        return await self._queue.get()
+
+
+class ProgressBroker:
+    '''Polls the books that have subscribers and pushes changed snapshots to them.'''
+    def __init__(self, session_factory: async_sessionmaker, interval: float, heartbeat: float):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.polls = 0
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def subscriber_count(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self._subscribers.values())
+
+    def subscribe(self, book_id: str, last_event_id: Optional[str] = None) -> Subscription:
+        subscription = Subscription(book_id, last_event_id)
+        self._subscribers.setdefault(book_id, set()).add(subscription)
+        if self._task is None or self._task.done():
+            # Polling runs only while someone is listening, on the loop serving the streams
+            self._task = asyncio.get_running_loop().create_task(self._poll_loop())
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions = self._subscribers.get(subscription.book_id, set())
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            self._subscribers.pop(subscription.book_id, None)
+        if not self._subscribers and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def poll(self) -> None:
+        '''Read every watched book once and publish snapshots that changed (None for deleted books).'''
+        book_ids = list(self._subscribers)
+        if not book_ids:
+            return
+        current: Dict[str, Progress] = {}
+        async with self.session_factory() as db:
+            for start in range(0, len(book_ids), POLL_CHUNK):
+                rows = await db.execute(select(
+                    models.Book.id, models.Book.status, models.Book.processed_chapters, models.Book.chapter_count
+                ).where(models.Book.id.in_(book_ids[start:start + POLL_CHUNK])))
+                for book_id, status, processed, total in rows:
+                    current[book_id] = Progress(book_id, status, processed or 0, total or 0)
+        self.polls += 1
+        for book_id in book_ids:
+            progress = current.get(book_id)
+            for subscription in list(self._subscribers.get(book_id, ())):
+                if progress is None or progress.event_id != subscription.last_event_id:
+                    subscription.last_event_id = progress.event_id if progress else None
+                    subscription.publish(progress)
+
+    async def stream(self, current: Progress, last_event_id: Optional[str] = None) -> AsyncIterator[str]:
+        '''
+        SSE body for one client: `current` (unless the client already saw it), then every change
+        until the book finishes. Subscribing comes first, so a change made after `current` was
+        read is still picked up by the next poll.
+        '''
+        subscription = self.subscribe(current.book_id, last_event_id)
+        try:
+            yield f"retry: {config.PROGRESS_RETRY_MS}\n\n"
+            if current.event_id != last_event_id:
+                subscription.last_event_id = current.event_id
+                yield format_event(current)
+            progress: Optional[Progress] = current
+            while progress is not None and not progress.finished:
+                try:
+                    progress = await asyncio.wait_for(subscription.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                if progress is not None:
+                    yield format_event(progress)
+        finally:
+            self.unsubscribe(subscription)
+
+    async def close(self) -> None:
+        '''Stop polling and end every open stream (clients reconnect to another process).'''
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        for subscriptions in list(self._subscribers.values()):
+            for subscription in subscriptions:
+                subscription.publish(None)
+
+    async def _poll_loop(self) -> None:
+        while self._subscribers:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception("Polling progress of %d book(s) failed", len(self._subscribers))
+
+
+def broker_from_config() -> ProgressBroker:
+    from echoread.api_server.database import AsyncSessionLocal
+    return ProgressBroker(AsyncSessionLocal, config.PROGRESS_POLL_INTERVAL, config.PROGRESS_HEARTBEAT_INTERVAL)
+
+
+broker = broker_from_config()
@@ -0,0 +1,93 @@
+"""
+Background removal of deleted books' files.
+
+DELETE /books/{id} deletes the book row in one statement (ON DELETE CASCADE takes
+its audios, plays and jobs) and renames the book directory into the trash
+(storage.trash_book). Both steps take the same time for a 3-chapter book as for
+a 300-chapter one. The actual unlinking happens here: a `Reaper` task in each
+API process removes up to REAPER_BATCH_SIZE files from the trash every
+REAPER_INTERVAL seconds, on a worker thread, so a large book never holds up the
+event loop or hammers the disk in one go.
+
+The trash is the only state: if a process stops halfway through a book, the
+next one finishes it. Several processes reaping the same trash just skip the
+files another one removed first.
+"""
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from echoread.api_server import config, storage
+
+logger = logging.getLogger("echoread.reaper")
+
+
+def reap(limit: int, storage_root: Optional[str] = None) -> int:
+    '''Remove up to `limit` files from the trash, and the directories they leave empty. Returns the files removed.'''
+    trash = storage.trash_dir(storage_root)
+    removed = 0
+    for directory, _, files in os.walk(trash, topdown=False): # Leaves first, so emptied directories can go
+        for name in files:
+            if removed >= limit:
+                return removed
+            try:
+                os.unlink(os.path.join(directory, name))
+                removed += 1
+            except FileNotFoundError:
+                pass # Reaped by another process
+        if directory != trash:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass # Not empty yet, or already gone
+    return removed
+
+
+class Reaper:
+    '''Empties the trash in batches of `batch_size` files every `interval` seconds.'''
+    def __init__(self, interval: float, batch_size: int, storage_root: Optional[str] = None):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.storage_root = storage_root
+        self.removed = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> int:
+        removed = await run_in_threadpool(reap, self.batch_size, self.storage_root)
+        self.removed += removed
+        return removed
+
+    def start(self) -> None:
+        '''Start reaping on the running event loop.'''
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._reap_loop())
+
+    async def close(self) -> None:
+        '''Stop reaping; whatever is left in the trash is reaped by the next process.'''
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _reap_loop(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Reaping %s failed", storage.trash_dir(self.storage_root))
+            await asyncio.sleep(self.interval)
+
+
+def reaper_from_config() -> Optional[Reaper]:
+    if config.REAPER_INTERVAL <= 0:
+        return None
+    return Reaper(config.REAPER_INTERVAL, config.REAPER_BATCH_SIZE)
+
+
+reaper = reaper_from_config()
@@ -0,0 +1,133 @@
+"""
+Read/write splitting between the primary database and a read replica.
+
+Routes that only read take their session from `get_read_db` instead of
+`get_db`. With DATABASE_REPLICA_URL set, that session is bound to the replica;
+without it, it is the request's primary session, so nothing changes.
+
+A replica trails the primary, usually by milliseconds, sometimes by seconds.
+A user who has just written (uploaded a book, then opens it) is therefore
+pinned to the primary for REPLICA_PIN_SECONDS. ReadYourWritesMiddleware
+records each successful POST/PUT/PATCH/DELETE of an authenticated user in two
+places:
+
+* `pins`, in this process, by user id;
+* a cookie holding the end of the window. The client's next request may be
+  served by another worker process, which has no record of the write.
+
+Play position heartbeats (POST /plays) pin too, so a position read right
+after a heartbeat is the new one. While a book plays, its listener therefore
+reads from the primary. With the write-behind buffer on (see playback.py), a
+heartbeat reaches the primary up to one flush interval after its response,
+so the window is that much longer.
+"""
+import math
+import time
+from typing import Dict, Optional
+
+from fastapi import Depends, Request
+from jose import JWTError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from echoread.api_server import config, database, models, playback
+from echoread.api_server.database import get_db
+from echoread.api_server.security import decode_access_token, get_current_user
+
+PIN_COOKIE = "echoread_primary_until" # Unix time until which this client reads from the primary
+SAFE_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+DEFERRED_WRITE_ROUTES = frozenset(("/plays",)) # Route templates whose writes the position buffer may defer
+
+
+class WritePins:
+    '''User id -> end of the user's primary-only window, in this process. Only touched from the event loop.'''
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self._until: Dict[str, float] = {}
+        self._next_prune = 0.0
+
+    def pin(self, user_id: str, seconds: Optional[float] = None) -> None:
+        now = time.monotonic()
+        if now >= self._next_prune: # Entries outlive their window by at most one more window
+            self._until = {key: until for key, until in self._until.items() if until > now}
+            self._next_prune = now + self.seconds
+        self._until[user_id] = max(self._until.get(user_id, 0.0), now + (seconds or self.seconds))
+
+    def pinned(self, user_id: str) -> bool:
+        until = self._until.get(user_id)
+        return until is not None and until > time.monotonic()
+
+
+pins = WritePins(config.REPLICA_PIN_SECONDS)
+
+
+def _pinned_by_cookie(request: Request) -> bool:
+    value = request.cookies.get(PIN_COOKIE)
+    if value is None:
+        return False
+    try:
+        return float(value) > time.time()
+    except ValueError:
+        return False
+
+
+async def get_read_db(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    '''
+    Session for routes that only read: on the replica, unless none is configured or the user wrote recently.
+    `db` is the primary session get_current_user already uses; it opens no connection unless queried.
+    '''
+    if not database.replica_configured() or pins.pinned(current_user.id) or _pinned_by_cookie(request):
+        yield db
+        return
+    async with database.ReplicaSessionLocal() as replica:
+        yield replica
+
+
+def _pin_seconds(route_path: Optional[str]) -> float:
+    if route_path in DEFERRED_WRITE_ROUTES and playback.position_buffer is not None:
+        return pins.seconds + playback.position_buffer.interval # The write reaches the primary at the next flush
+    return pins.seconds
+
+
+def _token_user_id(scope: Scope) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                return None
+            try:
+                return decode_access_token(token)["sub"]
+            except JWTError:
+                return None
+    return None
+
+
+class ReadYourWritesMiddleware:
+    '''Pin users to the primary after their successful writes; reads (most requests) pass straight through.'''
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS or pins.seconds <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_pin(message: Message) -> None:
+            # By the time the response starts, the route has committed its writes
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                user_id = _token_user_id(scope)
+                if user_id is not None:
+                    seconds = _pin_seconds(getattr(scope.get("route"), "path", None))
+                    pins.pin(user_id, seconds)
+                    cookie = (f"{PIN_COOKIE}={time.time() + seconds:.3f}; "
+                              f"Max-Age={math.ceil(seconds)}; Path=/; HttpOnly; SameSite=Lax")
+                    message["headers"] = list(message.get("headers", [])) + [(b"set-cookie", cookie.encode())]
+            await send(message)
+
+        await self.app(scope, receive, send_with_pin)
@@ -1,7 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel, Field
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
-import time # For dummy JWT generation
+import uuid
+
+from echoread.api_server import models
+from echoread.api_server.database import get_db
+from echoread.api_server.security import create_access_token
 
 # --- Pydantic Models for Auth ---
 class GoogleTokenRequest(BaseModel):
@@ -21,15 +28,25 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-# --- Mock JWT Generation ---
-# In a real app, use python-jose or similar libraries
-def create_mock_jwt(data: dict) -> str:
-    # This is a highly simplified mock. Real JWTs have a specific structure and signature.
-    return f"mock_jwt_token.{{time.time()}}.{{data.get('sub', 'unknown_user')}}" # Escaped curly braces for f-string
+# --- Helper Functions ---
+async def _get_or_create_user(db: AsyncSession, email: str) -> models.User:
+    # Users are created here, at login, so authenticated requests never write to `users`
+    user = await db.scalar(select(models.User).where(models.User.email == email))
+    if user:
+        return user
+    user = models.User(id=str(uuid.uuid4()), email=email, name=email.split('@')[0].capitalize())
+    db.add(user)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # A concurrent login created the same user first
+        await db.rollback()
+        user = await db.scalar(select(models.User).where(models.User.email == email))
+    return user
 
 # --- Endpoints ---
 @router.post("/google", response_model=JWTResponse)
-async def login_google(request: GoogleTokenRequest):
+async def login_google(request: GoogleTokenRequest, db: AsyncSession = Depends(get_db)):
     '''
     Mock exchanging a Google OAuth2 token for our app's JWT.
     In a real scenario, you would validate the Google token here.
@@ -43,9 +60,10 @@ async def login_google(request: GoogleTokenRequest):
     # Mock user info extracted from a validated Google token
     mock_user_email = "user@example.com" # Simulate extracting email
 
-    # Create a mock JWT for our application
-    # The 'sub' (subject) claim typically holds the user identifier
-    access_token = create_mock_jwt(data={"sub": mock_user_email})
+    user = await _get_or_create_user(db, mock_user_email)
+
+    # Signed JWT for our application; 'sub' holds the user id (see security.py)
+    access_token = create_access_token(user.id, user.email)
     return JWTResponse(access_token=access_token)
 
 @router.post("/logout", response_model=LogoutResponse)
@@ -1,127 +1,249 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Response
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel as PydanticBaseModel
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional, Tuple, Union
+from datetime import datetime
 import uuid
 import time
+import os
+import shutil
 
-from echoread.api_server import models
+from echoread.api_server import book_zip, config, models, jobs, http_cache, progress, segments, serializers, signed_urls, storage
 from echoread.api_server.models import AudioURLResponse # Import the new model
 from echoread.api_server.database import get_db
-from echoread.api_server.routers.users import get_current_user_mock
+from echoread.api_server.epub import EpubError, EpubReader
+from echoread.api_server.pagination import (MAX_PAGE_SIZE, decode_cursor, next_page_headers, page_size,
+                                            parse_fields, set_next_page)
+from echoread.api_server.replicas import get_read_db
+from echoread.api_server.security import get_current_user
 
 # --- Router Definition ---
 router = APIRouter(
     prefix="/books",
     tags=["Books"],
-    dependencies=[Depends(get_current_user_mock)],
+    dependencies=[Depends(get_current_user)],
     responses={404: {"description": "Not found"}},
 )
 
+# Columns that `fields=` can select on the list endpoints
+BOOK_FIELDS = {
+    "id": models.Book.id,
+    "user_id": models.Book.user_id,
+    "title": models.Book.title,
+    "author": models.Book.author,
+    "epub_path": models.Book.epub_path,
+    "status": models.Book.status,
+    "chapter_count": models.Book.chapter_count,
+    "created_at": models.Book.created_at,
+}
+AUDIO_FIELDS = {
+    "audio_id": models.Audio.id,
+    "chapter_index": models.Audio.chapter_index,
+    "url": models.Audio.url,
+    "duration": models.Audio.duration,
+}
+
 # --- Helper Functions ---
-def _get_book_or_404(db: Session, book_id: str, user_id: str) -> models.Book:
-    book = db.query(models.Book).filter(models.Book.id == book_id, models.Book.user_id == user_id).first()
+async def _get_book_or_404(db: AsyncSession, book_id: str, user_id: str, *options) -> models.Book:
+    # Relationships can't be lazy-loaded on an AsyncSession; pass loader options (e.g. selectinload) for the ones needed
+    book = await db.scalar(
+        select(models.Book).where(models.Book.id == book_id, models.Book.user_id == user_id).options(*options)
+    )
     if not book:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
     return book
 
-def _get_audio_or_404(db: Session, book_id: str, audio_id: str, user_id: str) -> models.Audio:
+async def _get_book_version_or_404(db: AsyncSession, book_id: str, user_id: str) -> int:
+    # Ownership check that loads one column: enough to answer conditional requests (http_cache.py)
+    version = await db.scalar(
+        select(models.Book.version).where(models.Book.id == book_id, models.Book.user_id == user_id)
+    )
+    if version is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
+    return version
+
+async def _get_audio_or_404(db: AsyncSession, book_id: str, audio_id: str, user_id: str) -> models.Audio:
     # First, ensure the book itself exists and belongs to the user
-    book = _get_book_or_404(db, book_id, user_id)
+    book = await _get_book_or_404(db, book_id, user_id)
     # Now, query for the audio related to this book
-    audio = db.query(models.Audio).filter(models.Audio.id == audio_id, models.Audio.book_id == book.id).first()
+    audio = await db.scalar(select(models.Audio).where(models.Audio.id == audio_id, models.Audio.book_id == book.id))
     if not audio:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Audio chapter not found")
     return audio
 
-def _generate_and_save_audios_for_book(db: Session, book: models.Book, chapter_count: int = 5):
-    """Generates SQLAlchemy Audio objects for a book and adds them to the session."""
-    # This function now creates SQLAlchemy Audio objects.
-    # The actual audio file generation/TTS is still conceptual.
-
-    # book.audios will be an empty list initially as per relationship setup
-
-    for i in range(1, chapter_count + 1):
-        audio_id = str(uuid.uuid4()) # Generate unique ID for each audio
-        new_audio = models.Audio(
-            id=audio_id,
-            book_id=book.id,
-            chapter_index=i,
-            audio_path=f"/user_uploads/{book.user_id}/{book.id}/chapter_{i}.mp3", # Conceptual path
-            url=f"/books/{book.id}/audios/{audio_id}", # API path to access this audio
-            duration=180.0 + (i * 10), # Mock duration
-            # created_at is default in model
-        )
-        db.add(new_audio) # Add to session; book.audios will be populated by SQLAlchemy
-        # No need to append to book.audios manually if back_populates is correct
+async def _get_book_by_hash(db: AsyncSession, user_id: str, content_sha256: str) -> Optional[models.Book]:
+    return await db.scalar(select(models.Book).where(
+        models.Book.user_id == user_id, models.Book.content_sha256 == content_sha256
+    ))
 
-    book.status = "complete" # Update book status
-    book.chapter_count = chapter_count # Update chapter count
-    db.add(book) # Mark book as dirty to save status/chapter_count updates
+def _page_response(request: Request, rows: list, names: List[str], next_key) -> Response:
+    # Column tuples encoded as they are, bypassing the response model (see serializers.py)
+    page = serializers.json_response(serializers.dump_rows(rows, names))
+    set_next_page(request, page, next_key)
+    return page
 
+def _read_epub_metadata(path: str) -> Tuple[Optional[str], Optional[str], int]:
+    with EpubReader(path) as reader:
+        return reader.title, reader.author, reader.chapter_count
 
 # --- Endpoints ---
-@router.post("/upload", response_model=models.BookResponse, status_code=status.HTTP_202_ACCEPTED)
+# The body is parsed by storage.receive_form_upload, not by FastAPI; this documents it
+UPLOAD_REQUEST_BODY = {
+    "required": True,
+    "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "properties": {"file": {"type": "string", "format": "binary"}},
+        "required": ["file"],
+    }}},
+}
+
+@router.post("/upload", response_model=models.BookResponse, status_code=status.HTTP_202_ACCEPTED,
+             openapi_extra={"requestBody": UPLOAD_REQUEST_BODY})
 async def upload_book(
-    file: UploadFile = File(...),
-    current_user: models.User = Depends(get_current_user_mock),
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    if not file.filename:
+    # Parse the multipart body as it arrives, writing the file part to disk in chunks (hashing on the fly)
+    try:
+        upload, filename = await storage.receive_form_upload(request, current_user.id)
+    except storage.UploadTooLarge:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Uploaded file is too large")
+    except storage.InvalidUploadForm:
         raise HTTPException(status_code=400, detail="No file uploaded")
+    if not filename:
+        storage.discard_upload(upload)
+        raise HTTPException(status_code=400, detail="No file uploaded")
+
+    # Same EPUB uploaded again by this user: hand back the existing book instead of re-processing it
+    existing_book = await _get_book_by_hash(db, current_user.id, upload.sha256)
+    if existing_book:
+        storage.discard_upload(upload)
+        response.status_code = status.HTTP_200_OK
+        return existing_book
+
+    # Only the OPF metadata and spine are read here; chapters are parsed lazily by the worker
+    try:
+        title, author, chapter_count = await run_in_threadpool(_read_epub_metadata, upload.path)
+    except EpubError:
+        storage.discard_upload(upload)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File is not a valid EPUB")
 
     book_id = str(uuid.uuid4())
-    book_title = file.filename.replace(".epub", "") if file.filename.endswith(".epub") else "Uploaded Book"
-
-    db_book = models.Book(
-        id=book_id,
-        user_id=current_user.id,
-        title=book_title,
-        epub_path=f"/user_uploads/{current_user.id}/{file.filename}",
-        status="processing",
-    )
-    db.add(db_book)
+    if not title:
+        title = filename.replace(".epub", "") if filename.endswith(".epub") else "Uploaded Book"
+
+    committed = False
+    try:
+        db_book = models.Book(
+            id=book_id,
+            user_id=current_user.id,
+            title=title,
+            author=author,
+            epub_path=storage.commit_upload(upload, current_user.id, book_id),
+            content_sha256=upload.sha256,
+            chapter_count=chapter_count, # From the spine; the worker corrects it once chapters are read
+            status="pending",
+        )
+        db.add(db_book)
 
-    # Generate and associate audio entries
-    _generate_and_save_audios_for_book(db, db_book, chapter_count=5) # Example: 5 chapters
+        # Synthesis is slow (~30s per chapter), so it runs in the TTS worker (worker.py);
+        # the book moves pending -> processing -> complete/error as the job progresses.
+        jobs.enqueue_book_synthesis(db, db_book)
 
-    db.commit()
-    db.refresh(db_book)
-    # To ensure audios are loaded for the response if BookResponse includes them (it doesn't currently)
-    # If BookResponse were to include audios, you might need db.refresh(db_book.audios) or similar
-    # or ensure the session is configured to load them. For now, BookResponse is simple.
+        await db.commit()
+        committed = True
+    except IntegrityError:
+        # A concurrent request stored the same EPUB first
+        await db.rollback()
+        existing_book = await _get_book_by_hash(db, current_user.id, upload.sha256)
+        if not existing_book:
+            raise
+        response.status_code = status.HTTP_200_OK
+        return existing_book
+    finally:
+        if not committed:
+            # Whatever stopped the commit (duplicate, lost connection, cancelled request), no row
+            # points at the book directory: remove it, and the upload if it never got there
+            shutil.rmtree(storage.book_dir(current_user.id, book_id), ignore_errors=True)
+            storage.discard_upload(upload)
+    await db.refresh(db_book)
 
     return db_book
 
-@router.get("", response_model=List[models.BookResponse])
+@router.get("", response_model=Union[List[models.BookResponse], List[models.BookFields]]) # The latter with fields=
 async def list_user_books(
-    current_user: models.User = Depends(get_current_user_mock),
-    db: Session = Depends(get_db)
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE), # None: every book, unless a cursor is given
+    cursor: Optional[str] = None, # From the previous page's Link / X-Next-Cursor header
+    fields: Optional[str] = None, # e.g. "id,title,status"
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    user_books = db.query(models.Book).filter(models.Book.user_id == current_user.id).all()
-    return user_books
+    '''
+    The user's library, newest first: all of it, or one page at a time with `limit` / `cursor` (see pagination.py).
+    '''
+    size = page_size(limit, cursor)
+    names = parse_fields(fields, BOOK_FIELDS)
+    columns = {name: BOOK_FIELDS[name] for name in names} if names else serializers.BOOK_COLUMNS
+    # Keyset on (created_at, id), served by ix_books_user_id_created_at
+    query = select(*serializers.labelled(columns), models.Book.created_at.label("_created_at"), models.Book.id.label("_id")).where(
+        models.Book.user_id == current_user.id
+    ).order_by(models.Book.created_at.desc(), models.Book.id.desc())
+    if size is not None:
+        query = query.limit(size + 1)
+    if cursor:
+        query = query.where(tuple_(models.Book.created_at, models.Book.id) < tuple(decode_cursor(cursor, (datetime, str))))
+    rows = (await db.execute(query)).all()
+
+    next_key = (rows[size - 1]._created_at, rows[size - 1]._id) if size is not None and len(rows) > size else None
+    return _page_response(request, rows[:size], list(columns), next_key)
 
 @router.get("/{book_id}", response_model=models.BookDetail) # Using BookDetail for richer info
 async def get_book_details(
     book_id: str,
-    current_user: models.User = Depends(get_current_user_mock),
-    db: Session = Depends(get_db)
+    if_none_match: Optional[str] = Header(None),
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    book = _get_book_or_404(db, book_id, current_user.id)
-    # book.audios relationship will be loaded by SQLAlchemy (lazy load by default)
-    # Pydantic's BookDetail (with from_attributes=True) will handle serialization
-    return book # book object now includes its audios through relationship
+    version = await _get_book_version_or_404(db, book_id, current_user.id)
+    cached = http_cache.cached_book_response(if_none_match, book_id, version, "detail")
+    if cached is not None:
+        return cached # 304, or the serialized detail of this version
+    book = (await db.execute(
+        select(*serializers.labelled(serializers.BOOK_DETAIL_COLUMNS), models.Book.version.label("_version"))
+        .where(models.Book.id == book_id, models.Book.user_id == current_user.id)
+    )).first()
+    if book is None: # Deleted since the version was read
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
+    audios = (await db.execute(
+        select(*serializers.labelled(serializers.BOOK_DETAIL_AUDIO_COLUMNS))
+        .where(models.Audio.book_id == book_id).order_by(models.Audio.chapter_index)
+    )).all()
+    # Cached under the version of the row serialized, which a concurrent change may have moved past `version`
+    return http_cache.book_response(book_id, book._version, "detail", serializers.dump_book_detail(book, audios))
 
 @router.delete("/{book_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_book(
     book_id: str,
-    current_user: models.User = Depends(get_current_user_mock),
-    db: Session = Depends(get_db)
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    book = _get_book_or_404(db, book_id, current_user.id)
-    # Cascade delete should handle associated audios and plays (if Play has FK to Book and cascade)
-    db.delete(book)
-    db.commit()
+    # One statement, nothing loaded: ON DELETE CASCADE removes the book's audios, plays and jobs
+    epub_path = (await db.execute(
+        delete(models.Book).where(models.Book.id == book_id, models.Book.user_id == current_user.id)
+        .returning(models.Book.epub_path).execution_options(synchronize_session=False)
+    )).first()
+    if epub_path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
+    await db.commit()
+    # The files go to the trash with one rename; reaper.py removes them in the background
+    await run_in_threadpool(storage.trash_book, current_user.id, book_id, epub_path[0])
     return None
 
 # --- Endpoints (Part 2 - Audio & Status) ---
@@ -135,46 +257,138 @@ class TTSStatusResponse(PydanticBaseModel):
 @router.get("/{book_id}/status", response_model=TTSStatusResponse)
 async def get_book_tts_status(
     book_id: str,
-    current_user: models.User = Depends(get_current_user_mock),
-    db: Session = Depends(get_db)
+    if_none_match: Optional[str] = Header(None),
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    # processed_chapters is maintained by the worker as chapters commit: no audios are counted here
+    row = (await db.execute(
+        select(models.Book.status, models.Book.processed_chapters, models.Book.chapter_count, models.Book.version)
+        .where(models.Book.id == book_id, models.Book.user_id == current_user.id)
+    )).first()
+    if row is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Book not found")
+    cached = http_cache.cached_book_response(if_none_match, book_id, row.version, "status")
+    if cached is not None:
+        return cached
+    body = TTSStatusResponse(
+        book_id=book_id,
+        status=row.status,
+        processed_chapters=row.processed_chapters,
+        total_chapters=row.chapter_count or 0
+    ).model_dump_json().encode()
+    return http_cache.book_response(book_id, row.version, "status", body)
+
+@router.get("/{book_id}/status/stream")
+async def stream_book_tts_status(
+    book_id: str,
+    last_event_id: Optional[str] = Header(None), # Sent by EventSource when it reconnects
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    book = _get_book_or_404(db, book_id, current_user.id)
-
-    # `processed_chapters` can be the count of audio objects associated with the book.
-    # `total_chapters` can be what's stored in `book.chapter_count`.
-    # This provides a more realistic status based on DB data.
-    processed_chapters_count = len(book.audios) # Relies on relationship loading
-
-    return TTSStatusResponse(
-        book_id=book.id,
-        status=book.status,
-        processed_chapters=processed_chapters_count,
-        total_chapters=book.chapter_count or 0
+    '''
+    TTS progress as Server-Sent Events: a `progress` event (the /status fields) whenever a chapter
+    finishes or the status changes, until the book is complete or failed (see progress.py).
+    '''
+    book = await _get_book_or_404(db, book_id, current_user.id)
+    current = progress.progress_of(book)
+    await db.close() # Streams last minutes: don't hold a pooled connection for them
+    return StreamingResponse(
+        progress.broker.stream(current, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}, # No proxy buffering of events
     )
 
-@router.get("/{book_id}/audios", response_model=List[models.AudioChapterInfo])
+@router.get("/{book_id}/audios",
+            response_model=Union[List[models.AudioChapterInfo], List[models.AudioChapterFields]]) # The latter with fields=
 async def list_book_audios(
     book_id: str,
-    current_user: models.User = Depends(get_current_user_mock),
-    db: Session = Depends(get_db)
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE), # None: every chapter, unless a cursor is given
+    cursor: Optional[str] = None, # From the previous page's Link / X-Next-Cursor header
+    fields: Optional[str] = None, # e.g. "audio_id,chapter_index"
+    if_none_match: Optional[str] = Header(None),
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    book = _get_book_or_404(db, book_id, current_user.id)
-    # book.audios is a list of SQLAlchemy Audio objects.
-    # These will be converted to AudioChapterInfo by Pydantic.
-    return book.audios
+    '''
+    The book's chapters in reading order: all of them, or one page at a time with `limit` / `cursor` (see pagination.py).
+    '''
+    size = page_size(limit, cursor)
+    names = parse_fields(fields, AUDIO_FIELDS)
+    after = decode_cursor(cursor, (int,))[0] if cursor else None
+    version = await _get_book_version_or_404(db, book_id, current_user.id)
+    variant = f"audios?{request.url.query}" # Each page / projection is its own representation
+    cached = http_cache.cached_book_response(if_none_match, book_id, version, variant)
+    if cached is not None:
+        return cached
+
+    columns = {name: AUDIO_FIELDS[name] for name in names} if names else serializers.AUDIO_CHAPTER_COLUMNS
+    # Keyset on chapter_index, unique per book (ux_audios_book_id_chapter_index)
+    query = select(*serializers.labelled(columns), models.Audio.chapter_index.label("_chapter_index")).where(
+        models.Audio.book_id == book_id
+    ).order_by(models.Audio.chapter_index)
+    if size is not None:
+        query = query.limit(size + 1)
+    if after is not None:
+        query = query.where(models.Audio.chapter_index > after)
+    rows = (await db.execute(query)).all()
+
+    next_key = (rows[size - 1]._chapter_index,) if size is not None and len(rows) > size else None
+    body = serializers.dump_rows(rows[:size], list(columns)) # Bypasses the response model (see serializers.py)
+    return http_cache.book_response(book_id, version, variant, body, next_page_headers(request, next_key))
+
+@router.get("/{book_id}/download", response_class=Response)
+@router.head("/{book_id}/download", response_class=Response, include_in_schema=False) # Same operation: one operationId
+async def download_book(
+    book_id: str,
+    request: Request,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    '''
+    The whole book for offline listening: a zip of its chapter files plus manifest.json, streamed
+    from the files on disk (book_zip.py). Supports Range / If-Range, so interrupted downloads resume.
+    '''
+    book = await _get_book_or_404(db, book_id, current_user.id)
+    info = {"id": book.id, "title": book.title, "author": book.author}
+    chapters = (await db.execute(
+        select(models.Audio.id, models.Audio.chapter_index, models.Audio.audio_path, models.Audio.duration,
+               models.Audio.crc32)
+        .where(models.Audio.book_id == book_id).order_by(models.Audio.chapter_index)
+    )).all()
+    await db.close() # The download can stream for minutes: don't hold a pooled connection for it
+    archive = await run_in_threadpool(book_zip.book_archive, info, chapters)
+    return book_zip.archive_response(request, archive, archive.etag, _download_filename(book.title))
+
+def _download_filename(title: str) -> str:
+    # Quoted-string safe; titles are free text
+    safe = "".join(c if c.isascii() and (c.isalnum() or c in " ._-") else "_" for c in title).strip(" ._") or "book"
+    return f"{safe[:100]}.zip"
 
 @router.get("/{book_id}/audios/{audio_id}", response_model=AudioURLResponse)
 async def get_book_chapter_audio(
     book_id: str,
     audio_id: str,
-    current_user: models.User = Depends(get_current_user_mock), # current_user is available if needed for logic
-    db: Session = Depends(get_db) # db session is available if needed
+    current_user: models.User = Depends(get_current_user), # current_user is available if needed for logic
+    db: AsyncSession = Depends(get_read_db) # db session is available if needed
 ):
     # Ensure the audio chapter exists and belongs to the user's book (indirectly via book_id and user_id)
-    _ = _get_audio_or_404(db, book_id, audio_id, current_user.id) # We don't need audio_obj here
+    audio = await _get_audio_or_404(db, book_id, audio_id, current_user.id)
+    if not audio.audio_path:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Audio file not available yet")
 
-    # Construct the URL as specified
-    url = f"https://api.echoread.com/media/books/{book_id}/chapters/{audio_id}.mp3?token=mock_presigned_token"
-    expires_in = 3600 # As specified
+    directory, filename = os.path.split(audio.audio_path)
+    if os.path.abspath(directory) == os.path.abspath(storage.book_dir(current_user.id, book_id)):
+        # Ownership is checked here once; the signed URL is then verified without the database (signed_urls.py)
+        url, expires_in = signed_urls.sign(current_user.id, book_id, audio.id, filename)
+        playlist = segments.playlist_path(audio.audio_path)
+        if await run_in_threadpool(os.path.exists, playlist): # A stat can block on slow or network storage
+            playlist_url, _ = signed_urls.sign(current_user.id, book_id, audio.id, os.path.basename(playlist))
+            return AudioURLResponse(url=url, expires_in=expires_in, playlist_url=playlist_url)
+    else:
+        # Stored outside the book directory (older layouts): served by the authenticated media route instead
+        extension = os.path.splitext(audio.audio_path)[1] or ".mp3"
+        url, expires_in = f"{config.MEDIA_BASE_URL}/media/books/{book_id}/chapters/{audio_id}{extension}", config.MEDIA_URL_TTL
 
     return AudioURLResponse(url=url, expires_in=expires_in)
@@ -0,0 +1,82 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+import os
+
+from echoread.api_server import models, segments, signed_urls, storage
+from echoread.api_server.media import file_response
+from echoread.api_server.replicas import get_read_db
+from echoread.api_server.security import get_current_user
+from echoread.api_server.routers.books import _get_audio_or_404
+
+# --- Router Definition ---
+router = APIRouter(
+    prefix="/media",
+    tags=["Media"],
+    responses={404: {"description": "Not found"}},
+)
+
+# --- Endpoints ---
+@router.get("/books/{book_id}/chapters/{audio_file}")
+@router.head("/books/{book_id}/chapters/{audio_file}", include_in_schema=False) # Same operation: one operationId
+async def stream_chapter_audio(
+    book_id: str,
+    audio_file: str, # "<audio_id>.<ext>", as handed out by GET /books/{book_id}/audios/{audio_id}
+    request: Request,
+    current_user: models.User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    '''
+    Serve the bytes of a generated chapter.
+    Supports Range / If-Range so players can seek without re-downloading the file,
+    and ETag / Last-Modified so cached chapters are revalidated with a 304.
+    '''
+    audio_id, _ = os.path.splitext(audio_file)
+    audio = await _get_audio_or_404(db, book_id, audio_id, current_user.id)
+    if not audio.audio_path:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Audio file not available yet")
+
+    try:
+        return file_response(request, audio.audio_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Audio file not available yet")
+
+@router.get("/signed/{user_id}/{book_id}/{audio_id}/{filename}")
+@router.head("/signed/{user_id}/{book_id}/{audio_id}/{filename}", include_in_schema=False)
+async def stream_signed_chapter_audio(
+    user_id: str,
+    book_id: str,
+    audio_id: str,
+    filename: str,
+    request: Request,
+    expires: int = Query(...),
+    kid: str = Query(...),
+    sig: str = Query(...),
+):
+    '''
+    Serve a chapter through a URL issued by GET /books/{book_id}/audios/{audio_id}.
+    The signature is checked in memory: no token lookup and no database query per (Range) request.
+    '''
+    try:
+        signed_urls.verify(user_id, book_id, audio_id, filename, expires, kid, sig)
+    except signed_urls.InvalidSignature:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid or expired media URL")
+    if filename != os.path.basename(filename) or filename.startswith("."):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Audio file not available yet")
+
+    path = os.path.join(storage.book_dir(user_id, book_id), filename)
+    try:
+        if filename.endswith(segments.PLAYLIST_SUFFIX):
+            return _signed_playlist(path, user_id, book_id, audio_id)
+        if segments.is_segment(filename):
+            return file_response(request, path, cache_control=segments.SEGMENT_CACHE_CONTROL)
+        return file_response(request, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Audio file not available yet")
+
+def _signed_playlist(path: str, user_id: str, book_id: str, audio_id: str) -> Response:
+    with open(path) as playlist:
+        text = playlist.read()
+    # Segment URLs carry their own signatures: relative URIs would lose the playlist's query string
+    signed = segments.sign_playlist(text, lambda name: signed_urls.sign(user_id, book_id, audio_id, name)[0])
+    return Response(content=signed, media_type=segments.PLAYLIST_MEDIA_TYPE,
+                    headers={"cache-control": "private, no-cache"})
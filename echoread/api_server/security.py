@@ -0,0 +1,120 @@
+"""
+Access tokens and authenticated-user resolution.
+
+Access tokens are HS256-signed JWTs (python-jose) issued by POST /auth/google.
+They carry the user id in `sub` plus the email, so verifying a request needs no
+database access. The `User` row behind a token is looked up at most once per
+request (FastAPI caches `get_current_user` per request, including router-level
+dependencies) and kept in a small per-process TTL/LRU cache, so most requests
+do zero user lookups.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import Depends, Header, HTTPException, status
+from jose import JWTError, jwt
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from echoread.api_server import config, models
+from echoread.api_server.database import get_db
+
+if not config.JWT_SECRET_KEY:
+    # Same policy as DATABASE_URL: refuse to start rather than sign tokens with a guessable key
+    raise RuntimeError("JWT_SECRET_KEY environment variable not set. Ensure dev.env is present and configured correctly in echoread/api_server/dev.env")
+
+
+def create_access_token(user_id: str, email: str, expires_delta: Optional[timedelta] = None) -> str:
+    now = datetime.utcnow()
+    claims = {
+        "sub": user_id,
+        "email": email,
+        "iat": now,
+        "exp": now + (expires_delta or timedelta(minutes=config.JWT_EXPIRE_MINUTES)),
+    }
+    return jwt.encode(claims, config.JWT_SECRET_KEY, algorithm=config.JWT_ALGORITHM)
+
+
+def decode_access_token(token: str) -> dict:
+    '''Verify signature and expiry; raises jose.JWTError for anything invalid.'''
+    claims = jwt.decode(token, config.JWT_SECRET_KEY, algorithms=[config.JWT_ALGORITHM])
+    if not claims.get("sub"):
+        raise JWTError("Token has no subject")
+    return claims
+
+
+class UserCache:
+    '''Per-process cache of resolved users: user id -> detached `User`, bounded by size and age.'''
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict() # user id -> (expires_at, user), LRU first
+
+    def get(self, user_id: str) -> Optional[models.User]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(user_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user: models.User) -> None:
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str) -> None:
+        '''Call after changing or deleting a user, so this process stops serving the old row.'''
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache(config.USER_CACHE_TTL, config.USER_CACHE_SIZE)
+
+_credentials_error = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Not authenticated or invalid token",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+
+async def get_current_user(
+    db: AsyncSession = Depends(get_db),
+    authorization: Optional[str] = Header(None),
+) -> models.User:
+    '''
+    Resolve the `Authorization: Bearer <jwt>` header to a `User`.
+    Returned users are shared between requests; treat them as read-only.
+    '''
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise _credentials_error
+    try:
+        user_id = decode_access_token(token)["sub"]
+    except JWTError:
+        raise _credentials_error
+
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await db.get(models.User, user_id)
+        if user is None: # Deleted since the token was issued
+            raise _credentials_error
+        db.expunge(user) # Detach, so the cached instance outlives this session
+        user_cache.put(user)
+    return user
@@ -0,0 +1,95 @@
+"""
+Segmented packaging of chapter audio (HLS-style playlists).
+
+With TTS_SEGMENT_SECONDS > 0 the worker also cuts every finished chapter into
+fixed-duration segments next to it, plus a VOD playlist:
+
+    chapter_3.wav             the whole chapter, as before
+    chapter_3_s00000.wav ...  TTS_SEGMENT_SECONDS of audio each, never rewritten
+    chapter_3.m3u8            #EXTINF / segment file name pairs, #EXT-X-ENDLIST
+
+A player then starts after one playlist and one segment, and a seek only fetches
+the few segments around the new position. Segments are immutable, so they are
+served with a year-long `immutable` Cache-Control and CDNs and clients can keep
+them. The playlist is written last, so if it exists, all of its segments exist.
+
+Segment lines in the playlist on disk are bare file names. The media route
+rewrites each one to a signed URL (signed_urls.py) when it serves the playlist.
+
+The local engine produces PCM, so segments are WAV files cut on sample
+boundaries. A production engine emitting AAC would package the same way into
+.ts/.m4s segments.
+"""
+import math
+import os
+import wave
+from typing import Callable, List, Tuple
+
+from echoread.api_server import tts
+
+PLAYLIST_SUFFIX = ".m3u8"
+PLAYLIST_MEDIA_TYPE = "application/vnd.apple.mpegurl"
+SEGMENT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def playlist_path(chapter_path: str) -> str:
+    return os.path.splitext(chapter_path)[0] + PLAYLIST_SUFFIX
+
+
+def segment_name(chapter_path: str, number: int) -> str:
+    stem, extension = os.path.splitext(os.path.basename(chapter_path))
+    return f"{stem}_s{number:05d}{extension}"
+
+
+def is_segment(filename: str) -> bool:
+    stem = os.path.splitext(filename)[0]
+    return len(stem) > 7 and stem[-7:-5] == "_s" and stem[-5:].isdigit()
+
+
+def render_playlist(entries: List[Tuple[str, float]]) -> str:
+    '''VOD media playlist for (segment file name, duration) pairs.'''
+    target = max((duration for _, duration in entries), default=0)
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{max(1, math.ceil(target))}", # Rounded up, as the spec requires
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+    ]
+    for name, duration in entries:
+        lines += [f"#EXTINF:{duration:.3f},", name]
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def package_chapter(chapter_path: str, segment_seconds: float) -> str:
+    '''Cut a chapter WAV into segments next to it and write its playlist; returns the playlist path.'''
+    directory = os.path.dirname(chapter_path)
+    entries = []
+    with wave.open(chapter_path, "rb") as chapter:
+        if (chapter.getnchannels(), chapter.getsampwidth()) != (1, 2):
+            raise ValueError(f"{chapter_path}: expected 16-bit mono PCM")
+        sample_rate = chapter.getframerate()
+        frames_per_segment = max(1, round(segment_seconds * sample_rate))
+        while True:
+            pcm = chapter.readframes(frames_per_segment)
+            if not pcm and entries:
+                break
+            name = segment_name(chapter_path, len(entries))
+            entries.append((name, tts.write_wav(os.path.join(directory, name), pcm, sample_rate)))
+            if len(pcm) < frames_per_segment * 2:
+                break
+
+    path = playlist_path(chapter_path)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w") as out:
+        out.write(render_playlist(entries))
+    os.replace(tmp_path, path) # Last, and atomic: a visible playlist means every segment is in place
+    return path
+
+
+def sign_playlist(playlist: str, sign: Callable[[str], str]) -> str:
+    '''Replace each segment file name in `playlist` with `sign(name)`.'''
+    return "\n".join(
+        line if not line or line.startswith("#") else sign(line) for line in playlist.split("\n")
+    )
@@ -0,0 +1,64 @@
+"""
+JSON bodies for the book and chapter endpoints, encoded straight from column tuples.
+
+The routes select exactly the columns a response has and hand the rows to
+orjson in one call. Nothing is loaded into ORM objects, and nothing is
+validated into Pydantic models one at a time; for a long list those two steps
+were most of the request's CPU time (benchmarks/bench_serialization.py).
+
+The output is byte for byte what the Pydantic response models produce:
+- models.BookResponse (GET /books);
+- models.BookDetail (GET /books/{id});
+- models.AudioChapterInfo (GET /books/{id}/audios).
+
+The published schema does not change, and the routes keep those models as
+their response_model. The columns come from the models' fields, in field
+order, so a field added to a model is picked up here. A field that is not a
+column, or one with a custom serializer like BookDetail.author, needs code
+here too.
+"""
+from typing import Dict, Iterable, List, Sequence, Type
+
+import orjson
+from pydantic import BaseModel
+from starlette.responses import Response
+
+from echoread.api_server import models
+
+UNKNOWN_AUTHOR = "Unknown Author" # What BookDetail.serialize_author writes for a missing author
+
+
+def model_columns(schema: Type[BaseModel], table, exclude: Iterable[str] = ()) -> Dict[str, object]:
+    '''Response key -> column of `table`, in the order `schema` serializes its fields.'''
+    return {
+        name: getattr(table, field.validation_alias or name)
+        for name, field in schema.model_fields.items() if name not in exclude
+    }
+
+
+BOOK_COLUMNS = model_columns(models.BookResponse, models.Book)
+BOOK_DETAIL_COLUMNS = model_columns(models.BookDetail, models.Book, exclude=("audios",))
+BOOK_DETAIL_AUDIO_COLUMNS = model_columns(models.AudioResponse, models.Audio)
+AUDIO_CHAPTER_COLUMNS = model_columns(models.AudioChapterInfo, models.Audio)
+
+
+def labelled(columns: Dict[str, object]) -> List:
+    '''select() arguments for `columns`; rows then start with the response's values, in key order.'''
+    return [column.label(name) for name, column in columns.items()]
+
+
+def dump_rows(rows: Sequence, names: Sequence[str]) -> bytes:
+    # zip stops at the names: columns selected after them (keyset values) are left out
+    return orjson.dumps([dict(zip(names, row)) for row in rows])
+
+
+def dump_book_detail(book, audios: Sequence) -> bytes:
+    detail = dict(zip(BOOK_DETAIL_COLUMNS, book))
+    if detail["author"] is None:
+        detail["author"] = UNKNOWN_AUTHOR
+    detail["audios"] = [dict(zip(BOOK_DETAIL_AUDIO_COLUMNS, audio)) for audio in audios]
+    return orjson.dumps(detail)
+
+
+def json_response(body: bytes) -> Response:
+    return Response(body, media_type="application/json")
@@ -0,0 +1,86 @@
+"""
+Expiring, HMAC-signed URLs for chapter audio.
+
+GET /books/{id}/audios/{audio_id} checks ownership once and hands out a URL of
+the form
+
+    <MEDIA_BASE_URL>/media/signed/<user_id>/<book_id>/<audio_id>/<file>?expires=..&kid=..&sig=..
+
+The signature is an HMAC-SHA256 over the path (user, book, audio and file name
+under the book's storage directory) and the expiry. The media route only
+recomputes that HMAC in memory, then serves <STORAGE_ROOT>/<user_id>/<book_id>/<file>.
+The Range requests a player makes while seeking therefore cost no database
+query and no token lookup.
+
+Keys come from MEDIA_SIGNING_KEYS ("kid:secret,kid:secret"). The first key signs,
+and every listed key verifies. To rotate, put the new key first, keep the old one
+listed for one MEDIA_URL_TTL, then drop it. Without MEDIA_SIGNING_KEYS, a key
+derived from JWT_SECRET_KEY is used.
+
+Expiries are rounded up to MEDIA_URL_EXPIRY_STEP, so repeated requests for the
+same chapter get the same URL and HTTP caches can reuse the response.
+"""
+import base64
+import hashlib
+import hmac
+import math
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+from echoread.api_server import config
+
+SIGNED_PREFIX = "/media/signed"
+
+
+class InvalidSignature(Exception):
+    pass
+
+
+def load_keys(spec: Optional[str]) -> Tuple[str, Dict[str, bytes]]:
+    '''(signing kid, {kid: secret}) from a "kid:secret,kid:secret" spec; the first key signs.'''
+    if not spec:
+        derived = hmac.new(config.JWT_SECRET_KEY.encode(), b"echoread media urls", hashlib.sha256).digest()
+        return "default", {"default": derived}
+    keys = {}
+    for entry in spec.split(","):
+        kid, sep, secret = entry.strip().partition(":")
+        if not sep or not kid or not secret:
+            raise RuntimeError("MEDIA_SIGNING_KEYS must look like 'kid:secret[,kid:secret...]'")
+        keys.setdefault(kid, secret.encode())
+    return next(iter(keys)), keys
+
+
+SIGNING_KID, KEYS = load_keys(config.MEDIA_SIGNING_KEYS)
+
+
+def _signature(key: bytes, path: str, expires: int) -> str:
+    digest = hmac.new(key, f"{path}\n{expires}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+
+def media_path(user_id: str, book_id: str, audio_id: str, filename: str) -> str:
+    return "/".join((SIGNED_PREFIX, *(quote(part, safe="") for part in (user_id, book_id, audio_id, filename))))
+
+
+def sign(user_id: str, book_id: str, audio_id: str, filename: str, now: Optional[float] = None) -> Tuple[str, int]:
+    '''Signed URL for a chapter file in the book's storage directory, and its lifetime in seconds.'''
+    now = time.time() if now is None else now
+    step = max(1, config.MEDIA_URL_EXPIRY_STEP)
+    expires = math.ceil((now + config.MEDIA_URL_TTL) / step) * step
+    path = media_path(user_id, book_id, audio_id, filename)
+    query = urlencode({"expires": expires, "kid": SIGNING_KID, "sig": _signature(KEYS[SIGNING_KID], path, expires)})
+    return f"{config.MEDIA_BASE_URL}{path}?{query}", int(expires - now)
+
+
+def verify(user_id: str, book_id: str, audio_id: str, filename: str, expires: int, kid: str, sig: str,
+           now: Optional[float] = None) -> None:
+    '''Raises InvalidSignature unless `sig` was issued by `sign` for these values and has not expired.'''
+    key = KEYS.get(kid)
+    if key is None:
+        raise InvalidSignature("unknown key")
+    expected = _signature(key, media_path(user_id, book_id, audio_id, filename), expires)
+    if not hmac.compare_digest(expected, sig):
+        raise InvalidSignature("bad signature")
+    if expires < (time.time() if now is None else now):
+        raise InvalidSignature("expired")
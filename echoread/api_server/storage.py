@@ -0,0 +1,253 @@
+"""
+On-disk storage for uploaded EPUBs.
+
+The multipart body of an upload is parsed as it arrives (`receive_form_upload`),
+and the file part is written to disk in fixed-size chunks while its SHA-256 is
+computed. The EPUB is written once, and a request never holds more than one
+chunk of it in memory. The file is first written under
+`<STORAGE_ROOT>/<user_id>/.incoming/` and atomically renamed into the book
+directory once the upload is accepted (see `commit_upload`).
+
+Deleted books are renamed into `<STORAGE_ROOT>/.trash/` (see `trash_book`) and
+removed from there in batches by reaper.py.
+"""
+import hashlib
+import os
+import tempfile
+import uuid
+from typing import List, NamedTuple, Optional, Tuple
+
+import multipart
+from fastapi import HTTPException, Request, status
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import parse_options_header
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from echoread.api_server import config
+
+MULTIPART_OVERHEAD = 64 * 1024 # Slack for boundaries and part headers around the file itself
+TRASH_DIR = ".trash"
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class InvalidUploadForm(Exception):
+    pass
+
+
+class IncomingUpload(NamedTuple):
+    path: str # Temporary location, same filesystem as the final one
+    sha256: str
+    size: int
+
+
+def book_dir(user_id: str, book_id: str, storage_root: Optional[str] = None) -> str:
+    return os.path.join(storage_root or config.STORAGE_ROOT, user_id, book_id)
+
+
+def trash_dir(storage_root: Optional[str] = None) -> str:
+    return os.path.join(storage_root or config.STORAGE_ROOT, TRASH_DIR)
+
+
+class _IncomingFile:
+    '''A temporary file under `.incoming` that hashes and counts what is written to it. Blocking.'''
+
+    def __init__(self, user_id: str, max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes or config.MAX_UPLOAD_BYTES
+        incoming_dir = os.path.join(config.STORAGE_ROOT, user_id, ".incoming")
+        os.makedirs(incoming_dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=incoming_dir, suffix=".epub.part")
+        self._out = os.fdopen(fd, "wb")
+        self._digest = hashlib.sha256()
+        self._size = 0
+
+    def write(self, chunk: bytes) -> None:
+        self._size += len(chunk)
+        if self._size > self.max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {self.max_bytes} bytes")
+        self._digest.update(chunk)
+        self._out.write(chunk)
+
+    def finish(self) -> IncomingUpload:
+        self._out.close()
+        return IncomingUpload(path=self.path, sha256=self._digest.hexdigest(), size=self._size)
+
+    def abort(self) -> None:
+        self._out.close()
+        os.unlink(self.path)
+
+
+class _FilePartReader:
+    '''python-multipart callbacks that keep the data of the first file part named `field` and drop the rest.'''
+
+    def __init__(self, field: str):
+        self.field = field
+        self.filename: Optional[str] = None
+        self.pending: List[bytes] = [] # Data of the file part not yet written out
+        self._headers: List[Tuple[bytes, bytes]] = []
+        self._header_name = b""
+        self._header_value = b""
+        self._in_file = False
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._part_begin,
+            "on_header_field": self._header_field,
+            "on_header_value": self._header_value_data,
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        }
+
+    def _part_begin(self) -> None:
+        self._headers = []
+
+    def _header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def _header_value_data(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _header_end(self) -> None:
+        self._headers.append((self._header_name.lower(), self._header_value))
+        self._header_name = self._header_value = b""
+
+    def _headers_finished(self) -> None:
+        disposition = dict(self._headers).get(b"content-disposition")
+        if disposition is None:
+            raise InvalidUploadForm("Part without a Content-Disposition header")
+        _, options = parse_options_header(disposition)
+        self._in_file = (self.filename is None and b"filename" in options
+                         and options.get(b"name", b"").decode("latin-1") == self.field)
+        if self._in_file:
+            self.filename = options[b"filename"].decode("utf-8", errors="replace")
+
+    def _part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_file:
+            self.pending.append(data[start:end])
+
+    def _part_end(self) -> None:
+        self._in_file = False
+
+
+async def receive_form_upload(request: Request, user_id: str, field: str = "file", max_bytes: Optional[int] = None,
+                              chunk_size: Optional[int] = None) -> Tuple[IncomingUpload, str]:
+    '''
+    Parse a multipart/form-data request body as it arrives and copy its file part `field`
+    to a temporary file, hashing as it goes; returns the upload and its filename.
+    Unlike an UploadFile, the file is not spooled to disk first and copied again.
+
+    Disk writes run on worker threads, `chunk_size` bytes at a time. Raises UploadTooLarge
+    as soon as the file part exceeds `max_bytes`, and InvalidUploadForm for a body that is
+    not multipart or has no such part; either way nothing is left behind on disk.
+    '''
+    chunk_size = chunk_size or config.UPLOAD_CHUNK_SIZE
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise InvalidUploadForm("Expected a multipart/form-data body")
+
+    reader = _FilePartReader(field)
+    parser = multipart.MultipartParser(params[b"boundary"], reader.callbacks())
+    incoming = await run_in_threadpool(_IncomingFile, user_id, max_bytes)
+    try:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except MultipartParseError as exc:
+                raise InvalidUploadForm(str(exc)) from exc
+            if sum(map(len, reader.pending)) >= chunk_size:
+                await run_in_threadpool(incoming.write, b"".join(reader.pending))
+                reader.pending.clear()
+        parser.finalize()
+        if reader.filename is None:
+            raise InvalidUploadForm(f"No file part named {field!r}")
+        if reader.pending:
+            await run_in_threadpool(incoming.write, b"".join(reader.pending))
+    except BaseException:
+        incoming.abort()
+        raise
+    return incoming.finish(), reader.filename
+
+
+def commit_upload(upload: IncomingUpload, user_id: str, book_id: str) -> str:
+    '''Move an accepted upload into its book directory and return the final path.'''
+    directory = book_dir(user_id, book_id)
+    os.makedirs(directory, exist_ok=True)
+    final_path = os.path.join(directory, "book.epub")
+    os.replace(upload.path, final_path)
+    return final_path
+
+
+def discard_upload(upload: IncomingUpload) -> None:
+    try:
+        os.unlink(upload.path)
+    except FileNotFoundError:
+        pass
+
+
+def trash_book(user_id: str, book_id: str, epub_path: Optional[str] = None, storage_root: Optional[str] = None) -> bool:
+    '''
+    Move a deleted book's files out of the way in O(1): one rename of its directory into the trash,
+    whatever the number of chapters (plus one for an EPUB stored elsewhere). Returns whether anything was moved.
+    '''
+    trash = trash_dir(storage_root)
+    os.makedirs(trash, exist_ok=True)
+    moved = False
+    directory = book_dir(user_id, book_id, storage_root)
+    sources = [directory]
+    if epub_path and os.path.dirname(os.path.abspath(epub_path)) != os.path.abspath(directory):
+        sources.append(epub_path)
+    for source in sources:
+        try:
+            # Unique name: the trash may still hold an earlier copy being reaped
+            os.rename(source, os.path.join(trash, f"{book_id}.{uuid.uuid4().hex}"))
+            moved = True
+        except FileNotFoundError:
+            pass
+    return moved
+
+
+class UploadSizeLimitMiddleware:
+    '''
+    Reject oversized upload bodies before they are parsed.
+
+    A declared Content-Length above the limit is answered with 413 without reading
+    the body; chunked bodies are counted as they arrive and aborted with 413 once
+    they cross the limit, instead of being written to disk in full first.
+    '''
+
+    def __init__(self, app: ASGIApp, paths: tuple = ("/books/upload",), max_bytes: Optional[int] = None):
+        self.app = app
+        self.paths = paths
+        self.limit = (max_bytes or config.MAX_UPLOAD_BYTES) + MULTIPART_OVERHEAD
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > self.limit:
+                await send({"type": "http.response.start", "status": status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            "headers": [(b"content-type", b"application/json"), (b"connection", b"close")]})
+                await send({"type": "http.response.body", "body": b'{"detail":"Uploaded file is too large"}'})
+                return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    # FastAPI re-raises HTTPExceptions from body parsing, so this becomes a 413 response
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                        detail="Uploaded file is too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
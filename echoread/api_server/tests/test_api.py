@@ -1,31 +1,42 @@
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool # For in-memory SQLite
+from sqlalchemy.pool import NullPool
 
 from echoread.api_server.main import app # Main FastAPI app
-from echoread.api_server.database import Base, get_db
-from echoread.api_server import models # Import your SQLAlchemy models
+from echoread.api_server.database import Base, async_database_url, enable_sqlite_foreign_keys, get_db
+from echoread.api_server import metrics, models # Import your SQLAlchemy models
+from echoread.api_server.http_cache import response_cache
+from echoread.api_server.security import create_access_token, user_cache
+import asyncio
+import json
 import uuid
+import os
+import tempfile
 from datetime import datetime
 
-# Setup for an in-memory SQLite database for testing
-DATABASE_URL = "sqlite:///:memory:"
+# Setup for a throwaway SQLite file for testing: the API reaches it through aiosqlite,
+# while fixtures and the TTS worker use the synchronous engine
+DATABASE_URL = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='echoread-tests-'), 'test.db')}"
 engine = create_engine(
     DATABASE_URL,
     connect_args={"check_same_thread": False}, # Needed for SQLite
-    poolclass=StaticPool
 )
+enable_sqlite_foreign_keys(engine)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# NullPool: TestClient may run each request on a new event loop, so connections must not be reused across requests
+async_engine = create_async_engine(async_database_url(DATABASE_URL), poolclass=metrics.timed_pool_class(NullPool, "async"))
+enable_sqlite_foreign_keys(async_engine.sync_engine)
+metrics.instrument_engine(async_engine.sync_engine)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 # Override the get_db dependency for testing
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
+async def override_get_db():
+    async with TestingAsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 app.dependency_overrides[get_db] = override_get_db
 
@@ -34,14 +45,13 @@ client = TestClient(app)
 # Mock user for dependency
 MOCK_USER_ID = str(uuid.uuid4())
 MOCK_USER_EMAIL = "test@example.com"
-# This token format is based on the get_current_user_mock in echoread/api_server/routers/users.py
-# It expects "Bearer mock_jwt_token.<email>"
-MOCK_AUTH_TOKEN = f"Bearer mock_jwt_token.{MOCK_USER_EMAIL}"
+# Signed JWT for the mock user, as issued by POST /auth/google (see security.py)
+MOCK_AUTH_TOKEN = f"Bearer {create_access_token(MOCK_USER_ID, MOCK_USER_EMAIL)}"
 
 @pytest.fixture(scope="function", autouse=True)
 def setup_database():
     Base.metadata.create_all(bind=engine) # Create tables
-    # Pre-populate with a mock user, as get_current_user_mock might try to fetch/create one
+    # Pre-populate with the mock user that MOCK_AUTH_TOKEN refers to
     db = TestingSessionLocal()
     user = db.query(models.User).filter(models.User.email == MOCK_USER_EMAIL).first()
     if not user:
@@ -52,10 +62,20 @@ def setup_database():
     #    global MOCK_USER_ID # Not ideal, but for fixture simplicity if ID must match pre-existing
     #    MOCK_USER_ID = user.id
     db.close()
+    user_cache.clear() # Users are recreated for every test
+    response_cache.clear()
     yield
     Base.metadata.drop_all(bind=engine) # Drop tables after test
 
 
+@pytest.fixture(autouse=True)
+def storage_root(tmp_path, monkeypatch):
+    # Keep uploads and generated audio inside the test's temporary directory
+    from echoread.api_server import config
+    monkeypatch.setattr(config, "STORAGE_ROOT", str(tmp_path))
+    return tmp_path
+
+
 # --- Test for GET /books/{book_id} ---
 def test_get_book_details_includes_author():
     db = TestingSessionLocal()
@@ -92,11 +112,182 @@ def test_get_book_details_defaults_author():
     data = response.json()
     assert data["author"] == "Unknown Author" # Default value from Pydantic model
 
+# --- Tests for GET /books and GET /books/{book_id}/audios pagination ---
+def test_list_and_detail_bodies_match_the_response_models():
+    # serializers.py encodes column tuples; the bytes must be what the Pydantic response models produce
+    from pydantic import TypeAdapter
+    from sqlalchemy.orm import selectinload
+    db = TestingSessionLocal()
+    book_id = str(uuid.uuid4())
+    db.add(models.Book(id=book_id, user_id=MOCK_USER_ID, title="Café \"Ünïcode\"", author=None, chapter_count=3,
+                       status="processing", epub_path="/x/book.epub", created_at=datetime(2024, 5, 1, 12, 30, 0, 120000)))
+    db.add(models.Book(id=str(uuid.uuid4()), user_id=MOCK_USER_ID, title="Second", author="Someone",
+                       created_at=datetime(2024, 5, 2)))
+    db.add_all([
+        models.Audio(id="audio_a", book_id=book_id, chapter_index=1, duration=61.5, url="https://x/1.mp3",
+                     audio_path="/x/1.mp3", created_at=datetime(2024, 5, 1, 12, 31, 5, 7)),
+        models.Audio(id="audio_b", book_id=book_id, chapter_index=2, duration=None, created_at=datetime(2024, 5, 1)),
+        models.Audio(id="audio_c", book_id=book_id, chapter_index=3, duration=0.1, created_at=datetime(2024, 5, 1)),
+    ])
+    db.commit()
+    books = db.query(models.Book).order_by(models.Book.created_at.desc()).all()
+    detail = db.query(models.Book).options(selectinload(models.Book.audios)).filter(models.Book.id == book_id).one()
+    book_list, audio_list = TypeAdapter(list[models.BookResponse]), TypeAdapter(list[models.AudioChapterInfo])
+    expected_list = book_list.dump_json(book_list.validate_python(books))
+    expected_detail = models.BookDetail.model_validate(detail).model_dump_json().encode()
+    expected_audios = audio_list.dump_json(audio_list.validate_python(detail.audios))
+    db.close()
+    headers = {"Authorization": MOCK_AUTH_TOKEN}
+
+    assert client.get("/books", headers=headers).content == expected_list
+    response = client.get(f"/books/{book_id}", headers=headers)
+    assert response.content == expected_detail
+    assert response.json()["author"] == "Unknown Author"
+    assert client.get(f"/books/{book_id}/audios", headers=headers).content == expected_audios
+
+def _follow_pages(url, **params):
+    pages = []
+    while url:
+        response = client.get(url, params=params, headers={"Authorization": MOCK_AUTH_TOKEN})
+        assert response.status_code == 200
+        pages.append(response.json())
+        params = {}
+        link = response.headers.get("link")
+        url = link[link.index("<") + 1:link.index(">")] if link else None
+        assert (url is None) == ("x-next-cursor" not in response.headers)
+    return pages
+
+def test_list_books_keyset_pagination():
+    db = TestingSessionLocal()
+    same_time = datetime(2026, 1, 1) # Ties on created_at are broken by id
+    book_ids = [f"book_{i:02d}" for i in range(7)]
+    db.add_all(models.Book(id=book_id, user_id=MOCK_USER_ID, title=book_id, created_at=same_time) for book_id in book_ids)
+    db.commit()
+    db.close()
+
+    pages = _follow_pages("/books", limit=3)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [book["id"] for page in pages for book in page] == sorted(book_ids, reverse=True)
+    assert set(pages[0][0]) >= {"id", "title", "status", "created_at"}
+
+def test_list_books_is_unbounded_without_limit_or_cursor(monkeypatch):
+    from echoread.api_server import pagination
+    monkeypatch.setattr(pagination, "DEFAULT_PAGE_SIZE", 2)
+    db = TestingSessionLocal()
+    db.add_all(models.Book(id=f"book_{i}", user_id=MOCK_USER_ID, title=f"Title {i}") for i in range(5))
+    db.commit()
+    db.close()
+
+    headers = {"Authorization": MOCK_AUTH_TOKEN}
+    response = client.get("/books", headers=headers)
+    assert len(response.json()) == 5 and "link" not in response.headers # The whole library, as before paging
+    first = client.get("/books", params={"limit": 3}, headers=headers)
+    assert len(first.json()) == 3
+    # A cursor without a limit gets the default page size
+    rest = client.get("/books", params={"cursor": first.headers["x-next-cursor"]}, headers=headers)
+    assert len(rest.json()) == 2 and "link" not in rest.headers
+
+def test_list_books_field_projection():
+    db = TestingSessionLocal()
+    db.add_all(models.Book(id=f"book_{i}", user_id=MOCK_USER_ID, title=f"Title {i}", created_at=datetime(2026, 1, i + 1)) for i in range(3))
+    db.commit()
+    db.close()
+
+    pages = _follow_pages("/books", limit=2, fields="title,id")
+    assert pages == [[{"title": "Title 2", "id": "book_2"}, {"title": "Title 1", "id": "book_1"}],
+                     [{"title": "Title 0", "id": "book_0"}]]
+
+    headers = {"Authorization": MOCK_AUTH_TOKEN}
+    assert client.get("/books", params={"fields": "title,password"}, headers=headers).status_code == 400
+    assert client.get("/books", params={"cursor": "not-a-cursor"}, headers=headers).status_code == 400
+    assert client.get("/books", params={"limit": 0}, headers=headers).status_code == 422
+
+def test_openapi_operation_ids_are_unique():
+    import warnings
+    from fastapi.openapi.utils import get_openapi
+    with warnings.catch_warnings():
+        warnings.simplefilter("error") # FastAPI warns on a duplicate operationId
+        schema = get_openapi(title=app.title, version=app.version, routes=app.routes)
+    ids = [operation["operationId"] for path in schema["paths"].values() for operation in path.values()]
+    assert len(ids) == len(set(ids))
+    assert "head" not in schema["paths"]["/books/{book_id}/download"] # HEAD is served, not documented twice
+
+def test_list_endpoints_document_their_projections():
+    paths = client.get("/openapi.json").json()["paths"]
+    for path, full, projected in (("/books", "BookResponse", "BookFields"),
+                                  ("/books/{book_id}/audios", "AudioChapterInfo", "AudioChapterFields")):
+        schema = paths[path]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+        assert [option["items"]["$ref"].rsplit("/", 1)[1] for option in schema["anyOf"]] == [full, projected]
+
+def test_list_book_audios_keyset_pagination():
+    book_id, audio_ids = _create_book_with_chapters(count=5)
+
+    pages = _follow_pages(f"/books/{book_id}/audios", limit=2)
+    assert [[chapter["audio_id"] for chapter in page] for page in pages] == [audio_ids[0:2], audio_ids[2:4], audio_ids[4:]]
+    pages = _follow_pages(f"/books/{book_id}/audios", limit=4, fields="chapter_index")
+    assert pages == [[{"chapter_index": i} for i in range(1, 5)], [{"chapter_index": 5}]]
+
 # --- Test for GET /books/{book_id}/audios/{audio_id} ---
-def test_get_book_chapter_audio_url():
+def test_book_responses_carry_etags_and_answer_304():
+    book_id, _ = _create_book_with_chapters(count=3)
+    headers = {"Authorization": MOCK_AUTH_TOKEN}
+
+    for path in (f"/books/{book_id}", f"/books/{book_id}/audios?limit=2", f"/books/{book_id}/status"):
+        first = client.get(path, headers=headers)
+        assert first.status_code == 200
+        assert first.headers["etag"] == f'"{book_id}.1"'
+        hits = response_cache.hits
+        assert client.get(path, headers=headers).json() == first.json() # Served from the response cache
+        assert response_cache.hits == hits + 1
+        revalidated = client.get(path, headers={**headers, "If-None-Match": first.headers["etag"]})
+        assert (revalidated.status_code, revalidated.content) == (304, b"")
+    paged = client.get(f"/books/{book_id}/audios?limit=2", headers=headers)
+    assert [audio["chapter_index"] for audio in paged.json()] == [1, 2] and "cursor=" in paged.headers["link"]
+
+    db = TestingSessionLocal()
+    db.get(models.Book, book_id).title = "Renamed"
+    db.commit()
+    db.close()
+    changed = client.get(f"/books/{book_id}", headers={**headers, "If-None-Match": f'"{book_id}.1"'})
+    assert (changed.status_code, changed.headers["etag"], changed.json()["title"]) == (200, f'"{book_id}.2"', "Renamed")
+    assert client.get(f"/books/{uuid.uuid4()}", headers={**headers, "If-None-Match": "*"}).status_code == 404
+
+def test_duration_backfill_invalidates_cached_book_responses(tmp_path):
+    import wave
+    from echoread.api_server.backfill_durations import backfill
+    book_id, (audio_id,) = _create_book_with_chapters(count=1)
+    with wave.open(str(tmp_path / "chapter_1.wav"), "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(8000)
+        wav.writeframes(b"\0\0" * 8000) # One second
+    db = TestingSessionLocal()
+    db.get(models.Audio, audio_id).audio_path = str(tmp_path / "chapter_1.wav")
+    db.commit()
+    db.close()
+    headers = {"Authorization": MOCK_AUTH_TOKEN}
+    etags = {}
+    for path in (f"/books/{book_id}", f"/books/{book_id}/audios"):
+        first = client.get(path, headers=headers)
+        assert first.status_code == 200
+        etags[path] = first.headers["etag"]
+
+    assert backfill(TestingSessionLocal) == {"updated": 1, "failed": 0}
+
+    for path, etag in etags.items():
+        response = client.get(path, headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 200 and response.headers["etag"] != etag
+    assert client.get(f"/books/{book_id}/audios", headers=headers).json()[0]["duration"] == 1.0
+
+def test_get_book_chapter_audio_url(storage_root):
+    from urllib.parse import parse_qs, urlsplit
+    from echoread.api_server import config
     db = TestingSessionLocal()
     book_id = str(uuid.uuid4())
     audio_id = "audio_" + str(uuid.uuid4()) # Match Audio model default id prefix if any
+    audio_path = storage_root / MOCK_USER_ID / book_id / "chapter_1.wav" # Where the worker writes chapters
+    audio_path.parent.mkdir(parents=True)
+    audio_path.write_bytes(b"RIFF" + bytes(range(256)))
 
     test_book = models.Book(id=book_id, user_id=MOCK_USER_ID, title="Audio Test Book")
     db.add(test_book)
@@ -106,20 +297,57 @@ def test_get_book_chapter_audio_url():
         id=audio_id,
         book_id=book_id,
         chapter_index=1,
-        audio_path="/test/path.mp3", # Example path
+        audio_path=str(audio_path),
         url=f"/books/{book_id}/audios/{audio_id}", # Example URL, though API generates its own
         duration=180.0
     )
     db.add(test_audio)
+    db.add(models.Audio(id="audio_legacy", book_id=book_id, chapter_index=2, audio_path="/test/path.mp3"))
     db.commit()
     db.close()
 
     response = client.get(f"/books/{book_id}/audios/{audio_id}", headers={"Authorization": MOCK_AUTH_TOKEN})
     assert response.status_code == 200
     data = response.json()
-    assert "url" in data
-    assert f"https://api.echoread.com/media/books/{book_id}/chapters/{audio_id}.mp3?token=mock_presigned_token" == data["url"]
-    assert data["expires_in"] == 3600
+    url = urlsplit(data["url"])
+    assert f"{url.scheme}://{url.netloc}" == config.MEDIA_BASE_URL
+    assert url.path == f"/media/signed/{MOCK_USER_ID}/{book_id}/{audio_id}/chapter_1.wav"
+    assert config.MEDIA_URL_TTL <= data["expires_in"] <= config.MEDIA_URL_TTL + config.MEDIA_URL_EXPIRY_STEP
+    # Stable within an expiry step, so clients and HTTP caches can reuse the URL
+    assert client.get(f"/books/{book_id}/audios/{audio_id}", headers={"Authorization": MOCK_AUTH_TOKEN}).json()["url"] == data["url"]
+
+    # No Authorization header: the signature alone grants access, Range requests included
+    signed = f"{url.path}?{url.query}"
+    assert client.get(signed).content == audio_path.read_bytes()
+    assert client.get(signed, headers={"Range": "bytes=0-3"}).content == b"RIFF"
+    params = parse_qs(url.query)
+    tampered = signed.replace(params["sig"][0], params["sig"][0][::-1])
+    assert client.get(tampered).status_code == 403
+    assert client.get(signed.replace(book_id, str(uuid.uuid4()))).status_code == 403
+    expired = signed.replace(f"expires={params['expires'][0]}", "expires=1000")
+    assert client.get(expired).status_code == 403
+
+    legacy = client.get(f"/books/{book_id}/audios/audio_legacy", headers={"Authorization": MOCK_AUTH_TOKEN}).json()
+    assert legacy["url"] == f"{config.MEDIA_BASE_URL}/media/books/{book_id}/chapters/audio_legacy.mp3"
+
+def test_signed_media_urls_verify_with_rotated_keys(monkeypatch):
+    from echoread.api_server import signed_urls
+    old_kid, old_keys = signed_urls.load_keys("k1:first-secret")
+    monkeypatch.setattr(signed_urls, "SIGNING_KID", old_kid)
+    monkeypatch.setattr(signed_urls, "KEYS", old_keys)
+    url, _ = signed_urls.sign("u", "b", "a", "chapter_1.wav", now=1000)
+    params = dict(part.split("=") for part in url.split("?")[1].split("&"))
+    assert params["kid"] == "k1"
+
+    # Rotation: k2 now signs, k1 still verifies URLs issued before the switch
+    kid, keys = signed_urls.load_keys("k2:second-secret,k1:first-secret")
+    monkeypatch.setattr(signed_urls, "SIGNING_KID", kid)
+    monkeypatch.setattr(signed_urls, "KEYS", keys)
+    signed_urls.verify("u", "b", "a", "chapter_1.wav", int(params["expires"]), "k1", params["sig"], now=1000)
+    assert "kid=k2" in signed_urls.sign("u", "b", "a", "chapter_1.wav", now=1000)[0]
+    monkeypatch.setattr(signed_urls, "KEYS", {"k2": keys["k2"]}) # k1 retired
+    with pytest.raises(signed_urls.InvalidSignature):
+        signed_urls.verify("u", "b", "a", "chapter_1.wav", int(params["expires"]), "k1", params["sig"], now=1000)
 
 # --- Test for GET /play/{book_id} ---
 def test_get_last_play_position_found():
@@ -182,3 +410,876 @@ def test_get_last_play_position_book_not_found():
     assert response.status_code == 404
     data = response.json()
     assert data["detail"] == "Book not found" # Or whatever your 404 detail is
+
+# --- Tests for POST /plays ---
+def _create_book_with_chapters(count=2, user_id=None):
+    db = TestingSessionLocal()
+    book_id = str(uuid.uuid4())
+    audio_ids = ["audio_" + str(uuid.uuid4()) for _ in range(count)]
+    db.add(models.Book(id=book_id, user_id=user_id or MOCK_USER_ID, title="Play Test Book", processed_chapters=count))
+    db.add_all(models.Audio(id=audio_id, book_id=book_id, chapter_index=i) for i, audio_id in enumerate(audio_ids, 1))
+    db.commit()
+    db.close()
+    return book_id, audio_ids
+
+def test_save_play_position_upserts_one_row_per_book():
+    from echoread.api_server.playback import play_id
+    book_id, (first, second) = _create_book_with_chapters()
+    headers = {"Authorization": MOCK_AUTH_TOKEN}
+
+    saved = client.post("/plays", json={"book_id": book_id, "audio_id": first, "last_timestamp": 12.5}, headers=headers)
+    assert saved.status_code == 200
+    assert saved.json()["id"] == play_id(MOCK_USER_ID, book_id)
+    saved = client.post("/plays", json={"book_id": book_id, "audio_id": second, "last_timestamp": 3.0}, headers=headers)
+    assert saved.json()["audio_id"] == second
+
+    db = TestingSessionLocal()
+    plays = db.query(models.Play).filter(models.Play.book_id == book_id).all()
+    db.close()
+    assert [(p.id, p.audio_id, p.last_timestamp) for p in plays] == [(play_id(MOCK_USER_ID, book_id), second, 3.0)]
+    assert client.get(f"/play/{book_id}", headers=headers).json()[0]["audio_id"] == second
+
+def test_save_play_position_validates_book_and_chapter():
+    book_id, (audio_id, _) = _create_book_with_chapters()
+    other_book_id, (other_audio_id, _) = _create_book_with_chapters()
+    headers = {"Authorization": MOCK_AUTH_TOKEN}
+
+    response = client.post("/plays", json={"book_id": str(uuid.uuid4()), "audio_id": audio_id, "last_timestamp": 1}, headers=headers)
+    assert (response.status_code, response.json()["detail"]) == (404, "Book not found")
+    response = client.post("/plays", json={"book_id": book_id, "audio_id": other_audio_id, "last_timestamp": 1}, headers=headers)
+    assert (response.status_code, response.json()["detail"]) == (404, "Audio chapter not found")
+
+    db = TestingSessionLocal()
+    db.add(models.User(id="someone-else", email="else@example.com"))
+    db.commit()
+    db.close()
+    foreign_book_id, (foreign_audio_id, _) = _create_book_with_chapters(user_id="someone-else")
+    response = client.post("/plays", json={"book_id": foreign_book_id, "audio_id": foreign_audio_id, "last_timestamp": 1}, headers=headers)
+    assert response.status_code == 404
+
+def test_save_play_position_write_behind(monkeypatch):
+    import asyncio
+    from echoread.api_server import playback
+    buffer = playback.PositionBuffer(TestingAsyncSessionLocal, interval=60) # Flushed explicitly below
+    monkeypatch.setattr(playback, "position_buffer", buffer)
+    book_id, (first, second) = _create_book_with_chapters()
+    headers = {"Authorization": MOCK_AUTH_TOKEN}
+
+    for audio_id, timestamp in ((first, 1.0), (first, 2.0), (second, 0.5)):
+        assert client.post("/plays", json={"book_id": book_id, "audio_id": audio_id, "last_timestamp": timestamp}, headers=headers).status_code == 200
+    assert client.post("/plays", json={"book_id": book_id, "audio_id": "audio_missing", "last_timestamp": 1}, headers=headers).status_code == 404
+
+    assert len(buffer) == 1 # Heartbeats for the same book are coalesced
+    assert client.get(f"/play/{book_id}", headers=headers).json()[0]["audio_id"] == second # Reads see the buffer
+    db = TestingSessionLocal()
+    assert db.query(models.Play).count() == 0
+    db.close()
+
+    assert asyncio.run(buffer.close()) is None # Shutdown flushes what is pending
+    db = TestingSessionLocal()
+    stored = db.query(models.Play).one()
+    db.close()
+    assert (stored.audio_id, stored.last_timestamp) == (second, 0.5)
+    assert len(buffer) == 0
+
+def test_buffered_position_is_read_through_only_in_its_own_process(monkeypatch):
+    import asyncio
+    from echoread.api_server import playback
+    book_id, (first, second) = _create_book_with_chapters()
+    headers = {"Authorization": MOCK_AUTH_TOKEN}
+    def play(audio_id, timestamp):
+        assert client.post("/plays", json={"book_id": book_id, "audio_id": audio_id, "last_timestamp": timestamp}, headers=headers).status_code == 200
+    def position():
+        return client.get(f"/play/{book_id}", headers=headers).json()[0]["audio_id"]
+
+    writer = playback.PositionBuffer(TestingAsyncSessionLocal, interval=60) # The worker that takes the heartbeats
+    other = playback.PositionBuffer(TestingAsyncSessionLocal, interval=60) # Another worker process, empty buffer
+    monkeypatch.setattr(playback, "position_buffer", writer)
+    play(first, 1.0)
+    asyncio.run(writer.flush())
+    play(second, 0.5)
+    assert position() == second
+
+    monkeypatch.setattr(playback, "position_buffer", other)
+    assert position() == first # The database row, one flush interval behind
+    asyncio.run(writer.flush())
+    assert position() == second
+
+# --- Tests for authentication ---
+def test_login_issues_token_for_new_user():
+    response = client.post("/auth/google", json={"token": "google-oauth-token"})
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+
+    me = client.get("/users/me", headers={"Authorization": f"Bearer {token}"})
+    assert me.status_code == 200
+    assert me.json()["email"] == "user@example.com"
+    # Logging in again reuses the user created the first time
+    again = client.post("/auth/google", json={"token": "google-oauth-token"}).json()["access_token"]
+    assert client.get("/users/me", headers={"Authorization": f"Bearer {again}"}).json()["id"] == me.json()["id"]
+
+def test_rejects_invalid_tokens():
+    from datetime import timedelta
+    from jose import jwt
+    expired = create_access_token(MOCK_USER_ID, MOCK_USER_EMAIL, expires_delta=timedelta(seconds=-1))
+    forged = jwt.encode({"sub": MOCK_USER_ID, "email": MOCK_USER_EMAIL}, "not-the-secret", algorithm="HS256")
+    unknown_user = create_access_token(str(uuid.uuid4()), "ghost@example.com")
+    for authorization in (None, "Bearer", "Bearer garbage", f"Bearer {expired}", f"Bearer {forged}",
+                          f"Bearer {unknown_user}", f"Basic {create_access_token(MOCK_USER_ID, MOCK_USER_EMAIL)}"):
+        headers = {"Authorization": authorization} if authorization else {}
+        response = client.get("/books", headers=headers)
+        assert response.status_code == 401, authorization
+        assert response.headers["www-authenticate"] == "Bearer"
+
+def test_resolved_users_are_cached():
+    assert client.get("/books", headers={"Authorization": MOCK_AUTH_TOKEN}).status_code == 200
+    misses = user_cache.misses
+
+    db = TestingSessionLocal()
+    db.query(models.User).filter(models.User.id == MOCK_USER_ID).update({"name": "Renamed"})
+    db.commit()
+    db.close()
+
+    me = client.get("/users/me", headers={"Authorization": MOCK_AUTH_TOKEN})
+    assert me.json()["name"] == "Test User" # Served from the cache, no lookup
+    assert user_cache.misses == misses
+    user_cache.invalidate(MOCK_USER_ID)
+    assert client.get("/users/me", headers={"Authorization": MOCK_AUTH_TOKEN}).json()["name"] == "Renamed"
+
+# --- Tests for GET /media/books/{book_id}/chapters/{audio_file} ---
+def _create_audio_file(tmp_path, size=4096):
+    db = TestingSessionLocal()
+    book_id = str(uuid.uuid4())
+    audio_id = "audio_" + str(uuid.uuid4())
+    audio_path = tmp_path / "chapter_1.mp3"
+    audio_path.write_bytes(bytes(i % 256 for i in range(size)))
+    db.add(models.Book(id=book_id, user_id=MOCK_USER_ID, title="Media Test Book"))
+    db.add(models.Audio(id=audio_id, book_id=book_id, chapter_index=1, audio_path=str(audio_path)))
+    db.commit()
+    db.close()
+    return f"/media/books/{book_id}/chapters/{audio_id}.mp3", audio_path.read_bytes()
+
+def test_stream_chapter_audio_full_and_range(tmp_path):
+    url, content = _create_audio_file(tmp_path)
+
+    response = client.get(url, headers={"Authorization": MOCK_AUTH_TOKEN})
+    assert response.status_code == 200
+    assert response.content == content
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["content-type"] == "audio/mpeg"
+
+    response = client.get(url, headers={"Authorization": MOCK_AUTH_TOKEN, "Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 100-199/{len(content)}"
+    assert response.content == content[100:200]
+
+    response = client.get(url, headers={"Authorization": MOCK_AUTH_TOKEN, "Range": "bytes=-10"})
+    assert response.status_code == 206
+    assert response.content == content[-10:]
+
+def test_stream_chapter_audio_conditional_requests(tmp_path):
+    url, content = _create_audio_file(tmp_path)
+    etag = client.get(url, headers={"Authorization": MOCK_AUTH_TOKEN}).headers["etag"]
+
+    response = client.get(url, headers={"Authorization": MOCK_AUTH_TOKEN, "If-None-Match": etag})
+    assert response.status_code == 304
+
+    # A stale If-Range validator means the client's partial copy is outdated: full body
+    response = client.get(url, headers={"Authorization": MOCK_AUTH_TOKEN, "Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.content == content
+
+    response = client.get(url, headers={"Authorization": MOCK_AUTH_TOKEN, "Range": "bytes=0-9", "If-Range": etag})
+    assert response.status_code == 206
+    assert response.content == content[:10]
+
+    response = client.get(url, headers={"Authorization": MOCK_AUTH_TOKEN, "Range": f"bytes={len(content)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(content)}"
+
+def test_stream_chapter_audio_missing_file(tmp_path):
+    url, _ = _create_audio_file(tmp_path)
+    (tmp_path / "chapter_1.mp3").unlink()
+    response = client.get(url, headers={"Authorization": MOCK_AUTH_TOKEN})
+    assert response.status_code == 404
+
+# --- Tests for POST /books/upload and the TTS worker ---
+def _epub_bytes(chapters=5, **kwargs):
+    import io
+    from echoread.api_server.benchmarks.epub_corpus import make_epub, synthetic_chapters
+    buffer = io.BytesIO()
+    make_epub(buffer, synthetic_chapters(chapters, paragraphs=2, sentences=3), **kwargs)
+    return buffer.getvalue()
+
+def _upload_book(filename="My Book.epub", content=None):
+    content = content if content is not None else _epub_bytes(title=None, author=None)
+    return client.post(
+        "/books/upload",
+        files={"file": (filename, content, "application/epub+zip")},
+        headers={"Authorization": MOCK_AUTH_TOKEN},
+    )
+
+def _make_worker(tmp_path, **kwargs):
+    from concurrent.futures import ThreadPoolExecutor
+    from echoread.api_server.worker import Worker
+    return Worker(session_factory=TestingSessionLocal, executor=ThreadPoolExecutor(max_workers=2),
+                  storage_root=str(tmp_path), poll_interval=0, **kwargs)
+
+def test_upload_book_enqueues_job():
+    response = _upload_book()
+    assert response.status_code == 202
+    data = response.json()
+    assert data["status"] == "pending"
+    assert data["title"] == "My Book"
+
+    db = TestingSessionLocal()
+    queued = db.query(models.Job).filter(models.Job.book_id == data["id"]).all()
+    assert [(job.kind, job.status) for job in queued] == [("synthesize_book", "queued")]
+    assert db.query(models.Audio).filter(models.Audio.book_id == data["id"]).count() == 0
+    db.close()
+
+def test_worker_processes_queued_job(tmp_path):
+    book_id = _upload_book().json()["id"]
+    worker = _make_worker(tmp_path)
+
+    assert worker.run_once() is True
+    assert worker.run_once() is False # Queue is now empty
+
+    status_data = client.get(f"/books/{book_id}/status", headers={"Authorization": MOCK_AUTH_TOKEN}).json()
+    assert status_data["status"] == "complete"
+    assert status_data["processed_chapters"] == status_data["total_chapters"] == 5
+
+    db = TestingSessionLocal()
+    audios = db.query(models.Audio).filter(models.Audio.book_id == book_id).order_by(models.Audio.chapter_index).all()
+    assert [audio.chapter_index for audio in audios] == [1, 2, 3, 4, 5]
+    assert all(os.path.getsize(audio.audio_path) > 44 and audio.duration > 0 for audio in audios)
+    assert db.query(models.Job).filter(models.Job.book_id == book_id).one().status == "done"
+    assert db.get(models.Book, book_id).version == 1 + 1 + 5 + 1 # processing, five chapters, complete
+    db.close()
+
+def test_long_running_job_with_a_fresh_heartbeat_is_not_requeued(tmp_path, monkeypatch):
+    from datetime import timedelta
+    from echoread.api_server import config, jobs
+    monkeypatch.setattr(config, "TTS_JOB_TIMEOUT", 300)
+    book_id = _upload_book().json()["id"]
+    worker = _make_worker(tmp_path)
+    db = TestingSessionLocal()
+    job = jobs.claim_next_job(db, worker.worker_id)
+    hours_ago = datetime.utcnow() - timedelta(hours=2)
+    job.started_at = job.heartbeat_at = hours_ago # Synthesizing for two hours, last beat long ago
+    db.commit()
+
+    worker._running_jobs.add(job.id) # Still being processed by this worker: its timer beats
+    worker.heartbeat()
+    db.refresh(job)
+    assert (job.status, job.locked_by) == (jobs.JOB_RUNNING, worker.worker_id)
+    assert job.heartbeat_at > hours_ago
+
+    worker._running_jobs.clear() # The worker died: no more beats
+    job.heartbeat_at = hours_ago
+    db.commit()
+    _make_worker(tmp_path).heartbeat() # Any other worker's periodic sweep
+    db.refresh(job)
+    assert (job.status, job.locked_by) == (jobs.JOB_QUEUED, None)
+    db.close()
+
+    assert worker.run_once() is True # Chapter commits beat too
+    db = TestingSessionLocal()
+    job = db.query(models.Job).filter(models.Job.book_id == book_id).one()
+    assert job.status == jobs.JOB_DONE and job.heartbeat_at > hours_ago
+    db.close()
+
+def test_worker_packages_segmented_chapters(tmp_path):
+    import wave
+    from urllib.parse import urlsplit
+    book_id = _upload_book().json()["id"]
+    assert _make_worker(tmp_path, segment_seconds=0.5).run_once() is True
+    headers = {"Authorization": MOCK_AUTH_TOKEN}
+
+    audio = client.get(f"/books/{book_id}/audios", headers=headers).json()[0]
+    urls = client.get(f"/books/{book_id}/audios/{audio['audio_id']}", headers=headers).json()
+    assert urlsplit(urls["playlist_url"]).path.endswith("/chapter_1.m3u8")
+    playlist = client.get(_local(urls["playlist_url"]))
+    assert playlist.headers["content-type"] == "application/vnd.apple.mpegurl"
+    lines = playlist.text.splitlines()
+    assert lines[0] == "#EXTM3U" and lines[-1] == "#EXT-X-ENDLIST"
+    segment_urls = [line for line in lines if not line.startswith("#")]
+    assert len(segment_urls) > 1 and all("sig=" in url for url in segment_urls) # Each segment is signed
+
+    pcm = b""
+    for url in segment_urls:
+        segment = client.get(_local(url))
+        assert segment.headers["cache-control"] == "public, max-age=31536000, immutable"
+        path = tmp_path / "segment.wav"
+        path.write_bytes(segment.content)
+        with wave.open(str(path), "rb") as wav:
+            pcm += wav.readframes(wav.getnframes())
+    with wave.open(str(tmp_path / MOCK_USER_ID / book_id / "chapter_1.wav"), "rb") as wav:
+        assert pcm == wav.readframes(wav.getnframes()) # Segments cover the chapter exactly
+
+def _local(url):
+    from urllib.parse import urlsplit
+    parts = urlsplit(url)
+    return f"{parts.path}?{parts.query}"
+
+def test_worker_retries_then_marks_book_error(tmp_path, monkeypatch):
+    from echoread.api_server import batching
+    def broken_synthesis(*args):
+        raise RuntimeError("model crashed")
+    monkeypatch.setattr(batching, "synthesize_batch", broken_synthesis)
+
+    book_id = _upload_book().json()["id"]
+    worker = _make_worker(tmp_path, max_attempts=2)
+
+    assert worker.run_once() is True # First attempt fails and is requeued
+    db = TestingSessionLocal()
+    assert db.get(models.Book, book_id).status == "pending"
+    db.close()
+
+    assert worker.run_once() is True # Second attempt exhausts the retries
+    db = TestingSessionLocal()
+    job = db.query(models.Job).filter(models.Job.book_id == book_id).one()
+    assert (job.status, job.attempts) == ("failed", 2)
+    assert "model crashed" in job.error
+    assert db.get(models.Book, book_id).status == "error"
+    db.close()
+
+def test_delete_book_cascades_and_reaps_files(storage_root):
+    from echoread.api_server import reaper
+    from echoread.api_server.playback import play_id
+    book_id = _upload_book().json()["id"]
+    assert _make_worker(storage_root, segment_seconds=1).run_once() is True
+    db = TestingSessionLocal()
+    audio_id = db.query(models.Audio.id).filter(models.Audio.book_id == book_id).first()[0]
+    db.add(models.Play(id=play_id(MOCK_USER_ID, book_id), user_id=MOCK_USER_ID, book_id=book_id, audio_id=audio_id,
+                       last_timestamp=1.0))
+    db.commit()
+    db.close()
+    book_files = len(os.listdir(storage_root / MOCK_USER_ID / book_id))
+
+    headers = {"Authorization": MOCK_AUTH_TOKEN}
+    assert client.delete(f"/books/{book_id}", headers=headers).status_code == 204
+    db = TestingSessionLocal()
+    for model in (models.Book, models.Audio, models.Play, models.Job): # ON DELETE CASCADE, one statement
+        assert db.query(model).filter(getattr(model, "id" if model is models.Book else "book_id") == book_id).count() == 0
+    db.close()
+    assert not os.path.exists(storage_root / MOCK_USER_ID / book_id) # Moved to the trash right away...
+    assert client.delete(f"/books/{book_id}", headers=headers).status_code == 404
+
+    # ...and removed from there in batches
+    assert reaper.reap(limit=2) == 2
+    background = reaper.Reaper(interval=60, batch_size=book_files)
+    assert asyncio.run(background.run_once()) == book_files - 2
+    assert os.listdir(storage_root / ".trash") == []
+
+def test_worker_drops_job_of_book_deleted_midway(tmp_path, monkeypatch):
+    from echoread.api_server import batching, storage
+    real_synthesize = batching.synthesize_batch
+    book_id = _upload_book().json()["id"]
+    def delete_during_synthesis(engine_name, texts):
+        if "Chapter 3" in texts: # Chapters 1-2 are committed, the rest still in flight
+            db = TestingSessionLocal()
+            db.query(models.Book).filter(models.Book.id == book_id).delete()
+            db.commit()
+            db.close()
+            storage.trash_book(MOCK_USER_ID, book_id, storage_root=str(tmp_path))
+        return real_synthesize(engine_name, texts)
+    monkeypatch.setattr(batching, "synthesize_batch", delete_during_synthesis)
+
+    assert _make_worker(tmp_path, batch_size=1).run_once() is True
+    db = TestingSessionLocal()
+    assert db.query(models.Audio).filter(models.Audio.book_id == book_id).count() == 0
+    assert db.query(models.Job).filter(models.Job.book_id == book_id).count() == 0
+    db.close()
+    # Chapters written after the delete went to the trash too, not into a resurrected book directory
+    assert not os.path.exists(tmp_path / MOCK_USER_ID / book_id)
+
+def test_download_book_streams_zip_and_resumes(storage_root):
+    import io
+    import zipfile
+    book_id = _upload_book().json()["id"]
+    assert _make_worker(storage_root, segment_seconds=1).run_once() is True
+    headers = {"Authorization": MOCK_AUTH_TOKEN}
+
+    response = client.get(f"/books/{book_id}/download", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    assert response.headers["content-disposition"] == 'attachment; filename="My Book.zip"'
+    body = response.content
+    assert int(response.headers["content-length"]) == len(body)
+    with zipfile.ZipFile(io.BytesIO(body)) as archive:
+        assert archive.testzip() is None # Every CRC checks out
+        assert archive.namelist() == ["manifest.json"] + [f"chapter_{i:03d}.wav" for i in range(1, 6)] # No segments
+        assert {info.compress_type for info in archive.infolist()} == {zipfile.ZIP_STORED}
+        manifest = json.loads(archive.read("manifest.json"))
+        assert manifest["book"]["id"] == book_id
+        assert [chapter["index"] for chapter in manifest["chapters"]] == [1, 2, 3, 4, 5]
+        assert all(chapter["duration"] > 0 for chapter in manifest["chapters"])
+        assert archive.read("chapter_002.wav") == (storage_root / MOCK_USER_ID / book_id / "chapter_2.wav").read_bytes()
+
+    etag = response.headers["etag"]
+    resumed = client.get(f"/books/{book_id}/download", headers={**headers, "Range": "bytes=1000-", "If-Range": etag})
+    assert resumed.status_code == 206
+    assert resumed.headers["content-range"] == f"bytes 1000-{len(body) - 1}/{len(body)}"
+    assert resumed.content == body[1000:] # Same bytes on every request, so the pieces fit together
+    stale = client.get(f"/books/{book_id}/download", headers={**headers, "Range": "bytes=1000-", "If-Range": '"old"'})
+    assert (stale.status_code, stale.content) == (200, body)
+    unsatisfiable = client.get(f"/books/{book_id}/download", headers={**headers, "Range": f"bytes={len(body)}-"})
+    assert unsatisfiable.status_code == 416
+    head = client.head(f"/books/{book_id}/download", headers=headers)
+    assert (head.headers["content-length"], head.content) == (str(len(body)), b"")
+
+def test_download_uses_crcs_stored_by_the_worker(storage_root, monkeypatch):
+    import io
+    import zipfile
+    from echoread.api_server import book_zip
+    book_id = _upload_book().json()["id"]
+    assert _make_worker(storage_root).run_once() is True
+    db = TestingSessionLocal()
+    audios = db.query(models.Audio).filter(models.Audio.book_id == book_id).all()
+    db.close()
+    assert all(audio.crc32 == book_zip.compute_crc32(audio.audio_path) for audio in audios)
+
+    # Another API process: nothing cached, and no chapter may be read before the response starts
+    book_zip.crc_cache.clear()
+    def no_crc_pass(path, size, mtime_ns):
+        raise AssertionError(f"{path} read for its CRC")
+    monkeypatch.setattr(book_zip, "file_crc32", no_crc_pass)
+    response = client.get(f"/books/{book_id}/download", headers={"Authorization": MOCK_AUTH_TOKEN})
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert archive.testzip() is None
+
+def test_download_archive_switches_to_zip64(tmp_path, monkeypatch):
+    import io
+    import zipfile
+    from echoread.api_server import book_zip
+    monkeypatch.setattr(book_zip, "ZIP64_LIMIT", 1000) # Stand-in for 4 GiB
+    monkeypatch.setattr(book_zip, "ZIP64_COUNT_LIMIT", 2)
+    chapters = []
+    for index, size in enumerate([700, 1500, 300], 1):
+        path = tmp_path / f"chapter_{index}.wav"
+        path.write_bytes(os.urandom(size))
+        chapters.append((f"audio_{index}", index, str(path), 1.0, None))
+
+    archive = book_zip.book_archive({"id": "book", "title": "Big", "author": None}, chapters)
+    body = b"".join(part.data if part.data is not None else open(part.path, "rb").read() for part in archive.parts)
+    assert len(body) == archive.size
+    with zipfile.ZipFile(io.BytesIO(body)) as parsed:
+        assert parsed.testzip() is None
+        assert [info.file_size for info in parsed.infolist()[1:]] == [700, 1500, 300]
+        assert parsed.read("chapter_003.wav") == (tmp_path / "chapter_3.wav").read_bytes()
+
+def test_metrics_report_routes_queries_and_queue(tmp_path, monkeypatch):
+    from prometheus_client import REGISTRY
+    from prometheus_client.parser import text_string_to_metric_families
+
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    route = {"route": "/books/{book_id}"}
+    before = {
+        "requests": sample("echoread_http_requests_total", method="GET", status="200", **route),
+        "latency": sample("echoread_http_request_duration_seconds_count", method="GET", **route),
+        "statements": sample("echoread_db_statements_per_request_sum", **route),
+        "checkouts": sample("echoread_db_pool_checkout_seconds_count", engine="async"),
+        "missing": sample("echoread_http_requests_total", method="GET", route=metrics.UNMATCHED_ROUTE, status="404"),
+        "chapters": sample("echoread_tts_chapter_synthesis_seconds_count"),
+        "first_chapters": sample("echoread_tts_time_to_first_chapter_seconds_count"),
+    }
+    book_id = _upload_book().json()["id"]
+    headers = {"Authorization": MOCK_AUTH_TOKEN}
+    for _ in range(3):
+        assert client.get(f"/books/{book_id}", headers=headers).status_code == 200
+    assert client.get("/no/such/path").status_code == 404
+
+    assert sample("echoread_http_requests_total", method="GET", status="200", **route) == before["requests"] + 3
+    assert sample("echoread_http_request_duration_seconds_count", method="GET", **route) == before["latency"] + 3
+    assert sample("echoread_db_statements_per_request_sum", **route) > before["statements"] # Labelled by template, not path
+    assert sample("echoread_db_pool_checkout_seconds_count", engine="async") > before["checkouts"]
+    assert sample("echoread_http_requests_total", method="GET", route=metrics.UNMATCHED_ROUTE, status="404") == \
+        before["missing"] + 1
+
+    from echoread.api_server import config
+    monkeypatch.setattr(config, "METRICS_TOKEN", "scrape-secret")
+    metrics_headers = {"Authorization": "Bearer scrape-secret"}
+
+    def scrape():
+        response = client.get("/metrics", headers=metrics_headers)
+        return {family.name: family for family in text_string_to_metric_families(response.text)}
+
+    def queue(families):
+        return {s.labels["status"]: s.value for s in families["echoread_tts_jobs"].samples}
+
+    families = scrape()
+    assert "echoread_http_request_duration_seconds" in families
+    assert queue(families) == {"queued": 1, "running": 0, "done": 0, "failed": 0}
+
+    assert _make_worker(tmp_path).run_once() is True
+    assert sample("echoread_tts_chapter_synthesis_seconds_count") == before["chapters"] + 5
+    assert sample("echoread_tts_time_to_first_chapter_seconds_count") == before["first_chapters"] + 1 # Once per book
+    assert queue(scrape()) == {"queued": 0, "running": 0, "done": 1, "failed": 0}
+
+
+def test_metrics_require_the_configured_token(monkeypatch):
+    from echoread.api_server import config
+    monkeypatch.setattr(config, "METRICS_TOKEN", None)
+    assert client.get("/metrics", headers={"Authorization": "Bearer anything"}).status_code == 404
+
+    monkeypatch.setattr(config, "METRICS_TOKEN", "scrape-secret")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert client.get("/metrics", headers={"Authorization": MOCK_AUTH_TOKEN}).status_code == 401 # User tokens don't do
+    response = client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"})
+    assert response.status_code == 200
+    assert "echoread_http_requests" in response.text
+
+def test_profiling_middleware_profiles_requested_requests_only(tmp_path):
+    from echoread.api_server import profiling
+    book_id, _ = _create_book_with_chapters(1)
+    profiled = TestClient(profiling.ProfilingMiddleware(app, token="debug-token", sample_rate=0, directory=str(tmp_path)))
+    headers = {"Authorization": MOCK_AUTH_TOKEN}
+
+    for extra in ({}, {"X-Profile": "wrong-token"}):
+        response = profiled.get(f"/books/{book_id}", headers={**headers, **extra})
+        assert response.status_code == 200
+        assert "server-timing" not in response.headers and "x-profile" not in response.headers
+    assert list(tmp_path.iterdir()) == []
+
+    response = profiled.get(f"/books/{book_id}", headers={**headers, "X-Profile": "debug-token"})
+    assert response.status_code == 200
+    assert response.json()["id"] == book_id
+    timing = response.headers["server-timing"]
+    assert timing.startswith("app;dur=") and 'statements"' in timing and 'desc="0 statements"' not in timing
+    filename = response.headers["x-profile"]
+    assert filename.endswith(".speedscope.json") and "-GET-books-book_id-" in filename
+    document = json.loads((tmp_path / filename).read_text())
+    (sampled,) = document["profiles"]
+    assert sampled["type"] == "sampled" and sampled["name"] == "GET /books/{book_id}"
+    assert len(sampled["samples"]) == len(sampled["weights"]) >= 1
+    names = [frame["name"] for frame in document["shared"]["frames"]]
+    assert names[0] == "ProfilingMiddleware.__call__" # Stacks start at the middleware
+
+def test_profiling_middleware_samples_to_collapsed_stacks(tmp_path):
+    from echoread.api_server import profiling
+    sampled = TestClient(profiling.ProfilingMiddleware(app, token=None, sample_rate=1.0, directory=str(tmp_path),
+                                                       output_format="collapsed"))
+    response = sampled.get("/")
+    assert response.status_code == 200
+    assert "x-profile" not in response.headers # Summaries only go to whoever asked for the profile
+    (path,) = tmp_path.iterdir()
+    assert "-GET-root-" in path.name and path.name.endswith(".collapsed.txt")
+    lines = path.read_text().splitlines()
+    assert lines and all(line.startswith("ProfilingMiddleware.__call__ (") for line in lines)
+    assert all(int(line.rsplit(" ", 1)[1]) >= 1 for line in lines)
+
+def test_profiling_middleware_keeps_only_the_newest_profiles(tmp_path):
+    from echoread.api_server import profiling
+    (tmp_path / "notes.txt").write_text("not a profile") # Other files in PROFILE_DIR are left alone
+    sampled = TestClient(profiling.ProfilingMiddleware(app, token=None, sample_rate=1.0, directory=str(tmp_path),
+                                                       output_format="collapsed", max_files=3))
+    written = []
+    for i in range(5):
+        assert sampled.get("/").status_code == 200
+        (newest,) = set(tmp_path.glob("*.collapsed.txt")) - set(written)
+        os.utime(newest, ns=(i * 10**9, i * 10**9)) # Distinct mtimes, oldest first
+        written.append(newest)
+    assert sorted(tmp_path.iterdir()) == sorted(written[2:] + [tmp_path / "notes.txt"])
+
+def _lagging_replica(tmp_path, monkeypatch):
+    '''Route reads to a copy of the primary taken now, which later writes do not reach; returns (client, engine).'''
+    import shutil
+    from echoread.api_server import database, replicas
+    replica_url = f"sqlite:///{tmp_path / 'replica.db'}"
+    shutil.copyfile(make_url(DATABASE_URL).database, tmp_path / "replica.db")
+    replica_engine = create_async_engine(async_database_url(replica_url), poolclass=NullPool)
+    monkeypatch.setitem(database._database_urls, "replica", async_database_url(replica_url))
+    monkeypatch.setattr(database, "_replica_engine", replica_engine)
+    monkeypatch.setattr(replicas, "pins", replicas.WritePins(60))
+    return TestClient(replicas.ReadYourWritesMiddleware(app)), replica_engine
+
+def test_read_routes_use_the_replica_until_the_user_writes(tmp_path, monkeypatch):
+    from echoread.api_server import replicas
+    routed, replica_engine = _lagging_replica(tmp_path, monkeypatch)
+    headers = {"Authorization": MOCK_AUTH_TOKEN}
+    book_id, audio_ids = _create_book_with_chapters(1) # Written to the primary only
+
+    assert routed.get(f"/books/{book_id}", headers=headers).status_code == 404
+    assert routed.get("/books", headers=headers).json() == []
+
+    response = routed.post("/books/upload", headers=headers,
+                           files={"file": ("New.epub", _epub_bytes(title=None, author=None), "application/epub+zip")})
+    assert response.status_code == 202
+    assert response.headers["set-cookie"].startswith(f"{replicas.PIN_COOKIE}=")
+    assert routed.get(f"/books/{book_id}", headers=headers).status_code == 200 # Pinned in this process
+    assert len(routed.get("/books", headers=headers).json()) == 2
+
+    monkeypatch.setattr(replicas, "pins", replicas.WritePins(60)) # As seen by another worker process
+    assert routed.get(f"/books/{book_id}", headers=headers).status_code == 200 # The cookie pins
+    routed.cookies.clear()
+    assert routed.get(f"/books/{book_id}", headers=headers).status_code == 404
+    asyncio.run(replica_engine.dispose())
+
+def test_play_heartbeat_then_read_sees_the_new_position(tmp_path, monkeypatch):
+    from echoread.api_server import playback, replicas
+    headers = {"Authorization": MOCK_AUTH_TOKEN}
+    book_id, (first, second) = _create_book_with_chapters()
+    assert client.post("/plays", headers=headers, json={"book_id": book_id, "audio_id": first, "last_timestamp": 1.0}).status_code == 200
+    routed, replica_engine = _lagging_replica(tmp_path, monkeypatch) # Has the book and the first position
+    assert routed.get(f"/play/{book_id}", headers=headers).json()[0]["audio_id"] == first
+
+    response = routed.post("/plays", headers=headers, json={"book_id": book_id, "audio_id": second, "last_timestamp": 2.0})
+    assert response.headers["set-cookie"].startswith(f"{replicas.PIN_COOKIE}=")
+    assert routed.get(f"/play/{book_id}", headers=headers).json()[0]["audio_id"] == second
+    monkeypatch.setattr(replicas, "pins", replicas.WritePins(60)) # Read served by another worker process
+    assert routed.get(f"/play/{book_id}", headers=headers).json()[0]["audio_id"] == second # The cookie pins
+
+    # Buffered heartbeats reach the primary at the next flush: the window covers that as well
+    monkeypatch.setattr(playback, "position_buffer", playback.PositionBuffer(TestingAsyncSessionLocal, interval=30))
+    response = routed.post("/plays", headers=headers, json={"book_id": book_id, "audio_id": first, "last_timestamp": 3.0})
+    assert "Max-Age=90;" in response.headers["set-cookie"]
+    assert routed.get(f"/play/{book_id}", headers=headers).json()[0]["audio_id"] == first
+    asyncio.run(replica_engine.dispose())
+
+def test_upload_book_streams_file_to_disk(storage_root):
+    import hashlib
+    content = _epub_bytes(cover_image_bytes=3 * 1024 * 1024 + 17) # Spans several upload chunks
+    book_id = _upload_book(content=content).json()["id"]
+
+    db = TestingSessionLocal()
+    book = db.get(models.Book, book_id)
+    assert book.epub_path == str(storage_root / MOCK_USER_ID / book_id / "book.epub")
+    assert book.content_sha256 == hashlib.sha256(content).hexdigest()
+    db.close()
+    with open(book.epub_path, "rb") as stored:
+        assert stored.read() == content
+    assert os.listdir(storage_root / MOCK_USER_ID / ".incoming") == [] # Temp file was renamed away
+
+def test_upload_book_writes_the_file_once(storage_root, monkeypatch):
+    # The body is parsed as it arrives: Starlette's form parser (which spools files to disk first) is never used
+    from starlette.formparsers import MultiPartParser
+    async def spooling_parse(self):
+        raise AssertionError("upload spooled through request.form()")
+    monkeypatch.setattr(MultiPartParser, "parse", spooling_parse)
+    from echoread.api_server import config
+    monkeypatch.setattr(config, "UPLOAD_CHUNK_SIZE", 4096)
+
+    content = _epub_bytes(cover_image_bytes=256 * 1024)
+    response = client.post("/books/upload", headers={"Authorization": MOCK_AUTH_TOKEN},
+                           data={"note": "ignored"},
+                           files={"cover": ("cover.png", b"not this one", "image/png"),
+                                  "file": ("My Book.epub", content, "application/epub+zip")})
+    assert response.status_code == 202
+    with open(os.path.join(storage_root, MOCK_USER_ID, response.json()["id"], "book.epub"), "rb") as stored:
+        assert stored.read() == content
+
+def test_upload_book_requires_a_file_part(storage_root):
+    headers = {"Authorization": MOCK_AUTH_TOKEN}
+    assert client.post("/books/upload", headers=headers, content=b"raw bytes").status_code == 400
+    assert client.post("/books/upload", headers=headers, data={"file": "not a file"}).status_code == 400
+    response = client.post("/books/upload", headers=headers, data={"file": "not a file"},
+                           files={"cover": ("cover.png", b"not an epub", "image/png")})
+    assert response.status_code == 400
+    assert os.listdir(storage_root / MOCK_USER_ID / ".incoming") == []
+
+def test_upload_book_removes_its_directory_when_the_commit_fails(storage_root, monkeypatch):
+    from echoread.api_server import jobs
+    def lost_connection(db, book):
+        raise ConnectionError("database went away")
+    monkeypatch.setattr(jobs, "enqueue_book_synthesis", lost_connection)
+
+    with pytest.raises(ConnectionError):
+        _upload_book()
+    assert sorted(os.listdir(storage_root / MOCK_USER_ID)) == [".incoming"] # No orphaned book directory
+    assert os.listdir(storage_root / MOCK_USER_ID / ".incoming") == []
+
+def test_upload_book_detects_duplicate():
+    content = _epub_bytes()
+    first = _upload_book(content=content)
+    second = _upload_book(filename="Renamed.epub", content=content)
+    assert first.status_code == 202
+    assert second.status_code == 200
+    assert second.json()["id"] == first.json()["id"]
+
+    db = TestingSessionLocal()
+    assert db.query(models.Book).filter(models.Book.user_id == MOCK_USER_ID).count() == 1
+    assert db.query(models.Job).count() == 1
+    db.close()
+
+def test_upload_book_rejects_oversized_file(storage_root, monkeypatch):
+    from echoread.api_server import config
+    monkeypatch.setattr(config, "MAX_UPLOAD_BYTES", 1024)
+    monkeypatch.setattr(config, "UPLOAD_CHUNK_SIZE", 256)
+
+    response = _upload_book(content=b"x" * 4096)
+    assert response.status_code == 413
+    assert os.listdir(storage_root / MOCK_USER_ID / ".incoming") == []
+    db = TestingSessionLocal()
+    assert db.query(models.Book).count() == 0
+    db.close()
+
+def test_upload_size_limit_middleware_checks_content_length():
+    from fastapi import FastAPI
+    from echoread.api_server.storage import UploadSizeLimitMiddleware, MULTIPART_OVERHEAD
+    limited_app = FastAPI()
+    limited_app.add_middleware(UploadSizeLimitMiddleware, max_bytes=1024)
+    @limited_app.post("/books/upload")
+    async def upload():
+        return {"ok": True}
+    limited_client = TestClient(limited_app)
+
+    assert limited_client.post("/books/upload", content=b"x" * 512).status_code == 200
+    response = limited_client.post("/books/upload", content=b"x" * (1024 + MULTIPART_OVERHEAD + 1))
+    assert response.status_code == 413
+
+def test_upload_book_reads_epub_metadata():
+    response = _upload_book(content=_epub_bytes(chapters=3, title="Moby-Dick", author="Herman Melville"))
+    assert response.status_code == 202
+    data = response.json()
+    assert (data["title"], data["chapter_count"]) == ("Moby-Dick", 3)
+    assert client.get(f"/books/{data['id']}", headers={"Authorization": MOCK_AUTH_TOKEN}).json()["author"] == "Herman Melville"
+
+def test_upload_book_rejects_invalid_epub(storage_root):
+    response = _upload_book(content=b"PK\x03\x04 not really an epub")
+    assert response.status_code == 400
+    assert os.listdir(storage_root / MOCK_USER_ID / ".incoming") == []
+
+def test_worker_makes_chapters_playable_as_they_finish(tmp_path, monkeypatch):
+    from echoread.api_server import batching
+    real_synthesize = batching.synthesize_batch
+    calls, failures = [], []
+    def flaky_synthesis(engine_name, texts):
+        calls.extend(text for text in texts if text.startswith("Chapter ")) # Each chapter starts with its heading
+        if "Chapter 3" in texts and not failures:
+            failures.append(texts)
+            raise RuntimeError("transient failure")
+        return real_synthesize(engine_name, texts)
+    monkeypatch.setattr(batching, "synthesize_batch", flaky_synthesis)
+
+    book_id = _upload_book().json()["id"]
+    worker = _make_worker(tmp_path, batch_size=1) # One sentence per model call: the failure hits only chapter 3
+    headers = {"Authorization": MOCK_AUTH_TOKEN}
+
+    assert worker.run_once() is True # Chapter 3 fails; the others are already playable
+    listed = client.get(f"/books/{book_id}/audios", headers=headers).json()
+    assert [audio["chapter_index"] for audio in listed] == [1, 2, 4, 5]
+    status_data = client.get(f"/books/{book_id}/status", headers=headers).json()
+    assert (status_data["status"], status_data["processed_chapters"], status_data["total_chapters"]) == ("pending", 4, 5)
+
+    calls.clear()
+    assert worker.run_once() is True # The retry only synthesizes the missing chapter
+    assert calls == ["Chapter 3"]
+    listed = client.get(f"/books/{book_id}/audios", headers=headers).json()
+    assert [audio["chapter_index"] for audio in listed] == [1, 2, 3, 4, 5]
+
+    db = TestingSessionLocal()
+    job = db.query(models.Job).filter(models.Job.book_id == book_id).one()
+    assert job.status == "done"
+    assert job.created_at <= job.first_chapter_at <= job.finished_at
+    db.close()
+
+def test_worker_reuses_cached_chapters_across_uploads(tmp_path, monkeypatch):
+    from echoread.api_server import batching
+    worker = _make_worker(tmp_path)
+    first_id = _upload_book(content=_epub_bytes(title="First Edition")).json()["id"]
+    assert worker.run_once() is True
+
+    def no_model(*args):
+        raise AssertionError("chapter should have come from the cache")
+    monkeypatch.setattr(batching, "synthesize_batch", no_model)
+    # Different file (new title) with identical chapter text: every chapter is a cache hit
+    second_id = _upload_book(content=_epub_bytes(title="Second Edition")).json()["id"]
+    assert second_id != first_id
+    assert worker.run_once() is True
+
+    db = TestingSessionLocal()
+    assert db.get(models.Book, second_id).status == "complete"
+    first_audios = db.query(models.Audio).filter(models.Audio.book_id == first_id).order_by(models.Audio.chapter_index).all()
+    second_audios = db.query(models.Audio).filter(models.Audio.book_id == second_id).order_by(models.Audio.chapter_index).all()
+    assert [a.duration for a in second_audios] == [a.duration for a in first_audios]
+    for first, second in zip(first_audios, second_audios):
+        with open(first.audio_path, "rb") as a, open(second.audio_path, "rb") as b:
+            assert a.read() == b.read()
+    db.close()
+    assert worker.cache.stats()["hits"] == 5
+
+# --- Tests for GET /books/{id}/status/stream ---
+def _sse_events(body):
+    '''(event ids, parsed data, comment lines) of an SSE body.'''
+    ids, data, comments = [], [], []
+    for block in body.split("\n\n"):
+        for line in block.splitlines():
+            if line.startswith("id: "):
+                ids.append(line[4:])
+            elif line.startswith("data: "):
+                data.append(json.loads(line[6:]))
+            elif line.startswith(":"):
+                comments.append(line)
+    return ids, data, comments
+
+def test_status_stream_pushes_progress_until_complete(monkeypatch):
+    import threading
+    import time
+    from echoread.api_server import progress
+    monkeypatch.setattr(progress, "broker", progress.ProgressBroker(TestingAsyncSessionLocal, interval=0.02, heartbeat=0.05))
+    book_id, _ = _create_book_with_chapters(count=1)
+    db = TestingSessionLocal()
+    book = db.get(models.Book, book_id)
+    book.status, book.chapter_count = "processing", 3
+    db.commit()
+    db.close()
+
+    def worker_progress(): # Stands in for the TTS worker committing chapters
+        for processed, status in ((2, "processing"), (3, "complete")):
+            time.sleep(0.2)
+            db = TestingSessionLocal()
+            book = db.get(models.Book, book_id)
+            book.processed_chapters, book.status = processed, status
+            db.commit()
+            db.close()
+    updater = threading.Thread(target=worker_progress)
+    updater.start()
+    response = client.get(f"/books/{book_id}/status/stream", headers={"Authorization": MOCK_AUTH_TOKEN})
+    updater.join()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    ids, data, comments = _sse_events(response.text)
+    assert [(d["processed_chapters"], d["status"]) for d in data] == [(1, "processing"), (2, "processing"), (3, "complete")]
+    assert ids == ["1.3.processing", "2.3.processing", "3.3.complete"]
+    assert ": heartbeat" in comments
+    assert progress.broker.subscriber_count() == 0
+
+    # Reconnecting with the last id seen: nothing new, and the stream ends since the book is complete
+    replay = client.get(f"/books/{book_id}/status/stream", headers={"Authorization": MOCK_AUTH_TOKEN, "Last-Event-ID": ids[-1]})
+    assert _sse_events(replay.text)[1] == []
+    replay = client.get(f"/books/{book_id}/status/stream", headers={"Authorization": MOCK_AUTH_TOKEN, "Last-Event-ID": ids[0]})
+    assert _sse_events(replay.text)[0] == [ids[-1]]
+
+    missing = client.get(f"/books/{uuid.uuid4()}/status/stream", headers={"Authorization": MOCK_AUTH_TOKEN})
+    assert missing.status_code == 404
+
+def test_progress_broker_fans_out_one_query_per_poll():
+    import asyncio
+    from echoread.api_server import progress
+    book_id, _ = _create_book_with_chapters(count=2)
+    other_book_id, _ = _create_book_with_chapters(count=1)
+
+    async def scenario():
+        broker = progress.ProgressBroker(TestingAsyncSessionLocal, interval=60, heartbeat=60) # Polled explicitly
+        first, second = broker.subscribe(book_id), broker.subscribe(book_id)
+        other = broker.subscribe(other_book_id)
+        await broker.poll()
+        assert broker.polls == 1
+        received = [await subscription.get() for subscription in (first, second, other)]
+        assert [(p.book_id, p.processed_chapters) for p in received] == [(book_id, 2), (book_id, 2), (other_book_id, 1)]
+
+        db = TestingSessionLocal()
+        db.delete(db.get(models.Book, other_book_id))
+        db.commit()
+        db.close()
+        await broker.poll() # Unchanged books publish nothing; deleted ones end their streams
+        assert first._queue.empty() and await other.get() is None
+        await broker.close()
+        assert await first.get() is None and await second.get() is None
+    asyncio.run(scenario())
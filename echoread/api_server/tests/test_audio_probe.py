@@ -0,0 +1,72 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from echoread.api_server import models
+from echoread.api_server.audio_probe import ProbeError, probe_duration
+from echoread.api_server.backfill_durations import backfill
+from echoread.api_server.benchmarks.audio_corpus import (
+    MP3_FRAME_SAMPLES, MP3_SAMPLE_RATE, mp3_frames, write_mp3, write_ogg, write_wav,
+)
+from echoread.api_server.database import Base
+from echoread.api_server.tts import LocalToneEngine, write_wav as write_pcm_wav
+
+
+def test_probes_wav_headers(tmp_path):
+    engine = LocalToneEngine()
+    path = str(tmp_path / "chapter_1.wav")
+    written = write_pcm_wav(path, engine.synthesize("one two three"), engine.sample_rate)
+    assert probe_duration(path) == written
+
+    write_wav(str(tmp_path / "long.wav"), 2400, extra_chunk=True) # Chunks before `data` are skipped
+    assert probe_duration(str(tmp_path / "long.wav")) == 2400
+
+def test_probes_mp3_with_and_without_frame_count(tmp_path):
+    expected = mp3_frames(90) * MP3_FRAME_SAMPLES / MP3_SAMPLE_RATE
+    write_mp3(str(tmp_path / "xing.mp3"), 90, xing=True)
+    write_mp3(str(tmp_path / "vbr.mp3"), 90, xing=False, vbr=True) # No frame count: every frame header is walked
+    for name in ("xing.mp3", "vbr.mp3"):
+        assert probe_duration(str(tmp_path / name)) == pytest.approx(expected)
+
+    write_mp3(str(tmp_path / "cbr.mp3"), 90, xing=False) # CBR: size / bitrate, within a frame
+    write_mp3(str(tmp_path / "bare.mp3"), 90, xing=False, id3=False)
+    for name in ("cbr.mp3", "bare.mp3"):
+        assert probe_duration(str(tmp_path / name)) == pytest.approx(expected, abs=MP3_FRAME_SAMPLES / MP3_SAMPLE_RATE)
+
+def test_probes_ogg_final_granule(tmp_path):
+    write_ogg(str(tmp_path / "chapter.opus"), 125.5, codec="opus")
+    write_ogg(str(tmp_path / "chapter.ogg"), 61.0, codec="vorbis", sample_rate=22050)
+    assert probe_duration(str(tmp_path / "chapter.opus")) == pytest.approx(125.5)
+    assert probe_duration(str(tmp_path / "chapter.ogg")) == pytest.approx(61.0)
+
+def test_rejects_unknown_formats(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_bytes(b"not audio at all")
+    with pytest.raises(ProbeError):
+        probe_duration(str(path))
+
+def test_backfill_fills_missing_durations(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'backfill.db'}")
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    write_wav(str(tmp_path / "a.wav"), 30)
+    write_mp3(str(tmp_path / "b.mp3"), 45)
+    with session_factory() as db:
+        db.add(models.User(id="u", email="u@example.com"))
+        db.add(models.Book(id="b", user_id="u", title="Backfill"))
+        db.add_all([
+            models.Audio(id="audio_1", book_id="b", chapter_index=1, audio_path=str(tmp_path / "a.wav")),
+            models.Audio(id="audio_2", book_id="b", chapter_index=2, audio_path=str(tmp_path / "b.mp3")),
+            models.Audio(id="audio_3", book_id="b", chapter_index=3, audio_path=str(tmp_path / "missing.wav")),
+            models.Audio(id="audio_4", book_id="b", chapter_index=4, audio_path=str(tmp_path / "a.wav"), duration=1.0),
+        ])
+        db.commit()
+
+    assert backfill(session_factory, batch_size=2, workers=2) == {"updated": 2, "failed": 1}
+    with session_factory() as db:
+        durations = dict(db.query(models.Audio.id, models.Audio.duration))
+    assert durations["audio_1"] == 30
+    assert durations["audio_2"] == pytest.approx(45, abs=0.03)
+    assert (durations["audio_3"], durations["audio_4"]) == (None, 1.0) # Existing durations are kept
+    assert backfill(session_factory, only_missing=False)["updated"] == 3
+    engine.dispose()
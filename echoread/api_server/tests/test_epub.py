@@ -0,0 +1,117 @@
+import io
+import zipfile
+
+import pytest
+
+from echoread.api_server import epub
+from echoread.api_server.epub import EpubError, EpubReader
+
+CONTAINER = """<?xml version="1.0"?>
+<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="OPS/package.opf"/></rootfiles>
+</container>"""
+
+PACKAGE = """<?xml version="1.0"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="2.0">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:title>  The   Test Book </dc:title><dc:creator>Jane Doe</dc:creator>
+  </metadata>
+  <manifest>
+    <item id="cover" href="text/cover.xhtml" media-type="application/xhtml+xml"/>
+    <item id="notes" href="text/notes.xhtml" media-type="application/xhtml+xml"/>
+    <item id="one" href="text/chapter%20one.xhtml" media-type="application/xhtml+xml"/>
+    <item id="two" href="text/two.xhtml" media-type="application/xhtml+xml"/>
+    <item id="css" href="style.css" media-type="text/css"/>
+  </manifest>
+  <spine><itemref idref="cover"/><itemref idref="one"/><itemref idref="notes" linear="no"/><itemref idref="two"/></spine>
+</package>"""
+
+CHAPTER_ONE = """<html><head><title>Ignored</title><style>p { color: red }</style></head><body>
+<h2>Loomings</h2>
+<p>Call me Ishmael.  Some years ago&#8212;never mind how long&mdash;I went to sea! Did I?</p>
+<script>var x = "not. spoken.";</script>
+<p>An unfinished paragraph</p>
+</body></html>"""
+
+
+def _make_epub(chapter_two="<p>The end.</p>"):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("mimetype", "application/epub+zip")
+        archive.writestr("META-INF/container.xml", CONTAINER)
+        archive.writestr("OPS/package.opf", PACKAGE)
+        archive.writestr("OPS/text/cover.xhtml", "<html><body><img src='cover.jpg'/></body></html>")
+        archive.writestr("OPS/text/notes.xhtml", "<html><body><p>Footnotes.</p></body></html>")
+        archive.writestr("OPS/text/chapter one.xhtml", CHAPTER_ONE)
+        archive.writestr("OPS/text/two.xhtml", f"<html><body>{chapter_two}</body></html>")
+        archive.writestr("OPS/style.css", "p {}")
+    buffer.seek(0)
+    return buffer
+
+
+def test_reads_metadata_and_linear_spine():
+    with EpubReader(_make_epub()) as reader:
+        assert reader.title == "The Test Book"
+        assert reader.author == "Jane Doe"
+        assert reader.spine == ["OPS/text/cover.xhtml", "OPS/text/chapter one.xhtml", "OPS/text/two.xhtml"]
+        assert reader.chapter_count == 3
+
+def test_iter_chapters_extracts_clean_sentences():
+    with EpubReader(_make_epub()) as reader:
+        chapters = list(reader.iter_chapters())
+
+    # The image-only cover has no text and is skipped; chapter numbering follows spoken chapters
+    assert [(chapter.index, chapter.title) for chapter in chapters] == [(1, "Loomings"), (2, None)]
+    assert chapters[0].sentences == [
+        "Loomings",
+        "Call me Ishmael.",
+        "Some years ago—never mind how long—I went to sea!",
+        "Did I?",
+        "An unfinished paragraph",
+    ]
+    assert chapters[1].text == "The end."
+
+def test_iter_chapters_streams_across_read_boundaries(monkeypatch):
+    monkeypatch.setattr(epub, "READ_SIZE", 7) # Forces tags, entities and sentences to straddle chunks
+    paragraphs = "".join(f"<p>Sentence number {i} is here. Caf&eacute; {i}!</p>" for i in range(50))
+    with EpubReader(_make_epub(chapter_two=paragraphs)) as reader:
+        sentences = list(reader.iter_chapters())[1].sentences
+    assert len(sentences) == 100
+    assert sentences[:2] == ["Sentence number 0 is here.", "Café 0!"]
+
+def test_corrupt_chapter_raises_epub_error():
+    buffer = _make_epub(chapter_two="".join(f"<p>Paragraph {i} of many.</p>" for i in range(200)))
+    with zipfile.ZipFile(buffer) as archive:
+        info = archive.getinfo("OPS/text/two.xhtml")
+    data = bytearray(buffer.getvalue())
+    start = info.header_offset + 30 + len(info.filename.encode()) + len(info.extra) # Past the local header
+    data[start + 10:start + 40] = bytes(30) # Damage the deflate stream
+    with EpubReader(io.BytesIO(bytes(data))) as reader:
+        with pytest.raises(EpubError):
+            list(reader.iter_chapters())
+
+def test_closes_the_zip_when_the_package_is_invalid(monkeypatch):
+    opened = []
+    class RecordingZipFile(zipfile.ZipFile):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            opened.append(self)
+    monkeypatch.setattr(epub.zipfile, "ZipFile", RecordingZipFile)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("META-INF/container.xml", CONTAINER)
+        archive.writestr("OPS/package.opf", "<package>not closed")
+    opened.clear()
+    with pytest.raises(EpubError):
+        EpubReader(buffer)
+    (archive,) = opened
+    assert archive.fp is None # Closed
+
+def test_rejects_files_that_are_not_epubs():
+    with pytest.raises(EpubError):
+        EpubReader(io.BytesIO(b"definitely not a zip"))
+    empty = io.BytesIO()
+    with zipfile.ZipFile(empty, "w") as archive:
+        archive.writestr("hello.txt", "hi")
+    with pytest.raises(EpubError):
+        EpubReader(empty)
@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine
+
+from echoread.api_server import models # Registers the tables on Base.metadata
+from echoread.api_server.database import Base
+
+API_SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _alembic(url, *args):
+    # alembic/env.py reads DATABASE_URL when it is imported, hence a separate process
+    subprocess.run([sys.executable, "-m", "alembic", *args], cwd=API_SERVER_DIR, check=True,
+                   env=dict(os.environ, DATABASE_URL=url), capture_output=True)
+
+
+def test_migrations_match_models(tmp_path):
+    url = f"sqlite:///{tmp_path / 'migrated.db'}"
+    _alembic(url, "upgrade", "head")
+
+    engine = create_engine(url)
+    with engine.connect() as connection:
+        differences = compare_metadata(MigrationContext.configure(connection), Base.metadata)
+    engine.dispose()
+
+    assert differences == []
+
+
+def test_migrations_downgrade_to_base(tmp_path):
+    url = f"sqlite:///{tmp_path / 'migrated.db'}"
+    _alembic(url, "upgrade", "head")
+    _alembic(url, "downgrade", "base")
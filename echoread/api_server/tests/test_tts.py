@@ -0,0 +1,113 @@
+import os
+import wave
+
+from echoread.api_server.tts import LocalToneEngine, get_engine, write_wav
+
+
+def test_local_engine_is_deterministic():
+    engine = LocalToneEngine()
+    first = engine.synthesize("Call me Ishmael. Some years ago")
+    assert first == LocalToneEngine().synthesize("Call me Ishmael. Some years ago")
+    assert first != engine.synthesize("Call me Ahab. Some years ago")
+    assert first != LocalToneEngine(voice="other").synthesize("Call me Ishmael. Some years ago")
+
+def test_write_wav_reports_duration(tmp_path):
+    engine = get_engine("local")
+    pcm = engine.synthesize("one two three four")
+    path = tmp_path / "out" / "chapter_1.wav"
+
+    duration = write_wav(str(path), pcm, engine.sample_rate)
+
+    assert duration == 4 * engine.word_seconds
+    with wave.open(str(path), "rb") as wav:
+        assert wav.getframerate() == engine.sample_rate
+        assert wav.getnframes() == len(pcm) // 2
+    assert [p.name for p in path.parent.iterdir()] == ["chapter_1.wav"] # No temp files left behind
+
+
+def _blob(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b"\0" * size)
+    return str(path)
+
+def test_cache_key_normalizes_text():
+    from echoread.api_server.tts_cache import make_key
+    assert make_key("Call  me\nIshmael.", "v", "m1", 16000) == make_key(" Call me Ishmael. ", "v", "m1", 16000)
+    assert make_key("Call me Ishmael.", "v", "m1", 16000) != make_key("Call me Ishmael.", "v", "m2", 16000)
+    assert make_key("Call me Ishmael.", "v", "m1", 16000) != make_key("Call me Ishmael.", "v", "m1", 24000)
+
+def test_cache_hits_misses_and_lru_eviction(tmp_path):
+    from echoread.api_server.tts_cache import SynthesisCache
+    cache = SynthesisCache(str(tmp_path / "cache"), max_bytes=150, rescan_interval=0)
+
+    def store(key):
+        source = _blob(tmp_path, f"{key}.wav", 100)
+        cache.store(key * 64, source)
+        os.unlink(source) # Its book was deleted: only the cache holds the audio now
+
+    store("a")
+    store("b")
+    assert cache.fetch("a" * 64, str(tmp_path / "book" / "chapter_1.wav")) # "a" is now most recently used
+    assert (tmp_path / "book" / "chapter_1.wav").stat().st_size == 100
+    assert not cache.fetch("c" * 64, str(tmp_path / "book" / "chapter_2.wav"))
+
+    store("c")
+    store("d") # Over budget: evicts "b", the least recently used
+    assert not cache.fetch("b" * 64, str(tmp_path / "book" / "chapter_3.wav"))
+    assert cache.stats() == {"hits": 1, "misses": 2, "evictions": 1, "entries": 3, "bytes": 100}
+
+    reopened = SynthesisCache(str(tmp_path / "cache"), max_bytes=150) # Index is rebuilt from disk
+    assert reopened.stats()["entries"] == 3
+    assert reopened.fetch("c" * 64, str(tmp_path / "book" / "chapter_4.wav"))
+
+def test_cache_bound_counts_only_audio_no_book_links_to(tmp_path):
+    # Evicting a blob still linked into a book would free no disk; other processes' blobs count too
+    from echoread.api_server.tts_cache import SynthesisCache
+    cache = SynthesisCache(str(tmp_path / "cache"), max_bytes=250, rescan_interval=0)
+    other_process = SynthesisCache(str(tmp_path / "cache"), max_bytes=250)
+    (tmp_path / "book").mkdir()
+    for key in "abc":
+        cache.store(key * 64, _blob(tmp_path / "book", f"{key}.wav", 100))
+    assert cache.stats()["evictions"] == 0 and cache.stats()["bytes"] == 0 # All still linked into the book
+
+    other_process.store("d" * 64, _blob(tmp_path, "d.wav", 100))
+    os.unlink(tmp_path / "d.wav")
+    os.unlink(tmp_path / "book" / "a.wav")
+    os.unlink(tmp_path / "book" / "b.wav")
+    cache.store("e" * 64, _blob(tmp_path, "e.wav", 10)) # The rescan finds a, b and d held only by the cache
+
+    remaining = sorted(name[0] for _, _, names in os.walk(tmp_path / "cache") for name in names if name.endswith(".wav"))
+    assert remaining == ["b", "c", "d", "e"] # "a" went; "c", though older than "d", is still in the book
+    assert cache.stats() == {"hits": 0, "misses": 0, "evictions": 1, "entries": 4, "bytes": 200}
+
+def test_cache_hit_leaves_already_placed_chapters_untouched(tmp_path):
+    # Blobs share an inode with the chapter files they were linked into; their ETags must not change
+    from echoread.api_server.media import make_etag
+    from echoread.api_server.tts_cache import SynthesisCache
+    cache = SynthesisCache(str(tmp_path / "cache"), max_bytes=1000)
+    (tmp_path / "book1").mkdir()
+    chapter = _blob(tmp_path / "book1", "chapter_1.wav", 100)
+    os.utime(chapter, ns=(1_600_000_000_000_000_000, 1_600_000_000_000_000_000))
+    cache.store("a" * 64, chapter)
+    before = os.stat(chapter)
+
+    assert cache.fetch("a" * 64, str(tmp_path / "book2" / "chapter_1.wav"))
+    after = os.stat(chapter)
+    assert after.st_mtime_ns == before.st_mtime_ns and make_etag(after) == make_etag(before)
+
+def test_batch_scheduler_groups_sentences_and_routes_outputs(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    from echoread.api_server.batching import BatchScheduler
+    engine = get_engine("local")
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        scheduler = BatchScheduler(executor, "local", max_batch_size=3, max_wait=0.5)
+        first = scheduler.synthesize_chapter(["one two.", "three four five."], str(tmp_path / "chapter_1.wav"))
+        second = scheduler.synthesize_chapter(["six.", "seven eight."], str(tmp_path / "chapter_2.wav"))
+        durations = first.result(timeout=5), second.result(timeout=5)
+        scheduler.close()
+
+    assert (scheduler.batches, scheduler.sentences) == (2, 4) # Sentences of both chapters share a batch
+    assert durations == (len(engine.synthesize("one two. three four five.")) / 2 / engine.sample_rate,
+                         len(engine.synthesize("six. seven eight.")) / 2 / engine.sample_rate)
+    with wave.open(str(tmp_path / "chapter_2.wav"), "rb") as wav:
+        assert wav.readframes(wav.getnframes()) == engine.synthesize("six.") + engine.synthesize("seven eight.")
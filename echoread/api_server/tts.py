@@ -0,0 +1,131 @@
+"""
+Text-to-speech engines used by the TTS worker.
+
+Engines turn text into 16-bit little-endian mono PCM at `sample_rate`.
+`LocalToneEngine` is a deterministic stand-in for the real model (Kokoro-style),
+so the whole pipeline can run and be tested without a GPU: every word becomes a
+short tone whose pitch is derived from the word, with a pause after sentences.
+"""
+import array
+import hashlib
+import math
+import os
+import sys
+import time
+import wave
+from typing import Dict, List, Optional, Type
+
+from echoread.api_server import config
+
+
+class TTSEngine:
+    '''
+    Interface implemented by every engine. The class attributes describe the
+    default output, so callers can reason about it (e.g. cache keys) without
+    loading the model.
+    '''
+    name = "base"
+    model_version = "0"
+    sample_rate = 24000
+    voice = "default"
+
+    def __init__(self, sample_rate: Optional[int] = None, voice: Optional[str] = None):
+        self.sample_rate = sample_rate or self.sample_rate
+        self.voice = voice or self.voice
+
+    def synthesize(self, text: str) -> bytes:
+        raise NotImplementedError
+
+    def synthesize_batch(self, texts: List[str]) -> List[bytes]:
+        '''
+        Synthesize several sentences in one model call (see batching.py).
+        Model-backed engines pad the batch to its longest input and run a single
+        forward pass; the default just loops.
+        '''
+        return [self.synthesize(text) for text in texts]
+
+
+class LocalToneEngine(TTSEngine):
+    name = "local"
+    model_version = "local-tone-1"
+    sample_rate = 16000
+    TONES = 24 # Two octaves of semitones
+
+    def __init__(self, sample_rate: Optional[int] = None, voice: Optional[str] = None, word_seconds: float = 0.25,
+                 call_overhead: Optional[float] = None):
+        super().__init__(sample_rate=sample_rate, voice=voice)
+        self.word_seconds = word_seconds
+        # Simulated fixed cost per model call (seconds), to exercise batching without a real model
+        self.call_overhead = config.TTS_LOCAL_CALL_OVERHEAD if call_overhead is None else call_overhead
+        # Voices only shift the base pitch, which keeps output deterministic per (text, voice)
+        base_freq = 110.0 * 2 ** ((hashlib.sha256(self.voice.encode()).digest()[0] % 12) / 12)
+        self._tones = [self._render_tone(base_freq * 2 ** (i / 12)) for i in range(self.TONES)]
+        self._pause = bytes(2 * int(self.sample_rate * word_seconds))
+
+    def _render_tone(self, freq: float) -> bytes:
+        n = int(self.sample_rate * self.word_seconds)
+        step = 2 * math.pi * freq / self.sample_rate
+        samples = array.array("h", (int(6000 * math.sin(step * t)) for t in range(n)))
+        if sys.byteorder == "big":
+            samples.byteswap()
+        return samples.tobytes()
+
+    def synthesize(self, text: str) -> bytes:
+        if self.call_overhead:
+            time.sleep(self.call_overhead)
+        return self._render(text)
+
+    def synthesize_batch(self, texts: List[str]) -> List[bytes]:
+        if self.call_overhead:
+            time.sleep(self.call_overhead) # Paid once for the whole batch
+        return [self._render(text) for text in texts]
+
+    def _render(self, text: str) -> bytes:
+        parts = []
+        for word in text.split():
+            parts.append(self._tones[hashlib.md5(word.lower().encode()).digest()[0] % self.TONES])
+            if word[-1] in ".!?;:":
+                parts.append(self._pause)
+        return b"".join(parts)
+
+
+ENGINES = {
+    LocalToneEngine.name: LocalToneEngine,
+}
+
+_engine_cache: Dict[str, TTSEngine] = {}
+
+def engine_class(name: Optional[str] = None) -> Type[TTSEngine]:
+    name = name or config.TTS_ENGINE
+    if name not in ENGINES:
+        raise ValueError(f"Unknown TTS engine '{name}'. Available: {', '.join(sorted(ENGINES))}")
+    return ENGINES[name]
+
+def get_engine(name: Optional[str] = None) -> TTSEngine:
+    '''Return the (per-process) engine instance registered under `name`.'''
+    name = name or config.TTS_ENGINE
+    if name not in _engine_cache:
+        _engine_cache[name] = engine_class(name)()
+    return _engine_cache[name]
+
+
+def write_wav(path: str, pcm: bytes, sample_rate: int) -> float:
+    '''
+    Atomically write 16-bit mono PCM as a WAV file and return its duration in seconds.
+    Readers never see a partially written chapter: the file is renamed into place at the end.
+    '''
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    try:
+        with wave.open(tmp_path, "wb") as out:
+            out.setnchannels(1)
+            out.setsampwidth(2)
+            out.setframerate(sample_rate)
+            out.writeframes(pcm)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return len(pcm) / 2 / sample_rate
+
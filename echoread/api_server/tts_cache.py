@@ -0,0 +1,190 @@
+"""
+Content-addressed cache of synthesized audio.
+
+Entries are keyed by a hash of (normalized text, voice, model version, sample
+rate), so re-uploads and other editions with identical chapters reuse earlier
+output instead of running the model again. Blobs live under
+`<root>/<key[:2]>/<key>.wav` and are hard-linked into book directories when
+possible (no copy).
+
+The size bound (max_bytes) is on the disk the cache adds: blobs no book links
+to any more (st_nlink == 1, or copies made across filesystems). A blob still
+linked into a book costs nothing extra, and evicting it would free nothing, so
+it is kept. Processes sharing the directory (TTS workers on one host) each
+keep an index, so the whole directory is rescanned whenever this process'
+count goes over the bound, and at least every RESCAN_INTERVAL seconds while
+storing: entries stored elsewhere, books deleted since and evictions by other
+processes are then counted. Between rescans the bound can be exceeded by
+what other processes stored.
+
+Eviction is least recently used first. Recency is the mtime of an empty
+`<key>.used` file next to each blob, refreshed on every hit, so the order
+survives restarts and is shared (approximately) by worker processes on the
+same host. It is not the blob's own mtime: a blob is
+the same inode as the chapter files of every book it was linked into, and
+their mtime is part of the ETags and zip timestamps already handed out.
+"""
+import hashlib
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger("echoread.tts_cache")
+
+WHITESPACE = re.compile(r"\s+")
+RESCAN_INTERVAL = 60.0 # Seconds between rescans of the directory while storing
+
+
+def normalize_text(text: str) -> str:
+    # Editions often differ only in Unicode forms and whitespace, which don't change the speech
+    return WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def make_key(text: str, voice: str, model_version: str, sample_rate: int) -> str:
+    material = "\x1f".join([normalize_text(text), voice, model_version, str(sample_rate)])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _place(source: str, destination: str) -> None:
+    '''Hard-link `source` to `destination` (atomically replacing it), copying across filesystems.'''
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    tmp_path = f"{destination}.tmp.{os.getpid()}.{threading.get_ident()}"
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, destination)
+
+
+def _touch(path: str) -> None:
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        with open(path, "a"):
+            pass
+
+
+class SynthesisCache:
+    def __init__(self, root: str, max_bytes: int, rescan_interval: float = RESCAN_INTERVAL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.rescan_interval = rescan_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict() # key -> size, least recently used first
+        self._size = 0 # Bytes of blobs only the cache holds, as of the last scan plus stores since
+        self._scanned_at = 0.0
+        self._reindex(self._scan())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.wav")
+
+    def _used_path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.used")
+
+    def _scan(self) -> List[Tuple[str, int, bool]]:
+        '''(key, size, held only by the cache) of every blob in the directory, least recently used first.'''
+        found = []
+        if os.path.isdir(self.root):
+            for shard in os.scandir(self.root):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if not entry.name.endswith(".wav"):
+                        continue
+                    key = entry.name[:-4]
+                    try:
+                        blob = entry.stat()
+                    except FileNotFoundError: # Evicted by another process meanwhile
+                        continue
+                    try:
+                        used = os.stat(self._used_path(key)).st_mtime
+                    except FileNotFoundError: # Stored by an older version
+                        used = blob.st_mtime
+                    found.append((used, key, blob.st_size, blob.st_nlink == 1))
+        found.sort()
+        return [(key, size, exclusive) for _, key, size, exclusive in found]
+
+    def _reindex(self, blobs: List[Tuple[str, int, bool]]) -> None:
+        self._entries = OrderedDict((key, size) for key, size, _ in blobs)
+        self._size = sum(size for _, size, exclusive in blobs if exclusive)
+        self._scanned_at = time.monotonic()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def fetch(self, key: str, destination: str) -> bool:
+        '''On a hit, place the cached audio at `destination` and return True.'''
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False
+            self._entries.move_to_end(key)
+        path = self._path(key)
+        try:
+            _place(path, destination)
+            _touch(self._used_path(key)) # Refresh recency for other processes and restarts; never the blob
+        except FileNotFoundError: # Evicted by another process sharing the directory
+            with self._lock:
+                self._entries.pop(key, None) # Its bytes leave the count at the next scan
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key: str, source: str) -> None:
+        '''Add a freshly synthesized file to the cache, evicting old entries to stay under max_bytes.'''
+        size = os.path.getsize(source)
+        if size > self.max_bytes:
+            return
+        path = self._path(key)
+        _place(source, path)
+        _touch(self._used_path(key))
+        exclusive = os.stat(path).st_nlink == 1 # Copied rather than linked, or the source is already gone
+        victims = []
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = size
+            if exclusive:
+                self._size += size
+            if self._size > self.max_bytes or time.monotonic() - self._scanned_at >= self.rescan_interval:
+                blobs = self._scan() # Under the lock: a few stats per entry, once per interval or overflow
+                excess = sum(blob_size for _, blob_size, held in blobs if held) - self.max_bytes
+                for victim, victim_size, victim_exclusive in blobs: # Least recently used first
+                    if excess <= 0:
+                        break
+                    if victim_exclusive and victim != key:
+                        victims.append(victim)
+                        excess -= victim_size
+                evicted = set(victims)
+                self._reindex([blob for blob in blobs if blob[0] not in evicted])
+                self.evictions += len(victims)
+        for victim in victims:
+            for path in (self._path(victim), self._used_path(victim)):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._entries), "bytes": self._size}
+
+
+def cache_from_config() -> Optional[SynthesisCache]:
+    from echoread.api_server import config
+    if not config.TTS_CACHE_MAX_BYTES:
+        return None
+    return SynthesisCache(config.TTS_CACHE_DIR or os.path.join(config.STORAGE_ROOT, ".tts_cache"),
+                          config.TTS_CACHE_MAX_BYTES)
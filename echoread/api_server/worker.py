@@ -0,0 +1,290 @@
+"""
+TTS worker: claims synthesis jobs from the database queue (jobs.py) and renders
+chapters in a process pool, so model inference never runs inside an API worker.
+Sentences from all in-flight chapters are grouped into batched model calls by
+batching.BatchScheduler.
+
+Run one or more instances next to the API:
+
+    python -m echoread.api_server.worker --processes 4
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, wait
+from typing import Callable, Optional
+
+from prometheus_client import start_http_server
+from sqlalchemy.orm import Session
+
+from echoread.api_server import audio_probe, book_zip, config, jobs, metrics, models, segments, storage, tts, tts_cache
+from echoread.api_server.batching import BatchScheduler
+from echoread.api_server.epub import EpubError, EpubReader
+
+logger = logging.getLogger("echoread.worker")
+
+
+class Worker:
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        executor: Optional[Executor] = None,
+        engine_name: Optional[str] = None,
+        storage_root: Optional[str] = None,
+        processes: Optional[int] = None,
+        poll_interval: Optional[float] = None,
+        max_attempts: Optional[int] = None,
+        cache: Optional[tts_cache.SynthesisCache] = None,
+        concurrent_jobs: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        batch_wait: Optional[float] = None,
+        segment_seconds: Optional[float] = None,
+    ):
+        if session_factory is None:
+            from echoread.api_server.database import SessionLocal
+            session_factory = SessionLocal
+        self.session_factory = session_factory
+        processes = processes or config.TTS_WORKER_PROCESSES
+        self.executor = executor or ProcessPoolExecutor(max_workers=processes)
+        # Chapters parsed but not yet synthesized; bounds memory for very long books
+        self.max_in_flight = 2 * processes
+        self.engine_name = engine_name or config.TTS_ENGINE
+        # Sentences of every chapter of every in-flight book share model calls
+        self.scheduler = BatchScheduler(
+            self.executor,
+            self.engine_name,
+            max_batch_size=batch_size or config.TTS_BATCH_MAX_SIZE,
+            max_wait=batch_wait if batch_wait is not None else config.TTS_BATCH_MAX_WAIT_MS / 1000,
+            max_in_flight=processes,
+        )
+        self.concurrent_jobs = concurrent_jobs or config.TTS_WORKER_JOBS
+        self.storage_root = storage_root or config.STORAGE_ROOT
+        self.poll_interval = poll_interval if poll_interval is not None else config.TTS_POLL_INTERVAL
+        self.max_attempts = max_attempts or config.TTS_JOB_MAX_ATTEMPTS
+        self.cache = cache if cache is not None else tts_cache.cache_from_config()
+        self.segment_seconds = segment_seconds if segment_seconds is not None else config.TTS_SEGMENT_SECONDS
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._stopping = False
+        self._stopped = threading.Event()
+        self._running_jobs = set() # Ids of the jobs this worker is processing, for heartbeats
+        self._running_lock = threading.Lock()
+
+    def stop(self, *_):
+        '''Finish the current job, then exit run_forever.'''
+        self._stopping = True
+        self._stopped.set()
+
+    def run_forever(self) -> None:
+        self.heartbeat() # Sweeps jobs left behind by a worker that died, before claiming any
+        logger.info("Worker %s started (engine=%s, concurrent jobs=%d)",
+                    self.worker_id, self.engine_name, self.concurrent_jobs)
+        # Several books in flight at once, so the batcher has sentences from all of them to group
+        threads = [threading.Thread(target=self._job_loop, name=f"tts-job-{i}") for i in range(self.concurrent_jobs)]
+        threads.append(threading.Thread(target=self._heartbeat_loop, name="tts-heartbeat"))
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive(): # Short joins keep the main thread responsive to signals
+                    thread.join(0.5)
+        finally:
+            self.scheduler.close()
+            self.executor.shutdown(wait=True)
+        logger.info("Worker %s stopped", self.worker_id)
+
+    def heartbeat(self) -> None:
+        '''Refresh the heartbeat of this worker's jobs, then requeue other workers' jobs that have none.'''
+        with self._running_lock:
+            running = list(self._running_jobs)
+        with self.session_factory() as db:
+            jobs.heartbeat(db, running, self.worker_id)
+            requeued = jobs.requeue_stale_jobs(db, config.TTS_JOB_TIMEOUT)
+            if requeued:
+                logger.warning("Requeued %d stale job(s)", requeued)
+
+    def _heartbeat_loop(self) -> None:
+        # Chapters can take minutes to synthesize: beat on a timer, not only when one is committed
+        while not self._stopped.wait(config.TTS_JOB_HEARTBEAT_INTERVAL):
+            try:
+                self.heartbeat()
+            except Exception:
+                logger.exception("Job heartbeat failed")
+
+    def _job_loop(self) -> None:
+        while not self._stopping:
+            try:
+                if not self.run_once():
+                    time.sleep(self.poll_interval)
+            except Exception:
+                logger.exception("Worker loop error")
+                time.sleep(self.poll_interval)
+
+    def run_once(self) -> bool:
+        '''Process at most one job. Returns False when the queue was empty.'''
+        with self.session_factory() as db:
+            job = jobs.claim_next_job(db, self.worker_id)
+            if job is None:
+                return False
+            self.process_job(db, job)
+            return True
+
+    def process_job(self, db: Session, job: models.Job) -> None:
+        job_id = job.id # The row may be gone by the end (book deleted mid-job)
+        with self._running_lock:
+            self._running_jobs.add(job_id)
+        try:
+            self._process_job(db, job)
+        finally:
+            with self._running_lock:
+                self._running_jobs.discard(job_id)
+
+    def _process_job(self, db: Session, job: models.Job) -> None:
+        book = job.book
+        logger.info("Job %s: synthesizing book %s (attempt %d)", job.id, book.id, job.attempts)
+        book.status = "processing"
+        db.commit()
+
+        job_id, book_id, user_id = job.id, book.id, book.user_id # Still known if the book is deleted mid-job
+        out_dir = storage.book_dir(user_id, book_id, self.storage_root)
+        started = time.monotonic()
+        engine = tts.engine_class(self.engine_name) # Class attributes only; the model lives in the pool processes
+        pending = {} # future -> (chapter_index, audio_path, cache_key, submitted_at)
+        errors = []
+        chapter_count = 0
+        try:
+            if not book.epub_path:
+                raise FileNotFoundError(f"Book {book.id} has no stored EPUB")
+            # Chapters committed by an earlier attempt are already playable: don't redo them
+            finished = {index for (index,) in db.query(models.Audio.chapter_index).filter(models.Audio.book_id == book.id)}
+            # Chapters are parsed lazily and submitted as soon as each one is read,
+            # so synthesis of chapter 1 starts while the rest of the book is still unread.
+            with EpubReader(book.epub_path) as reader:
+                for chapter in reader.iter_chapters():
+                    chapter_count = chapter.index
+                    if chapter.index in finished:
+                        continue
+                    path = os.path.join(out_dir, f"chapter_{chapter.index}.wav")
+                    key = None
+                    if self.cache is not None:
+                        # Identical text was synthesized before (re-upload, other edition): skip the model
+                        key = tts_cache.make_key(chapter.text, engine.voice, engine.model_version, engine.sample_rate)
+                        if self.cache.fetch(key, path):
+                            self._commit_chapter(db, job, chapter.index, path)
+                            continue
+                    future = self.scheduler.synthesize_chapter(chapter.sentences, path)
+                    pending[future] = (chapter.index, path, key, time.monotonic())
+                    if len(pending) >= self.max_in_flight:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        self._record_chapters(db, job, done, pending, errors)
+            self._record_chapters(db, job, wait(pending).done, pending, errors)
+            if errors:
+                raise errors[0]
+        except Exception as exc:
+            for future in pending:
+                future.cancel()
+            db.rollback()
+            if db.query(models.Book.id).filter(models.Book.id == book_id).first() is None:
+                # Deleted while being synthesized; its job went with it (ON DELETE CASCADE). Chapters
+                # written after DELETE /books/{id} trashed the directory are trashed as well.
+                wait(pending)
+                storage.trash_book(user_id, book_id, storage_root=self.storage_root)
+                logger.info("Job %s: book %s was deleted, job dropped", job_id, book_id)
+                return
+            logger.exception("Job %s failed", job.id)
+            # A malformed EPUB will not parse on a retry either
+            max_attempts = job.attempts if isinstance(exc, (EpubError, FileNotFoundError)) else self.max_attempts
+            requeued = jobs.fail_job(db, job, repr(exc), max_attempts)
+            book.status = "pending" if requeued else "error"
+            db.commit()
+            return
+
+        book.status = "complete"
+        book.chapter_count = chapter_count
+        jobs.complete_job(db, job)
+        db.commit()
+        logger.info("Job %s: %d chapters in %.1fs", job.id, chapter_count, time.monotonic() - started)
+        if self.cache is not None:
+            logger.info("TTS cache: %s", self.cache.stats())
+
+    def _record_chapters(self, db: Session, job: models.Job, done, pending: dict, errors: list) -> None:
+        for future in done:
+            index, path, key, submitted_at = pending.pop(future)
+            try:
+                future.result()
+            except Exception as exc:
+                errors.append(exc)
+                continue
+            metrics.CHAPTER_SYNTHESIS_SECONDS.observe(time.monotonic() - submitted_at)
+            if key is not None:
+                self.cache.store(key, path)
+            self._commit_chapter(db, job, index, path)
+
+    def _commit_chapter(self, db: Session, job: models.Job, index: int, path: str) -> None:
+        '''Commit the Audio row of a finished chapter, making it playable right away.'''
+        # Duration of the file as written, whatever the engine's output format (header only, no decoding)
+        duration = audio_probe.probe_duration(path)
+        # Read once here, while the file is still in the page cache, rather than before every download's first byte
+        crc32 = book_zip.compute_crc32(path)
+        if self.segment_seconds > 0:
+            segments.package_chapter(path, self.segment_seconds) # Before the chapter becomes visible
+        audio_id = str(uuid.uuid4())
+        db.add(models.Audio(
+            id=audio_id,
+            book_id=job.book_id,
+            chapter_index=index,
+            audio_path=path,
+            url=f"/books/{job.book_id}/audios/{audio_id}", # API path to access this audio
+            duration=duration,
+            crc32=crc32,
+        ))
+        # Same transaction as the Audio row, so the counter always matches the playable chapters
+        db.query(models.Book).filter(models.Book.id == job.book_id).update(
+            {models.Book.processed_chapters: models.Book.processed_chapters + 1, models.Book.version: models.Book.version + 1},
+            synchronize_session=False
+        )
+        job.heartbeat_at = datetime.utcnow()
+        first_chapter_wait = None
+        if job.first_chapter_at is None:
+            # Time-to-first-playable-chapter: how long a listener waited after uploading
+            job.first_chapter_at = datetime.utcnow()
+            first_chapter_wait = (job.first_chapter_at - job.created_at).total_seconds()
+        db.commit()
+        if first_chapter_wait is not None: # Once it is actually playable
+            metrics.FIRST_CHAPTER_SECONDS.observe(first_chapter_wait)
+            logger.info("Job %s: first chapter playable %.1fs after upload", job.id, first_chapter_wait)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EchoRead TTS worker")
+    parser.add_argument("--processes", type=int, default=config.TTS_WORKER_PROCESSES, help="Synthesis processes")
+    parser.add_argument("--poll-interval", type=float, default=config.TTS_POLL_INTERVAL)
+    parser.add_argument("--jobs", type=int, default=config.TTS_WORKER_JOBS, help="Books processed concurrently")
+    parser.add_argument("--batch-size", type=int, default=config.TTS_BATCH_MAX_SIZE, help="Max sentences per model call")
+    parser.add_argument("--batch-wait-ms", type=float, default=config.TTS_BATCH_MAX_WAIT_MS,
+                        help="Max time a sentence waits for its batch to fill")
+    parser.add_argument("--segment-seconds", type=float, default=config.TTS_SEGMENT_SECONDS,
+                        help="Also package chapters as segments of this length plus a playlist (0: off)")
+    parser.add_argument("--metrics-port", type=int, default=config.TTS_WORKER_METRICS_PORT,
+                        help="Serve this worker's Prometheus metrics on this port (0: off)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
+    if args.metrics_port:
+        # Synthesis times and the worker's own process metrics; queue depth is served by the API's /metrics
+        start_http_server(args.metrics_port)
+    worker = Worker(processes=args.processes, poll_interval=args.poll_interval, concurrent_jobs=args.jobs,
+                    batch_size=args.batch_size, batch_wait=args.batch_wait_ms / 1000,
+                    segment_seconds=args.segment_seconds)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run_forever()
+
+
+if __name__ == "__main__":
+    main()